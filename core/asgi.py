@@ -9,8 +9,30 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Every request runs on a thread of its own, see `PerRequestThreads`,
+# and connections belong to threads, so they can't be kept open for
+# later requests
+os.environ.setdefault('DATABASE_CONN_MAX_AGE', '0')
 
-application = get_asgi_application()
+# Like `get_asgi_application()`, with a handler streaming responses
+# safely, see `StreamingASGIHandler`
+django.setup(set_prefix=False)
+
+# The imports have to wait until Django is set up
+# pylint: disable=wrong-import-position
+from simple_sis.asynchronous import PerRequestThreads, StreamingASGIHandler
+from simple_sis.live import LiveEvents
+from simple_sis.lookups import lookup_codes
+from simple_sis.spatial import venue_index
+
+# Give the synchronous work of every request, e.g. its queries, a thread
+# of its own rather than one thread shared by all requests, and stream
+# live attendance ahead of Django, without holding a thread per stream
+application = LiveEvents(PerRequestThreads(StreamingASGIHandler()))
+
+# Warm process-wide caches before serving the first request
+lookup_codes.warm()
+venue_index.warm()
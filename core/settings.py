@@ -58,11 +58,14 @@ INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 # Middleware
 
 MIDDLEWARE = [
+    # Sends reads to replicas, see `simple_sis.databases`
+    'simple_sis.databases.ReplicaReadsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Loads the user from the cache, see `simple_sis.authentication`
+    'simple_sis.authentication.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -101,9 +104,95 @@ DATABASES = {
             'PORT': os.environ.get('DATABASE_PORT'),
             'USER': os.environ.get('DATABASE_USER'),
             'PASSWORD': os.environ.get('DATABASE_PASS'),
+            # Seconds connections are kept open for between requests,
+            # rather than connecting for every request. Served over
+            # ASGI, every request has connections of its own, see
+            # `core.asgi`.
+            'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+            # Connections kept open are checked before they're reused,
+            # see `simple_sis.databases`
+            'CONN_HEALTH_CHECKS': True,
         }
 }
 
+# Allow swapping MySQL for SQLite, e.g. to run the test suite locally
+# without access to a MySQL server
+if os.environ.get('DATABASE_ENGINE') == 'sqlite':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+    }
+
+# Read replicas of the database, as a comma separated list of their
+# hosts, or of their files for SQLite. Reads of requests go to replicas
+# where they can, see `simple_sis.databases`. Under test, replicas are
+# mirrors of the test database.
+REPLICA_DATABASES = []
+replica_setting = (
+    'NAME' if DATABASES['default']['ENGINE'].endswith('sqlite3') else 'HOST'
+)
+for number, replica in enumerate(
+    filter(None, os.environ.get('DATABASE_REPLICAS', '').split(',')), 1
+):
+    alias = f'replica_{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        replica_setting: replica.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['simple_sis.databases.PrimaryReplicaRouter']
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+#
+# Process-wide caches, e.g. of lookup codes, use the default cache to
+# propagate changes between processes, so when running several worker
+# processes it has to be a shared cache, e.g. file based or memcached
+
+CACHES = {
+    'default':
+        {
+            'BACKEND':
+                os.environ.get(
+                    'CACHE_BACKEND',
+                    'django.core.cache.backends.locmem.LocMemCache',
+                ),
+            'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+        },
+    # Rendered template fragments, keyed by the version of the objects
+    # they show, see `simple_sis.fragments`
+    'template_fragments':
+        {
+            'BACKEND':
+                os.environ.get(
+                    'FRAGMENT_CACHE_BACKEND',
+                    'django.core.cache.backends.locmem.LocMemCache',
+                ),
+            'LOCATION':
+                os.environ.get('FRAGMENT_CACHE_LOCATION', 'fragments'),
+            'OPTIONS': {
+                'MAX_ENTRIES':
+                    int(os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 10000)),
+            },
+        },
+}
+
+# Request header holding the IP of clients, e.g. to throttle failed
+# logins by IP. Behind a proxy, a header the proxy sets rather than
+# passes on from clients, e.g. HTTP_X_REAL_IP, or HTTP_X_FORWARDED_FOR
+# along with the number of proxies appending to it.
+
+CLIENT_IP_HEADER = os.environ.get('CLIENT_IP_HEADER', 'REMOTE_ADDR')
+CLIENT_IP_PROXY_COUNT = int(os.environ.get('CLIENT_IP_PROXY_COUNT', 1))
+
+# Sessions are kept in the default cache, falling back to the database,
+# and so are snapshots of the logged in users, see
+# `simple_sis.authentication`
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
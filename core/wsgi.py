@@ -14,3 +14,12 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_wsgi_application()
+
+# Warm process-wide caches before serving the first request, the
+# imports have to wait until Django is set up
+# pylint: disable=wrong-import-position
+from simple_sis.lookups import lookup_codes
+from simple_sis.spatial import venue_index
+
+lookup_codes.warm()
+venue_index.warm()
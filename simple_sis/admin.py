@@ -1,55 +1,180 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
 from simple_sis.models import (
     User,
     UserAccountType,
     School,
     Activity,
+    ActivityAttendee,
     Location,
     Venue,
     LookupCode,
     LookupCodeType,
 )
 
-
-class UserAdmin(admin.ModelAdmin):
-    pass
+# Tables estimated to hold fewer rows are counted exactly
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+def estimated_count(queryset):
+    """Number of rows of the table of a queryset as estimated by the
+    statistics of the database, or None if it keeps none.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'mysql':
+        # SQLite counts rows quickly enough
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT TABLE_ROWS FROM information_schema.TABLES '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+            [queryset.model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    return row and row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator estimating the count of unfiltered changelists of
+    large tables, as InnoDB counts rows by reading every one of them.
+    Filtered changelists are still counted exactly.
+    """
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            estimate = estimated_count(self.object_list)
+            if estimate is not None and estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class TrackedModelAdmin(admin.ModelAdmin):
+    """Admin of models tracking who created and updated them, scaled
+    for large tables: users and other related objects are picked by
+    search rather than from a list of all of them, and changelists
+    skip counting every row.
+    """
+    autocomplete_fields = ('created_by', 'updated_by')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # By an index, so that neither changelists nor the results of an
+    # empty search sort the whole table
+    ordering = ('-id', )
+
+
+class UserAdmin(TrackedModelAdmin):
+    list_display = (
+        '__str__',
+        'first_name',
+        'last_name',
+        'school',
+        'account_type',
+        'is_active',
+    )
+    list_select_related = ('school', 'account_type')
+    ordering = ('email', )
+    # Prefixes, which MySQL finds by the indexes of the fields, as its
+    # collations ignore case, while searching within values reads every
+    # row. The fields searched of the other large tables, activities and
+    # locations, are indexed too, the rest are small.
+    search_fields = ('^email', '^first_name', '^last_name')
+    autocomplete_fields = (
+        *TrackedModelAdmin.autocomplete_fields,
+        'school',
+        'account_type',
+    )
 
 
-class UserAccountTypeAdmin(admin.ModelAdmin):
-    pass
+class UserAccountTypeAdmin(TrackedModelAdmin):
+    search_fields = ('^name', )
 
 
-class SchoolAdmin(admin.ModelAdmin):
+class SchoolAdmin(TrackedModelAdmin):
     list_display = (
         '__str__',
         'location',
     )
+    list_select_related = ('location', )
+    search_fields = ('^name', )
+    autocomplete_fields = (*TrackedModelAdmin.autocomplete_fields, 'location')
+
+
+class ActivityAdmin(TrackedModelAdmin):
+    list_display = (
+        '__str__',
+        'school',
+        'start_date',
+    )
+    list_select_related = ('school', )
+    search_fields = ('^name', )
+    autocomplete_fields = (
+        *TrackedModelAdmin.autocomplete_fields,
+        'school',
+        'category',
+        'venue',
+    )
+
+
+class ActivityAttendeeAdmin(TrackedModelAdmin):
+    list_display = (
+        'user',
+        'activity',
+        'is_organiser',
+        'approved_at',
+        'attended_at',
+    )
+    list_select_related = ('user', 'activity')
+    list_filter = ('is_organiser', )
+    list_per_page = 50
+    autocomplete_fields = (
+        *TrackedModelAdmin.autocomplete_fields,
+        'user',
+        'activity',
+        'attendee_type',
+        'approved_by',
+    )
+    actions = ('approve', 'mark_attended')
 
+    @admin.action(description='Approve selected attendees')
+    def approve(self, request, queryset):
+        updated = queryset.approve(request.user)
+        self.message_user(request, f'Approved {updated} attendees.')
 
-class ActivityAdmin(admin.ModelAdmin):
-    pass
+    @admin.action(description='Mark selected attendees as attended')
+    def mark_attended(self, request, queryset):
+        updated = queryset.mark_attended(request.user)
+        self.message_user(request, f'Marked {updated} attendees as attended.')
 
 
-class LocationAdmin(admin.ModelAdmin):
-    pass
+class LocationAdmin(TrackedModelAdmin):
+    search_fields = ('^display_address', '^postcode')
 
 
-class VenueAdmin(admin.ModelAdmin):
+class VenueAdmin(TrackedModelAdmin):
     list_display = (
         '__str__',
         'location',
     )
+    list_select_related = ('location', )
+    search_fields = ('^name', )
+    autocomplete_fields = (*TrackedModelAdmin.autocomplete_fields, 'location')
 
 
-class LookupCodeAdmin(admin.ModelAdmin):
+class LookupCodeAdmin(TrackedModelAdmin):
     list_display = (
         '__str__',
         'type',
     )
+    list_select_related = ('type', )
+    search_fields = ('^name', '^code')
+    autocomplete_fields = (*TrackedModelAdmin.autocomplete_fields, 'type')
 
 
-class LookupCodeTypeAdmin(admin.ModelAdmin):
-    pass
+class LookupCodeTypeAdmin(TrackedModelAdmin):
+    search_fields = ('^code', )
 
 
 # Set header
@@ -60,6 +185,7 @@ admin.site.register(User, UserAdmin)
 admin.site.register(UserAccountType, UserAccountTypeAdmin)
 admin.site.register(School, SchoolAdmin)
 admin.site.register(Activity, ActivityAdmin)
+admin.site.register(ActivityAttendee, ActivityAttendeeAdmin)
 admin.site.register(Venue, VenueAdmin)
 admin.site.register(Location, LocationAdmin)
 admin.site.register(LookupCode, LookupCodeAdmin)
@@ -0,0 +1,142 @@
+"""Async JSON API of activities and their attendees, e.g. for apps
+which'd rather not scrape the pages.
+
+Endpoints are scoped to the school of the logged in user and page
+through listings with the same keyset cursors as the pages, i.e. the
+`next` cursor of a page is passed as `after` to fetch the page after
+it. Every endpoint costs the same few queries whatever the page.
+"""
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.db.models import Exists, OuterRef
+from django.http import Http404, JsonResponse
+
+from .asynchronous import async_login_required
+from .counters import COUNTER_FIELDS
+from .exports import lookup_name
+from .models import Activity
+from .pagination import paginate
+from .rosters import ROSTER_SECTIONS, ROSTER_STATUSES, roster_page
+from .views import ACTIVITY_LISTINGS, listed_activities
+
+
+def activity_json(activity):
+    """An activity of `Activity.objects.for_listing()` as JSON."""
+    return {
+        'id': activity.id,
+        'name': activity.name,
+        'category': lookup_name(activity.category_id),
+        'start_date': activity.start_date,
+        'venue': {
+            'id': activity.venue_id,
+            'name': activity.venue.name,
+            'address': activity.venue_address,
+        },
+        'distance_km': round(activity.distance_from_school / 1000, 1),
+        'counts': {
+            field: getattr(activity, field)
+            for field in COUNTER_FIELDS
+        },
+    }
+
+
+def attendee_json(attendee, email=False):
+    """An attendee as JSON, with the email of the user if `email`."""
+    json = {
+        'id': attendee.id,
+        'user': attendee.user_id,
+        'first_name': attendee.user.first_name,
+        'last_name': attendee.user.last_name,
+        'role': lookup_name(attendee.attendee_type_id),
+        'is_organiser': attendee.is_organiser,
+        'approved_at': attendee.approved_at,
+        'attended_at': attendee.attended_at,
+    }
+    if email:
+        json['email'] = attendee.user.email
+    return json
+
+
+def page_json(page, key, item_json):
+    return {
+        key: [item_json(item) for item in page],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }
+
+
+def load_activities(request):
+    activities, when, _ = listed_activities(request)
+    page = paginate(
+        activities.for_listing(),
+        ACTIVITY_LISTINGS[when],
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+    return page_json(page, 'activities', activity_json)
+
+
+def load_activity(request, id):
+    try:
+        activity = Activity.objects.for_listing().get(
+            school_id=request.user.school_id, id=id
+        )
+    except Activity.DoesNotExist:
+        raise Http404("Activity does not exist")
+    return {
+        **activity_json(activity),
+        'description': activity.description,
+        'updated_date': activity.updated_date,
+    }
+
+
+def load_attendees(request, id, section):
+    # Whether the activity exists, and if so whether the user manages it
+    managed = Activity.objects.filter(
+        school_id=request.user.school_id, id=id
+    ).values_list(
+        Exists(
+            Activity.objects.managed_by(request.user).filter(id=OuterRef('id'))
+        ),
+        flat=True,
+    ).first()
+    if managed is None:
+        raise Http404("Activity does not exist")
+    status = request.GET.get('status')
+    page = roster_page(
+        id,
+        section,
+        status=status if status in ROSTER_STATUSES else None,
+        search=request.GET.get('q', '').strip(),
+        after=request.GET.get('after'),
+    )
+    return page_json(page, 'attendees', partial(attendee_json, email=managed))
+
+
+@async_login_required
+async def activities(request):
+    """List the activities of the user's school, filtered by `when` and
+    `category` like the home page.
+    """
+    return JsonResponse(await sync_to_async(load_activities)(request))
+
+
+@async_login_required
+async def activity(request, id):
+    return JsonResponse(await sync_to_async(load_activity)(request, id))
+
+
+@async_login_required
+async def attendees(request, id):
+    """List the attendees of an activity, either the `organisers` or the
+    `participants` (by default) given by `section`, optionally filtered
+    by `status` and a `q` search like the roster of the activity page.
+    Their emails are only listed to those managing the activity.
+    """
+    section = request.GET.get('section', 'participants')
+    if section not in ROSTER_SECTIONS:
+        return JsonResponse({'error': 'Invalid section'}, status=400)
+    return JsonResponse(
+        await sync_to_async(load_attendees)(request, id, section)
+    )
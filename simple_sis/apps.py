@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SimpleSisConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'simple_sis'
+
+    def ready(self):
+        # Connect signal handlers
+        from . import signals  # pylint: disable=unused-import
@@ -0,0 +1,113 @@
+"""Support of async views.
+
+Django 3.2 has no async ORM, so async views still run their queries,
+and anything else touching the database or the cache, like loading the
+session and the user or rendering templates, through `sync_to_async()`.
+Views keep that to a single hop per request where they can, as every
+hop hands the work over to a thread and back.
+
+Served over ASGI, Django 3.2 runs all such synchronous work, including
+sync views and middleware, on one thread shared by the whole process,
+so that requests queue up behind each other. `PerRequestThreads` gives
+every request a thread of its own instead, like later Django versions
+do, which `core.asgi` wraps the application in.
+
+Django 3.2 also iterates streamed responses, e.g. exports fetching
+their rows chunk by chunk, in the event loop, where queries aren't
+allowed. `StreamingASGIHandler` fetches every part of them on the
+thread of their request instead.
+"""
+from functools import wraps
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connections
+
+
+class PerRequestThreads:
+    """ASGI middleware running the synchronous work of every request,
+    e.g. its queries, on a thread of its own.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        async with ThreadSensitiveContext():
+            return await self.app(scope, receive, send)
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """ASGI handler fetching the parts of streamed responses on the
+    thread of their request, see module docs.
+    """
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        headers = [
+            (header.encode('ascii'), value.encode('latin1'))
+            for header, value in response.items()
+        ]
+        headers += [
+            (b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+            for cookie in response.cookies.values()
+        ]
+        await send(
+            {
+                'type': 'http.response.start',
+                'status': response.status_code,
+                'headers': headers,
+            }
+        )
+        parts = iter(response)
+        next_part = sync_to_async(next, thread_sensitive=True)
+        end = object()
+        while True:
+            part = await next_part(parts, end)
+            if part is end:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send(
+                    {
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    }
+                )
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+async def run_detached(func, *args):
+    """Run `func(*args)` on a thread of its own outside of any request,
+    e.g. for work of long-lived streams, closing the database
+    connections it opened, as the request signals closing them
+    otherwise aren't sent.
+    """
+    def run():
+        try:
+            return func(*args)
+        finally:
+            connections.close_all()
+
+    async with ThreadSensitiveContext():
+        return await sync_to_async(run)()
+
+
+def is_authenticated(request):
+    """Whether the user of a request is logged in, which loads the
+    session and the user.
+    """
+    return request.user.is_authenticated
+
+
+def async_login_required(view):
+    """`login_required()` for async views."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not await sync_to_async(is_authenticated)(request):
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+
+    return wrapper
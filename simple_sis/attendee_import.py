@@ -0,0 +1,195 @@
+"""Bulk import of activity attendees from CSV files.
+
+A file lists one attendee per row, by the email of the user and the
+role (attendee type) they attend as, given by its code or name. An
+optional `organiser` column marks organisers, e.g.
+
+    email,role,organiser
+    jane@example.com,Student,
+    john@example.com,ATTENDEE_STAFF,yes
+
+Rows are read as a stream and processed in chunks. The users of a
+chunk are resolved by a single query, roles through the lookup code
+cache, and the new attendees are written by batched inserts, so that
+memory use stays flat and the number of queries grows with the number
+of chunks rather than rows. The whole file is imported in a single
+transaction, but invalid rows are merely reported and skipped, while
+users who already attend the activity are skipped silently. Should a
+concurrent import add some of the same users meanwhile, the chunk is
+inserted row by row instead, skipping those users.
+"""
+import csv
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .lookups import lookup_codes
+from .models import ActivityAttendee, LookupCodeType, User
+
+IMPORT_CHUNK_SIZE = 2000
+
+# Only the first errors are kept, the rest are just counted
+MAX_REPORTED_ERRORS = 1000
+
+REQUIRED_COLUMNS = ('email', 'role')
+
+# Values of the `organiser` column marking organisers
+TRUE_VALUES = {'1', 'y', 'yes', 'true', 'x'}
+
+
+class AttendeeImport:
+    """Imports attendees of an activity from the rows of a CSV file.
+
+    `lines` can be any iterable of lines of text, e.g. an open file, so
+    that the file is never held in memory as a whole.
+    """
+    def __init__(
+        self,
+        activity_id,
+        imported_by=None,
+        chunk_size=IMPORT_CHUNK_SIZE,
+    ):
+        self.activity_id = activity_id
+        self.imported_by_id = imported_by and imported_by.id
+        self.chunk_size = chunk_size
+        self.now = timezone.now()
+        self.imported = 0
+        self.skipped = 0
+        self.error_count = 0
+        self.errors = []  # (line number, message) tuples
+        self.roles = {}
+        for code in lookup_codes.of_type(
+            LookupCodeType.ACTIVITY_ATTENDEE_TYPE
+        ):
+            self.roles[code.code.lower()] = code.id
+            self.roles[code.name.lower()] = code.id
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def run(self, lines):
+        """Import the rows of a CSV file and return self, holding the
+        counts and errors.
+        """
+        reader = csv.DictReader(lines)
+        columns = [name.strip().lower() for name in reader.fieldnames or []]
+        missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+        if missing:
+            self.error(1, f'Missing columns: {", ".join(missing)}')
+            return self
+        reader.fieldnames = columns
+
+        rows = self.iter_rows(reader)
+        with transaction.atomic():
+            while True:
+                chunk = list(islice(rows, self.chunk_size))
+                if not chunk:
+                    break
+                self.import_chunk(chunk)
+        return self
+
+    def iter_rows(self, reader):
+        """Yield `(line number, email, role id, is organiser)` of every
+        valid row, reporting the invalid ones.
+        """
+        for row in reader:
+            line = reader.line_num
+            email = (row['email'] or '').strip()
+            role = (row['role'] or '').strip()
+            if not email:
+                self.error(line, 'Missing email')
+                continue
+            role_id = self.roles.get(role.lower())
+            if role_id is None:
+                self.error(line, f'Unknown role "{role}"')
+                continue
+            organiser = (row.get('organiser') or '').strip().lower()
+            yield line, email, role_id, organiser in TRUE_VALUES
+
+    def import_chunk(self, rows):
+        # Emails are matched regardless of case, like MySQL compares
+        # them. Their lowercase forms are queried too, for databases
+        # comparing them as is, e.g. SQLite.
+        emails = {email for _, email, _, _ in rows}
+        users = {
+            email.lower(): id
+            for email, id in User.objects.filter(
+                email__in=emails | {email.lower() for email in emails}
+            ).values_list('email', 'id')
+        }
+        # Covers attendees imported from earlier chunks too, as they're
+        # written within the same transaction
+        enrolled = set(
+            ActivityAttendee.objects.filter(
+                activity_id=self.activity_id,
+                user_id__in=users.values(),
+            ).values_list('user_id', flat=True)
+        )
+
+        attendees = []
+        lines = []
+        for line, email, role_id, is_organiser in rows:
+            user_id = users.get(email.lower())
+            if user_id is None:
+                self.error(line, f'Unknown user "{email}"')
+                continue
+            if user_id in enrolled:
+                self.skipped += 1
+                continue
+            enrolled.add(user_id)
+            attendees.append(
+                ActivityAttendee(
+                    activity_id=self.activity_id,
+                    user_id=user_id,
+                    attendee_type_id=role_id,
+                    is_organiser=is_organiser,
+                    created_by_id=self.imported_by_id,
+                    created_date=self.now,
+                    updated_by_id=self.imported_by_id,
+                    updated_date=self.now,
+                )
+            )
+            lines.append(line)
+
+        try:
+            with transaction.atomic():
+                ActivityAttendee.objects.bulk_create(
+                    attendees, batch_size=self.chunk_size
+                )
+        except IntegrityError:
+            # Users were added by someone else since they were looked up
+            self.insert_rows(lines, attendees)
+        else:
+            self.imported += len(attendees)
+
+    def insert_rows(self, lines, attendees):
+        """Insert `attendees` one at a time, skipping the users who
+        attend the activity already.
+        """
+        for line, attendee in zip(lines, attendees):
+            try:
+                with transaction.atomic():
+                    ActivityAttendee.objects.bulk_create([attendee])
+            except IntegrityError:
+                if ActivityAttendee.objects.filter(
+                    activity_id=self.activity_id, user_id=attendee.user_id
+                ).exists():
+                    self.skipped += 1
+                else:
+                    self.error(line, 'Could not add the user')
+            else:
+                self.imported += 1
+
+    def as_dict(self):
+        return {
+            'imported': self.imported,
+            'skipped': self.skipped,
+            'error_count': self.error_count,
+            'errors': [
+                {'line': line, 'error': message}
+                for line, message in self.errors
+            ],
+        }
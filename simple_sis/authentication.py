@@ -0,0 +1,122 @@
+"""Loading of the logged in user from the cache.
+
+Sessions are kept in the cache, see `SESSION_ENGINE`, and the user of
+a session is loaded from a snapshot in the (default) cache too, so that
+most requests start without any query at all, where loading the
+session and the user took two queries otherwise.
+
+A snapshot holds the fields requests read off the user and its school,
+everything else is deferred and loaded on access. It also holds the
+session auth hash of the user, which is derived from the password, so
+that sessions are verified against it like Django does, and a changed
+password logs the user's other sessions out right away. Snapshots are
+dropped when the user or their school is saved, see `signals`, while
+plain `update()` calls have to call `forget_users()` themselves.
+
+Like the sessions, snapshots have to be in a cache shared by all
+processes once there are several of them.
+"""
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+from .models import School, User
+
+# Seconds snapshots are kept for, which bounds how long a snapshot
+# loaded just before a change may outlive it
+USER_CACHE_TIMEOUT = 300
+
+# Fields of users and schools kept in snapshots
+USER_FIELDS = (
+    'id',
+    'email',
+    'first_name',
+    'last_name',
+    'school_id',
+    'account_type_id',
+    'is_staff',
+    'is_active',
+    'is_superuser',
+    'last_login',
+    'updated_date',
+)
+SCHOOL_FIELDS = ('id', 'name', 'location_id', 'updated_date')
+
+
+def user_key(user_id):
+    return f'simple_sis:user:{user_id}'
+
+
+def take_snapshot(user):
+    school = user.school
+    return {
+        'user': {field: getattr(user, field) for field in USER_FIELDS},
+        'school': school and {
+            field: getattr(school, field) for field in SCHOOL_FIELDS
+        },
+        'session_auth_hash': user.get_session_auth_hash(),
+    }
+
+
+def load(model, values):
+    """An instance of `model` with the given field values, leaving the
+    other fields deferred.
+    """
+    # Values are passed in the order of the fields of the model
+    fields = [
+        field.attname for field in model._meta.concrete_fields
+        if field.attname in values
+    ]
+    return model.from_db(
+        model.objects.db, fields, [values[field] for field in fields]
+    )
+
+
+def from_snapshot(snapshot):
+    user = load(User, snapshot['user'])
+    if snapshot['school']:
+        user.school = load(School, snapshot['school'])
+    return user
+
+
+def get_user(request):
+    """The user logged in with the session of a request, like
+    `django.contrib.auth.get_user()`, from a snapshot if there's one.
+    """
+    session = request.session
+    user_id = session.get(auth.SESSION_KEY)
+    session_hash = session.get(HASH_SESSION_KEY)
+    if user_id is None or session_hash is None:
+        return auth.get_user(request)
+
+    backend = session.get(BACKEND_SESSION_KEY)
+    snapshot = cache.get(user_key(user_id))
+    if (
+        snapshot is not None and
+        backend in settings.AUTHENTICATION_BACKENDS and
+        constant_time_compare(snapshot['session_auth_hash'], session_hash)
+    ):
+        return from_snapshot(snapshot)
+
+    user = auth.get_user(request)
+    if user.is_authenticated:
+        cache.set(
+            user_key(user.id), take_snapshot(user), USER_CACHE_TIMEOUT
+        )
+    return user
+
+
+def forget_users(user_ids):
+    """Drop the snapshots of the given users."""
+    cache.delete_many([user_key(user_id) for user_id in user_ids])
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """`AuthenticationMiddleware` loading users with `get_user()`."""
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
@@ -0,0 +1,63 @@
+"""Helpers for process-wide in-memory caches.
+
+Processes don't share memory, so every process-wide cache tracks a
+version stamp kept in the shared (default) cache. Changing the cached
+data replaces the stamp, and every process drops its copy once it
+notices the stamp no longer matches the one its copy was built with.
+To keep the overhead negligible, the stamp is checked at most once
+every `check_interval` seconds.
+"""
+import time
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+class VersionStamp:
+    """A version stamp of a process-wide cache, stored under `key` in
+    the shared cache.
+    """
+    def __init__(self, key, check_interval=1.0):
+        self.key = key
+        self.check_interval = check_interval
+        self.version = None
+        self.checked_at = 0
+
+    def fetch(self):
+        """Return the current stamp, creating it if it doesn't exist.
+        To be called right before (re)building the cached data, so that
+        a change made while building isn't missed.
+        """
+        cache.add(self.key, uuid.uuid4().hex, None)
+        version = cache.get(self.key)
+        self.version = version
+        self.checked_at = time.monotonic()
+        return version
+
+    def is_stale(self):
+        """Whether the cached data was changed by any of the processes
+        since the stamp was last fetched. Only actually checked once
+        every `check_interval` seconds.
+        """
+        now = time.monotonic()
+        if now - self.checked_at < self.check_interval:
+            return False
+        self.checked_at = now
+        return cache.get(self.key) != self.version
+
+    def bump(self, adopt=False):
+        """Replace the stamp once the current transaction commits.
+
+        Set `adopt` when the change has already been applied to the
+        cached data of this process, so that this process doesn't drop
+        its up to date copy.
+        """
+        def replace():
+            current = adopt and cache.get(self.key) == self.version
+            version = uuid.uuid4().hex
+            cache.set(self.key, version, None)
+            if current:
+                self.version = version
+
+        transaction.on_commit(replace)
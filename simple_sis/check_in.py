@@ -0,0 +1,188 @@
+"""Check-in of attendees at the gate, e.g. from organisers' tablets.
+
+Checking an attendee in takes two indexed queries: one looking the
+attendee up by the id or email of their user, and a conditional UPDATE,
+which makes check-ins idempotent, as scanning an attendee twice keeps
+the time of the first scan.
+
+Tablets which lose their connection queue check-ins up and sync them
+later, along with the times they were recorded at. A sync is applied in
+a single transaction, with a couple of queries per batch of check-ins
+rather than per check-in. Whether the times come from the same sync,
+another tablet or a live check-in, the earliest time of an attendee
+wins, as the first scan at the gate is the actual arrival.
+"""
+import datetime
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ActivityAttendee
+
+# Check-ins per batch of a sync, which bounds the size of the queries
+SYNC_BATCH_SIZE = 500
+
+# Check-ins recorded this far in the future are accepted, to allow for
+# tablet clocks running a bit fast
+CLOCK_SKEW = datetime.timedelta(minutes=5)
+
+
+class CheckInError(Exception):
+    """An invalid check-in, with a message to show to organisers."""
+
+
+class NotAttending(CheckInError):
+    """The user to check in doesn't attend the activity."""
+
+
+def user_lookup(scan):
+    """Return the id or email of the user to check in, as given by the
+    `user` or `email` key of a check-in.
+    """
+    user_id = scan.get('user')
+    email = scan.get('email')
+    if isinstance(user_id, int) and not isinstance(user_id, bool):
+        return user_id
+    if isinstance(email, str) and email.strip():
+        return email.strip()
+    raise CheckInError('Give the id or email of the user')
+
+
+def lookup_filter(lookups):
+    """Filter of attendees whose users are given by ids or emails.
+
+    Emails match regardless of case, like MySQL compares them. Their
+    lowercase forms are included for databases comparing them as is,
+    e.g. SQLite.
+    """
+    user_ids = [value for value in lookups if isinstance(value, int)]
+    emails = {value for value in lookups if isinstance(value, str)}
+    emails |= {email.lower() for email in emails}
+    return Q(user_id__in=user_ids) | Q(user__email__in=emails)
+
+
+def check_in(activity_id, scan, user, now=None):
+    """Check the attendee given by `scan`, e.g. `{"user": 42}` or
+    `{"email": "jane@example.com"}`, in to an activity.
+
+    Returns a dict describing the attendee, including whether they'd
+    already been checked in.
+    """
+    now = now or timezone.now()
+    lookup = user_lookup(scan)
+    attendee = ActivityAttendee.objects.filter(
+        lookup_filter([lookup]), activity_id=activity_id
+    ).values(
+        'id', 'user_id', 'user__first_name', 'user__last_name', 'attended_at'
+    ).first()
+    if attendee is None:
+        raise NotAttending('Not attending this activity')
+
+    already_checked_in = attendee['attended_at'] is not None
+    if not already_checked_in:
+        attendees = ActivityAttendee.objects.filter(id=attendee['id'])
+        if attendees.mark_attended(user, now):
+            attendee['attended_at'] = now
+        else:
+            # Checked in by another tablet in the meantime
+            already_checked_in = True
+            attendee['attended_at'] = attendees.values_list(
+                'attended_at', flat=True
+            ).get()
+
+    return {
+        'id': attendee['id'],
+        'user': attendee['user_id'],
+        'first_name': attendee['user__first_name'],
+        'last_name': attendee['user__last_name'],
+        'attended_at': attendee['attended_at'],
+        'already_checked_in': already_checked_in,
+    }
+
+
+def parse_time(value, now):
+    """Parse the ISO 8601 time a check-in was recorded at. Times
+    without a timezone are taken to be in the current timezone.
+    """
+    try:
+        time = parse_datetime(value) if isinstance(value, str) else None
+    except ValueError:  # Well formatted, but not a date, e.g. February 30
+        time = None
+    if time is None:
+        raise CheckInError('Invalid check-in time')
+    if timezone.is_naive(time):
+        time = timezone.make_aware(time)
+    if time > now + CLOCK_SKEW:
+        raise CheckInError('Check-in time is in the future')
+    return time
+
+
+def sync_check_ins(activity_id, check_ins, user, now=None):
+    """Apply a queue of check-ins recorded offline, each a dict like
+    `{"user": 42, "at": "2021-10-01T09:12:44+10:00"}`, to an activity.
+
+    Invalid check-ins are reported and skipped, the rest are applied in
+    a single transaction. Returns a dict with the number of check-ins
+    received, the number of attendees whose time changed and the errors
+    by position of the check-ins.
+    """
+    now = now or timezone.now()
+    received = 0
+    applied = 0
+    errors = []
+
+    check_ins = enumerate(check_ins)
+    with transaction.atomic():
+        while True:
+            batch = list(islice(check_ins, SYNC_BATCH_SIZE))
+            if not batch:
+                break
+            received += len(batch)
+
+            parsed = []
+            for position, item in batch:
+                try:
+                    if not isinstance(item, dict):
+                        raise CheckInError('Invalid check-in')
+                    parsed.append(
+                        (
+                            position,
+                            user_lookup(item),
+                            parse_time(item.get('at'), now),
+                        )
+                    )
+                except CheckInError as error:
+                    errors.append({'index': position, 'error': str(error)})
+
+            attendees = {}
+            if parsed:
+                for id, user_id, email in ActivityAttendee.objects.filter(
+                    lookup_filter([lookup for _, lookup, _ in parsed]),
+                    activity_id=activity_id,
+                ).values_list('id', 'user_id', 'user__email'):
+                    attendees[user_id] = attendees[email.lower()] = id
+
+            # The earliest time of every attendee in the batch
+            times = {}
+            for position, lookup, time in parsed:
+                if isinstance(lookup, str):
+                    lookup = lookup.lower()
+                id = attendees.get(lookup)
+                if id is None:
+                    errors.append(
+                        {
+                            'index': position,
+                            'error': 'Not attending this activity',
+                        }
+                    )
+                elif id not in times or time < times[id]:
+                    times[id] = time
+
+            applied += ActivityAttendee.objects.filter(
+                activity_id=activity_id
+            ).mark_attended_at(times, user, now)
+
+    return {'received': received, 'applied': applied, 'errors': errors}
@@ -0,0 +1,152 @@
+"""Conditional GETs of the pages staff keep open and refresh.
+
+Pages are given an ETag and a Last-Modified date, so that refreshing a
+page which hasn't changed is answered with `304 Not Modified` without
+loading or rendering anything. For that to pay off, finding out
+whether a page changed has to be cheap: the version of every page is
+read by a single query of aggregates over indexed `updated_date`
+columns of the rows the page shows, see `ActivityTrackingModel.save()`.
+
+The version covers the user viewing the page and the lookup codes too,
+as pages show both. Names of the users on activity rosters aren't
+covered, they change rarely enough for the occasional stale name until
+the activity next changes.
+"""
+import asyncio
+import datetime
+import hashlib
+from calendar import timegm
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, F, OuterRef, Subquery
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
+
+from .lookups import lookup_codes
+from .models import Activity, ActivityAttendee, Location, School, Venue
+
+
+class PageVersion:
+    """The validators of a page, derived from the values it depends on,
+    e.g. `updated_date`s and counts of the rows it shows.
+    """
+    def __init__(self, user, *values):
+        values = (user.id, user.updated_date, *values)
+        self.etag = hashlib.md5(
+            ':'.join(map(str, (*values, lookup_codes.version))).encode()
+        ).hexdigest()
+        self.last_modified = max(
+            value for value in values
+            if isinstance(value, datetime.datetime)
+        )
+
+
+def conditional_page(version_func):
+    """Like `condition()`, with both validators taken from the
+    `PageVersion` returned by `version_func(request, *args, **kwargs)`,
+    which is called once per request. A None version leaves the request
+    to the view, e.g. to answer 404. Works on sync and async views.
+    """
+    def version(request, *args, **kwargs):
+        if not hasattr(request, '_page_version'):
+            request._page_version = version_func(request, *args, **kwargs)
+        return request._page_version
+
+    def etag(request, *args, **kwargs):
+        page_version = version(request, *args, **kwargs)
+        return page_version and page_version.etag
+
+    def last_modified(request, *args, **kwargs):
+        page_version = version(request, *args, **kwargs)
+        return page_version and page_version.last_modified
+
+    sync_decorator = condition(
+        etag_func=etag, last_modified_func=last_modified
+    )
+
+    def decorator(view):
+        if not asyncio.iscoroutinefunction(view):
+            return sync_decorator(view)
+
+        # The same checks as `condition()`, with the version queried
+        # through `sync_to_async()`
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            page_version = await sync_to_async(version)(
+                request, *args, **kwargs
+            )
+            if page_version is None:
+                return await view(request, *args, **kwargs)
+
+            res_etag = quote_etag(page_version.etag)
+            res_last_modified = timegm(
+                page_version.last_modified.utctimetuple()
+            )
+            response = get_conditional_response(
+                request, etag=res_etag, last_modified=res_last_modified
+            )
+            if response is None:
+                response = await view(request, *args, **kwargs)
+
+            if request.method in ('GET', 'HEAD'):
+                if not response.has_header('Last-Modified'):
+                    response['Last-Modified'] = http_date(res_last_modified)
+                response.headers.setdefault('ETag', res_etag)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def latest(queryset):
+    """Subquery of the latest `updated_date` of a queryset."""
+    return Subquery(
+        queryset.order_by('-updated_date').values('updated_date')[:1]
+    )
+
+
+def home_version(request):
+    """Version of the activity listings of the user's school. Counts
+    of all and of past activities are covered as well, so that deleted
+    activities, and activities moving from upcoming to past, change the
+    version too.
+    """
+    activities = Activity.objects.filter(
+        school_id=OuterRef('id')
+    ).order_by().values('school_id')
+    row = School.objects.filter(id=request.user.school_id).values_list(
+        latest(Activity.objects.filter(school_id=OuterRef('id'))),
+        Subquery(activities.annotate(count=Count('id')).values('count')),
+        Subquery(
+            activities.filter(start_date__lt=timezone.now()).annotate(
+                count=Count('id')
+            ).values('count')
+        ),
+        latest(Venue.objects.all()),
+        latest(Location.objects.all()),
+    ).first()
+    return PageVersion(request.user, *(row or ()))
+
+
+def activity_version(request, id):
+    """Version of an activity page, which shows the activity, its venue
+    and its roster.
+    """
+    try:
+        row = Activity.objects.filter(
+            school_id=request.user.school_id, id=id
+        ).values_list(
+            'updated_date',
+            F('venue__updated_date'),
+            F('venue__location__updated_date'),
+            latest(
+                ActivityAttendee.objects.filter(activity_id=OuterRef('id'))
+            ),
+        ).get()
+    except Activity.DoesNotExist:
+        return None
+    return PageVersion(request.user, *row)
@@ -0,0 +1,208 @@
+"""Attendance counters of activities.
+
+Every activity keeps counts of its attendees, organisers, approved and
+attended attendees, so that listings can show them straight off the
+activity row rather than counting attendees on every request.
+
+The counters are adjusted by `F()` increments in the same transaction
+as the change of the attendees, which also move `updated_date` of the
+activities on, as the counts are shown wherever the activities are:
+
+- saving or deleting a single attendee, by the signal handlers in
+  `signals`,
+- bulk changes, i.e. `bulk_create()`, `delete()` and the status
+  changes of `ActivityAttendeeQuerySet`, by the queryset itself, with
+  one UPDATE per activity involved.
+
+Plain `update()` calls changing the counted fields of attendees aren't
+tracked, `recompute_counters()` (or the `recompute_counters` command)
+repairs any drift.
+
+Once the changes are committed, `attendance_changed` is sent with the
+ids of the activities whose counters changed, e.g. to push the new
+counts to live dashboards, see `live`.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import reduce
+from operator import or_
+
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal
+from django.utils import timezone
+
+# Counter fields of `Activity`, in the order of count tuples
+COUNTER_FIELDS = (
+    'attendee_count',
+    'organiser_count',
+    'approved_count',
+    'attended_count',
+)
+
+# Filters of attendees counted by every counter
+COUNTER_FILTERS = {
+    'attendee_count': models.Q(),
+    'organiser_count': models.Q(is_organiser=True),
+    'approved_count': models.Q(approved_at__isnull=False),
+    'attended_count': models.Q(attended_at__isnull=False),
+}
+
+# Activities are recomputed in batches of this size
+RECOMPUTE_BATCH_SIZE = 1000
+
+# Sent with `activity_ids` once changes of their counters are committed
+attendance_changed = Signal()
+
+_paused = ContextVar('counters_paused', default=False)
+
+# Ids of activities being deleted, whose counters don't matter anymore,
+# only set within `deleting_activities()`
+_deleting = ContextVar('counters_deleting', default=None)
+
+
+def attendee_counts(is_organiser, approved_at, attended_at):
+    """The counts a single attendee contributes, as a tuple in the
+    order of `COUNTER_FIELDS`.
+    """
+    return (
+        1,
+        int(bool(is_organiser)),
+        int(approved_at is not None),
+        int(attended_at is not None),
+    )
+
+
+class CounterDeltas:
+    """Changes of counters, summed up by activity."""
+    def __init__(self):
+        self.deltas = defaultdict(lambda: [0] * len(COUNTER_FIELDS))
+
+    def add(self, activity_id, counts, sign=1):
+        delta = self.deltas[activity_id]
+        for i, count in enumerate(counts):
+            delta[i] += sign * count
+
+    def apply(self):
+        """Write the changes, with one UPDATE per activity."""
+        if _paused.get():
+            return
+        from .models import Activity
+
+        deleting = _deleting.get() or ()
+        now = timezone.now()
+        changed = []
+        for activity_id, delta in self.deltas.items():
+            if activity_id in deleting or not any(delta):
+                continue
+            Activity.objects.filter(id=activity_id).update(
+                updated_date=now,
+                **{
+                    field: models.F(field) + change
+                    for field, change in zip(COUNTER_FIELDS, delta)
+                    if change
+                },
+            )
+            changed.append(activity_id)
+
+        if changed:
+            transaction.on_commit(
+                lambda: attendance_changed.send(
+                    sender=CounterDeltas, activity_ids=changed
+                )
+            )
+
+
+def is_paused():
+    return _paused.get()
+
+
+@contextmanager
+def paused():
+    """Stop maintaining the counters for the duration of the block,
+    e.g. when loading lots of attendees at once. The counters of the
+    activities involved have to be recomputed afterwards.
+    """
+    token = _paused.set(True)
+    try:
+        yield
+    finally:
+        _paused.reset(token)
+
+
+@contextmanager
+def deleting_activities():
+    """Scope of deleting activities, see `deleting()`. The marks are
+    dropped at the end of the block, whether or not the delete went
+    through, so a failed delete leaves the counters of its activities
+    maintained.
+    """
+    token = _deleting.set(frozenset())
+    try:
+        yield
+    finally:
+        _deleting.reset(token)
+
+
+def deleting(activity_ids):
+    """Mark activities as being deleted, so that deleting their
+    attendees doesn't bother updating their counters. Only takes effect
+    within `deleting_activities()`, elsewhere, e.g. when the activities
+    are deleted along with their school, the counters are just updated.
+    """
+    marked = _deleting.get()
+    if marked is not None:
+        _deleting.set(marked | set(activity_ids))
+
+
+def done_deleting(activity_ids):
+    marked = _deleting.get()
+    if marked is not None:
+        _deleting.set(marked - set(activity_ids))
+
+
+def recompute_counters(activities=None):
+    """Recompute the counters of `activities` (a queryset, all
+    activities by default) from their attendees and return the number
+    of activities whose counters were wrong.
+    """
+    from .models import Activity, ActivityAttendee
+
+    if activities is None:
+        activities = Activity.objects.all()
+
+    attendees = ActivityAttendee.objects.filter(
+        activity_id=models.OuterRef('id')
+    ).order_by().values('activity_id')
+    actual = {
+        field: Coalesce(
+            models.Subquery(
+                attendees.filter(filter).annotate(
+                    count=models.Count('id')
+                ).values('count'),
+                output_field=models.IntegerField(),
+            ),
+            0,
+        )
+        for field, filter in COUNTER_FILTERS.items()
+    }
+
+    # Only rewrite the counters which are out of sync
+    stale = activities.annotate(
+        **{f'actual_{field}': count for field, count in actual.items()}
+    ).filter(
+        reduce(
+            or_,
+            [
+                ~models.Q(**{field: models.F(f'actual_{field}')})
+                for field in COUNTER_FIELDS
+            ],
+        )
+    )
+    ids = list(stale.values_list('id', flat=True))
+    for start in range(0, len(ids), RECOMPUTE_BATCH_SIZE):
+        Activity.objects.filter(
+            id__in=ids[start:start + RECOMPUTE_BATCH_SIZE]
+        ).update(updated_date=timezone.now(), **actual)
+    return len(ids)
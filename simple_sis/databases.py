@@ -0,0 +1,110 @@
+"""Routing of queries between the primary database and its read
+replicas, and health checks of persistent connections.
+
+Reads of requests go to a replica, see `REPLICA_DATABASES`, picked once
+per request. Once a request writes, its later reads go to the primary,
+so that it reads its own writes despite the replicas lagging behind.
+Reads in transactions and outside of requests, e.g. of management
+commands or of streamed responses once their view returned, go to the
+primary as well.
+
+Persistent connections, see `CONN_MAX_AGE`, are checked at the start of
+every request, see `check_connections()`, so that a connection the
+server closed in the meantime is replaced rather than failing the first
+query of the request.
+"""
+import asyncio
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils.deprecation import MiddlewareMixin
+
+# Apps always read from the primary: sessions are read right after
+# logging in, before the replicas may have caught up
+PRIMARY_APPS = {'sessions'}
+
+
+class RequestReads:
+    """Where the reads of a request go."""
+    def __init__(self, replica):
+        self.replica = replica
+        self.pinned = False  # Whether the request wrote
+
+
+_reads = ContextVar('database_reads', default=None)
+
+
+@contextmanager
+def replica_reads():
+    """Send the reads of the block to a replica until it writes, like
+    those of a request.
+    """
+    replicas = settings.REPLICA_DATABASES
+    token = _reads.set(RequestReads(replicas and random.choice(replicas)))
+    try:
+        yield
+    finally:
+        _reads.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """Database router sending reads to replicas, see module docs."""
+    def db_for_read(self, model, **hints):
+        reads = _reads.get()
+        if (
+            reads is None or not reads.replica or reads.pinned or
+            model._meta.app_label in PRIMARY_APPS or
+            connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return reads.replica
+
+    def db_for_write(self, model, **hints):
+        reads = _reads.get()
+        if reads is not None:
+            reads.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their tables from the primary
+        if db in settings.REPLICA_DATABASES:
+            return False
+        return None
+
+
+class ReplicaReadsMiddleware(MiddlewareMixin):
+    """Routes the reads of every request, see `replica_reads()`."""
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with replica_reads():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with replica_reads():
+            return await self.get_response(request)
+
+
+def check_connections():
+    """Close the connections of the thread which are kept open between
+    requests and no longer work, e.g. timed out by the server, so that
+    they're reopened when next used.
+    """
+    for connection in connections.all():
+        if (
+            connection.connection is None or
+            not connection.settings_dict.get('CONN_HEALTH_CHECKS')
+        ):
+            continue
+        if not connection.is_usable():
+            try:
+                connection.close()
+            except DatabaseError:
+                pass  # It's gone anyway
@@ -0,0 +1,167 @@
+"""Exports of activity rosters and listings as CSV or XLSX files.
+
+Exports are streamed: rows are fetched in chunks, see
+`pagination.iter_chunks()`, and every chunk is encoded and sent as soon
+as it's fetched. The first bytes go out right away and memory use stays
+flat however many rows are exported.
+"""
+import csv
+import datetime
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.text import slugify
+
+from . import xlsx
+from .lookups import lookup_codes
+from .models import ActivityAttendee
+from .pagination import iter_chunks
+from .rosters import ROSTER_STATUSES
+
+EXPORT_CHUNK_SIZE = 2000
+
+ROSTER_HEADER = (
+    'First name',
+    'Last name',
+    'Email',
+    'Role',
+    'Organiser',
+    'Approved at',
+    'Attended at',
+)
+
+# Spreadsheet apps take text starting with these for a formula, which
+# names and emails of users could be crafted to be
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+ACTIVITY_HEADER = (
+    'Name',
+    'Category',
+    'Date',
+    'Venue',
+    'Address',
+    'Distance (km)',
+    'Attendees',
+    'Approved',
+    'Attended',
+)
+
+
+def lookup_name(id):
+    code = lookup_codes.get(id)
+    return code.name if code is not None else ''
+
+
+def roster_rows(activity_id, status=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield chunks of rows of the roster of an activity, optionally
+    only of attendees with the given status.
+    """
+    attendees = ActivityAttendee.objects.filter(activity_id=activity_id)
+    if status in ROSTER_STATUSES:
+        attendees = attendees.filter(ROSTER_STATUSES[status])
+    attendees = attendees.values(
+        'id',
+        'user__first_name',
+        'user__last_name',
+        'user__email',
+        'attendee_type_id',
+        'is_organiser',
+        'approved_at',
+        'attended_at',
+    )
+    for chunk in iter_chunks(attendees, ('id', ), chunk_size):
+        yield [
+            (
+                row['user__first_name'],
+                row['user__last_name'],
+                row['user__email'],
+                lookup_name(row['attendee_type_id']),
+                row['is_organiser'],
+                row['approved_at'],
+                row['attended_at'],
+            ) for row in chunk
+        ]
+
+
+def activity_rows(activities, keys, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield chunks of rows of a listing of activities ordered by
+    `keys`.
+    """
+    activities = activities.values(
+        'id',
+        'name',
+        'category_id',
+        'start_date',
+        'venue__name',
+        'venue__location__display_address',
+        'distance_from_school',
+        'attendee_count',
+        'approved_count',
+        'attended_count',
+    )
+    for chunk in iter_chunks(activities, keys, chunk_size):
+        yield [
+            (
+                row['name'],
+                lookup_name(row['category_id']),
+                row['start_date'],
+                row['venue__name'],
+                row['venue__location__display_address'],
+                round(row['distance_from_school'] / 1000, 1),
+                row['attendee_count'],
+                row['approved_count'],
+                row['attended_count'],
+            ) for row in chunk
+        ]
+
+
+class _Line:
+    """A file holding the last line written by a CSV writer."""
+    def write(self, line):
+        self.line = line
+
+
+def csv_value(value):
+    if isinstance(value, bool):
+        return 'Yes' if value else ''
+    if isinstance(value, datetime.datetime):
+        return timezone.localtime(value).strftime('%Y-%m-%d %H:%M')
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        # Shown as text, like Excel does for text typed in with a quote.
+        # XLSX files hold text as such already, see `xlsx.cell()`.
+        return f"'{value}"
+    return value
+
+
+def stream_csv(header, chunks):
+    """Yield a CSV file, UTF-8 encoded with a byte order mark so that
+    Excel opens it right, one chunk of rows at a time.
+    """
+    line = _Line()
+    writer = csv.writer(line)
+    writer.writerow(header)
+    yield ('\ufeff' + line.line).encode()
+    for chunk in chunks:
+        lines = []
+        for row in chunk:
+            writer.writerow([csv_value(value) for value in row])
+            lines.append(line.line)
+        yield ''.join(lines).encode()
+
+
+EXPORT_FORMATS = {
+    'csv': (stream_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (xlsx.stream_xlsx, xlsx.CONTENT_TYPE),
+}
+
+
+def export_response(format, name, header, chunks):
+    """Stream an export as an attachment named after `name`."""
+    stream, content_type = EXPORT_FORMATS[format]
+    response = StreamingHttpResponse(
+        stream(header, chunks), content_type=content_type
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="{slugify(name) or "export"}.{format}"'
+    )
+    return response
@@ -0,0 +1,34 @@
+"""Versioned caching of rendered template fragments.
+
+Fragments showing an object, e.g. a row of the activity listing, are
+cached under a key derived from the version of the object, i.e. the
+`updated_date` of the object itself and of the related objects the
+fragment shows. Every save through the ORM, including the admin, moves
+`updated_date` on (see `ActivityTrackingModel.save()`), so a changed
+object is simply looked up under a new key and cached HTML is never
+stale. Outdated fragments are never read again and are left to be
+evicted by the cache.
+
+Fragments are cached with the `{% cache %}` tag, in the
+`template_fragments` cache, whose backend is configured separately
+from the default cache, e.g. to keep fragments on disk.
+"""
+from .lookups import lookup_codes
+
+
+def activity_version(activity):
+    """The version of an activity as shown by listings, which covers
+    its venue and the venue's location too, along with the lookup codes
+    naming its category.
+
+    Expects activities loaded by `ActivityQuerySet.for_listing()`.
+    """
+    return ':'.join(
+        str(value) for value in (
+            activity.id,
+            activity.updated_date.timestamp(),
+            activity.venue.updated_date.timestamp(),
+            activity.venue_location_updated.timestamp(),
+            lookup_codes.version,
+        )
+    )
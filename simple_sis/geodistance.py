@@ -0,0 +1,214 @@
+"""Batch computation of activity distances from their schools.
+
+The distance of an activity only depends on the locations of its
+school and venue, and a school tends to reuse a handful of venues for
+hundreds of activities. So instead of computing distances activity by
+activity, the engine:
+
+1. collects the distinct (school, venue) pairs of the activities,
+2. looks their distances up in a process-wide school x venue distance
+   matrix, computing the missing or outdated ones in a single
+   vectorised haversine pass,
+3. writes the distances with one set-based UPDATE per school, which
+   only touches activities whose distance actually changed.
+"""
+import threading
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+import numpy as np
+from django.db import models
+from django.utils import timezone
+
+from .models import Activity, Location, School, Venue
+from .postcodes import postcode_centroid
+
+# Mean radius of the Earth in metres
+EARTH_RADIUS = 6371008.8
+
+# Number of venues per UPDATE statement, which bounds the size of the
+# CASE expression mapping venues to their distances
+UPDATE_BATCH_SIZE = 500
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Great-circle distances in metres between arrays of coordinates
+    given in decimal degrees.
+    """
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2)**2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2)**2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+class DistanceMatrix:
+    """Process-wide cache of distances between pairs of locations.
+
+    Every entry remembers the coordinates it was computed from, so that
+    only the pairs whose locations moved get recomputed.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (from location id, to location id) mapped to a tuple of
+        # (from coordinates, to coordinates, distance in metres)
+        self._entries = {}
+
+    def get_many(self, pairs, coordinates):
+        """Return a dict of distances in metres of the given location id
+        `pairs`, using `coordinates`, a dict of location ids mapped to
+        `(latitude, longitude)` tuples. Pairs with unknown coordinates
+        are left out.
+        """
+        distances = {}
+        stale = []
+        for pair in pairs:
+            start = coordinates.get(pair[0])
+            end = coordinates.get(pair[1])
+            if start is None or end is None:
+                continue
+            entry = self._entries.get(pair)
+            if entry is not None and entry[:2] == (start, end):
+                distances[pair] = entry[2]
+            else:
+                stale.append((pair, start, end))
+
+        if stale:
+            points = np.array(
+                [start + end for _, start, end in stale], dtype=float
+            )
+            metres = np.rint(haversine(*points.T)).astype(int).tolist()
+            with self._lock:
+                for (pair, start, end), distance in zip(stale, metres):
+                    self._entries[pair] = (start, end, distance)
+                    distances[pair] = distance
+
+        return distances
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+
+distance_matrix = DistanceMatrix()
+
+
+def approximate_coordinates(latitude, longitude, postcode):
+    """Coordinates of a location, falling back to the approximate
+    centroid of its postcode when they're unknown. Returns None if
+    neither is known.
+    """
+    if latitude is None or longitude is None:
+        return postcode_centroid(postcode)
+    return latitude, longitude
+
+
+def location_coordinates(location_ids):
+    """Fetch coordinates of the given locations, approximated from
+    their postcodes where unknown, as a dict of location ids mapped to
+    `(latitude, longitude)` tuples.
+    """
+    coordinates = {}
+    for id, *values in Location.objects.filter(
+        id__in=location_ids
+    ).values_list('id', 'latitude', 'longitude', 'postcode'):
+        point = approximate_coordinates(*values)
+        if point is not None:
+            coordinates[id] = point
+    return coordinates
+
+
+def recompute_distances(activities=None):
+    """Recompute `distance_from_school` of `activities` (a queryset,
+    all activities by default) and return the number of activities
+    whose distance changed.
+    """
+    if activities is None:
+        activities = Activity.objects.all()
+
+    rows = activities.values_list(
+        'school_id',
+        'venue_id',
+        'school__location_id',
+        'venue__location_id',
+    ).distinct().order_by()
+    venues_by_pair = defaultdict(list)
+    for school_id, venue_id, school_location, venue_location in rows:
+        venues_by_pair[school_location, venue_location].append(
+            (school_id, venue_id)
+        )
+    if not venues_by_pair:
+        return 0
+
+    location_ids = {id for pair in venues_by_pair for id in pair}
+    distances = distance_matrix.get_many(
+        venues_by_pair, location_coordinates(location_ids)
+    )
+
+    by_school = defaultdict(dict)
+    for pair, distance in distances.items():
+        for school_id, venue_id in venues_by_pair[pair]:
+            by_school[school_id][venue_id] = distance
+
+    updated = 0
+    now = timezone.now()
+    for school_id, venues in by_school.items():
+        venues = list(venues.items())
+        for start in range(0, len(venues), UPDATE_BATCH_SIZE):
+            batch = venues[start:start + UPDATE_BATCH_SIZE]
+            # Skip activities which already have the right distance
+            changed = reduce(
+                or_,
+                [
+                    models.Q(venue_id=venue_id) &
+                    ~models.Q(distance_from_school=distance)
+                    for venue_id, distance in batch
+                ],
+            )
+            updated += activities.filter(changed, school_id=school_id).update(
+                updated_date=now,
+                distance_from_school=models.Case(
+                    *[
+                        models.When(venue_id=venue_id, then=distance)
+                        for venue_id, distance in batch
+                    ],
+                    output_field=models.IntegerField(),
+                )
+            )
+    return updated
+
+
+def recompute_school_distances(school_ids):
+    """Recompute distances of all activities of the given schools."""
+    return recompute_distances(
+        Activity.objects.filter(school_id__in=school_ids)
+    )
+
+
+def recompute_location_distances(location_id):
+    """Recompute distances of activities affected by a move of the
+    given location, i.e. activities of schools or at venues located
+    there.
+    """
+    return recompute_distances(
+        Activity.objects.filter(
+            models.Q(school__location_id=location_id) |
+            models.Q(venue__location_id=location_id)
+        )
+    )
+
+
+def activity_distance(school_id, venue_id):
+    """Distance in metres between a school and a venue, or None if the
+    location of either of them is unknown.
+    """
+    school_location = School.objects.filter(id=school_id).values_list(
+        'location_id', flat=True
+    ).first()
+    venue_location = Venue.objects.filter(id=venue_id).values_list(
+        'location_id', flat=True
+    ).first()
+    pair = (school_location, venue_location)
+    return distance_matrix.get_many(
+        [pair], location_coordinates(pair)
+    ).get(pair)
@@ -0,0 +1,288 @@
+"""Live attendance of activities pushed to dashboards as server-sent
+events, rather than dashboards polling the activity page.
+
+Dashboards subscribe to an activity through a long-lived stream, see
+`LiveEvents`, which `core.asgi` serves ahead of Django. Whenever the
+attendance counters of an activity change, see
+`counters.attendance_changed`, the `broker` loads the attendance of the
+activity once and fans the event out to every stream subscribed to
+it. Changes in quick succession, e.g. a queue of check-ins, are
+coalesced into a single event, so the cost of keeping any number of
+dashboards up to date is a couple of queries per `PUSH_INTERVAL` of
+busy activities.
+
+The broker lives in the process serving the streams, so it only hears
+of changes made in the same process. Several worker processes need a
+shared channel instead, e.g. Redis pub/sub.
+"""
+import asyncio
+import contextvars
+import json
+from importlib import import_module
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError
+from django.http.cookie import parse_cookie
+from django.urls import Resolver404, resolve
+
+from .asynchronous import run_detached
+from .authentication import get_user
+from .counters import COUNTER_FIELDS
+from .models import Activity, ActivityAttendee
+
+# Seconds changes are collected for before an event is pushed
+PUSH_INTERVAL = 0.5
+
+# Seconds between comments keeping idle streams from timing out
+KEEP_ALIVE_INTERVAL = 15
+
+# Events waiting to be sent to a stream, older ones are dropped when a
+# stream falls behind, as every event holds the complete attendance
+SUBSCRIPTION_BACKLOG = 10
+
+# Recently changed attendees listed by events
+RECENT_ATTENDEES = 10
+
+EVENT_STREAM = 'text/event-stream'
+
+# How long browsers wait before reconnecting, in ms, which has them
+# poll when the events aren't streamed, e.g. under runserver
+RECONNECT_DELAY = 5000
+
+
+def attendance_event(activity_id, school_id=None):
+    """The attendance of an activity, optionally only if it belongs to
+    the given school: its counters and the attendees who changed last,
+    e.g. arrived. Returns None if there's no such activity.
+    """
+    activities = Activity.objects.filter(id=activity_id)
+    if school_id is not None:
+        activities = activities.filter(school_id=school_id)
+    counts = activities.values(*COUNTER_FIELDS).first()
+    if counts is None:
+        return None
+    recent = ActivityAttendee.objects.filter(
+        activity_id=activity_id
+    ).order_by('-updated_date', '-id').values(
+        'id',
+        'user__first_name',
+        'user__last_name',
+        'is_organiser',
+        'approved_at',
+        'attended_at',
+    )[:RECENT_ATTENDEES]
+    return {
+        'activity': activity_id,
+        'counts': counts,
+        'recent': [
+            {
+                'id': row['id'],
+                'first_name': row['user__first_name'],
+                'last_name': row['user__last_name'],
+                'is_organiser': row['is_organiser'],
+                'approved_at': row['approved_at'],
+                'attended_at': row['attended_at'],
+            } for row in recent
+        ],
+    }
+
+
+def event_message(event):
+    """A server-sent event of attendance."""
+    data = json.dumps(event, cls=DjangoJSONEncoder)
+    return f'retry: {RECONNECT_DELAY}\nevent: attendance\ndata: {data}\n\n'
+
+
+class Subscription:
+    """Events waiting to be sent to a stream."""
+    def __init__(self):
+        self.queue = asyncio.Queue(SUBSCRIPTION_BACKLOG)
+
+    def put(self, event):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+class Broker:
+    """Fans events of activities out to the streams subscribed to them.
+
+    Subscriptions are managed on the event loop serving the streams,
+    changes can be reported from any thread.
+    """
+    def __init__(self, interval=PUSH_INTERVAL):
+        self.interval = interval
+        self.loop = None
+        self.subscriptions = {}  # Activity ids mapped to subscriptions
+        self.pending = set()  # Ids of activities with a push scheduled
+        self.tasks = set()
+
+    def subscribe(self, activity_id):
+        self.loop = asyncio.get_running_loop()
+        subscription = Subscription()
+        self.subscriptions.setdefault(activity_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, activity_id, subscription):
+        subscriptions = self.subscriptions.get(activity_id, set())
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            self.subscriptions.pop(activity_id, None)
+
+    def changed(self, activity_ids):
+        """Schedule pushing the attendance of the given activities to
+        their subscribers. Safe to call from any thread.
+        """
+        loop = self.loop
+        watched = [id for id in activity_ids if id in self.subscriptions]
+        if not watched or loop is None or loop.is_closed():
+            return
+        try:
+            # Run in a context of its own rather than the caller's, e.g.
+            # the request which made the change
+            loop.call_soon_threadsafe(
+                self._schedule, watched, context=contextvars.Context()
+            )
+        except RuntimeError:
+            pass  # The loop closed in the meantime
+
+    def _schedule(self, activity_ids):
+        for activity_id in activity_ids:
+            if activity_id not in self.pending:
+                self.pending.add(activity_id)
+                self.loop.call_later(self.interval, self._start, activity_id)
+
+    def _start(self, activity_id):
+        task = self.loop.create_task(self.push(activity_id))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def push(self, activity_id):
+        """Load the attendance of an activity once and send it to every
+        subscriber.
+        """
+        self.pending.discard(activity_id)
+        if activity_id not in self.subscriptions:
+            return
+        try:
+            event = await run_detached(attendance_event, activity_id)
+        except DatabaseError:
+            return
+        for subscription in self.subscriptions.get(activity_id, ()):
+            subscription.put(event)
+
+
+broker = Broker()
+
+
+def authorize(cookies, activity_id):
+    """The attendance of an activity if the user logged in with the
+    session of the given cookies may see it, otherwise an HTTP status
+    code refusing the stream.
+    """
+    engine = import_module(settings.SESSION_ENGINE)
+    session = engine.SessionStore(cookies.get(settings.SESSION_COOKIE_NAME))
+    user = get_user(SimpleNamespace(session=session))
+    if not user.is_authenticated:
+        return 403
+    return attendance_event(activity_id, user.school_id) or 404
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+class LiveEvents:
+    """ASGI middleware streaming the events of `activity-events` URLs,
+    passing any other request on to `app`.
+
+    The streams don't hold a thread while they wait for events, unlike
+    Django 3.2 streaming responses, whose content is iterated by a
+    thread.
+    """
+    def __init__(self, app, broker=broker):
+        self.app = app
+        self.broker = broker
+
+    def activity_id(self, scope):
+        """Id of the activity whose events are requested, or None."""
+        if scope['type'] != 'http' or scope['method'] != 'GET':
+            return None
+        try:
+            match = resolve(scope['path'])
+        except Resolver404:
+            return None
+        if match.url_name != 'activity-events':
+            return None
+        return match.kwargs['id']
+
+    async def __call__(self, scope, receive, send):
+        activity_id = self.activity_id(scope)
+        if activity_id is None:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope['headers'])
+        event = await run_detached(
+            authorize,
+            parse_cookie(headers.get(b'cookie', b'').decode('latin-1')),
+            activity_id,
+        )
+        if isinstance(event, int):
+            await send({'type': 'http.response.start', 'status': event})
+            await send({'type': 'http.response.body'})
+            return
+
+        await send(
+            {
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', EVENT_STREAM.encode()),
+                    (b'cache-control', b'no-cache'),
+                    # Keep proxies like nginx from buffering the stream
+                    (b'x-accel-buffering', b'no'),
+                ],
+            }
+        )
+        await self.stream(activity_id, event, receive, send)
+
+    async def stream(self, activity_id, event, receive, send):
+        subscription = self.broker.subscribe(activity_id)
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        received = None
+        message = event_message(event)
+        try:
+            while message is not None:
+                await send(
+                    {
+                        'type': 'http.response.body',
+                        'body': message.encode(),
+                        'more_body': True,
+                    }
+                )
+                received = received or asyncio.ensure_future(
+                    subscription.queue.get()
+                )
+                done, _ = await asyncio.wait(
+                    (received, disconnected),
+                    timeout=KEEP_ALIVE_INTERVAL,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if disconnected in done:
+                    return
+                if received in done:
+                    event = received.result()
+                    received = None
+                    # No event once the activity was deleted
+                    message = event and event_message(event)
+                else:
+                    message = ': keep-alive\n\n'
+            await send({'type': 'http.response.body'})
+        finally:
+            self.broker.unsubscribe(activity_id, subscription)
+            disconnected.cancel()
+            if received is not None:
+                received.cancel()
@@ -0,0 +1,100 @@
+"""Process-wide cache of lookup codes.
+
+Lookup codes (activity categories, attendee roles, etc.) are referenced
+by nearly every row the app renders, yet they almost never change. So
+rather than joining or fetching them over and over, every process keeps
+all of them in memory, keyed both by id and by type and code. Saving
+or deleting a lookup code makes every process reload its codes, see
+`caching.VersionStamp`.
+"""
+import threading
+
+from django.db import DatabaseError
+
+from .caching import VersionStamp
+
+
+class LookupCodeCache:
+    """In-memory copy of all lookup codes."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        # A tuple of dicts of codes by id, by (type code, code) and
+        # by type code, replaced as a whole on reload
+        self._codes = None
+        self._version = VersionStamp('simple_sis:lookup_codes:version')
+
+    def _load(self):
+        from .models import LookupCode
+
+        self._version.fetch()
+
+        by_id, by_code, by_type = {}, {}, {}
+        for code in LookupCode.objects.select_related('type').order_by(
+            'name'
+        ):
+            by_id[code.id] = code
+            by_code[code.type.code, code.code] = code
+            by_type.setdefault(code.type.code, []).append(code)
+
+        self._codes = by_id, by_code, by_type
+        return self._codes
+
+    def _fresh(self):
+        """Return the codes, reloading them first if they haven't been
+        loaded yet or changed in any of the processes since.
+        """
+        codes = self._codes
+        if codes is not None and not self._version.is_stale():
+            return codes
+        with self._lock:
+            # Another thread may have reloaded the codes in the meantime
+            if self._codes is not None and self._codes is not codes:
+                return self._codes
+            return self._load()
+
+    def warm(self):
+        """Load the codes up front, e.g. when a worker process starts.
+
+        Failures are ignored, as the database may not be migrated yet,
+        the codes are then loaded on first use instead.
+        """
+        try:
+            with self._lock:
+                self._load()
+        except DatabaseError:
+            pass
+
+    def invalidate(self):
+        """Drop the codes of this process right away and let the other
+        processes know about the change once it's committed.
+        """
+        self._codes = None
+        self._version.bump()
+
+    def get(self, id):
+        """Return the lookup code with the given id, if any."""
+        by_id, _, _ = self._fresh()
+        return by_id.get(id)
+
+    def get_by_code(self, type_code, code):
+        """Return a lookup code by the codes of its type and itself,
+        e.g. `get_by_code('ACTIVITY_ATTENDEE_TYPE', 'ATTENDEE_STUDENT')`.
+        """
+        _, by_code, _ = self._fresh()
+        return by_code.get((type_code, code))
+
+    @property
+    def version(self):
+        """The version stamp of the loaded codes, e.g. for keying caches
+        of anything showing code names.
+        """
+        self._fresh()
+        return self._version.version
+
+    def of_type(self, type_code):
+        """Return all lookup codes of a type, ordered by name."""
+        _, _, by_type = self._fresh()
+        return list(by_type.get(type_code, []))
+
+
+lookup_codes = LookupCodeCache()
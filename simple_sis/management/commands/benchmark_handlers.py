@@ -0,0 +1,236 @@
+import asyncio
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from itertools import cycle, islice
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.urls import reverse
+
+from simple_sis.asynchronous import PerRequestThreads
+from simple_sis.models import Activity, User
+
+HOST = 'localhost'
+
+# How the app is served in every mode
+MODES = {
+    'wsgi': 'WSGI, a thread per request from a pool, like gunicorn',
+    'asgi': 'ASGI as set up by Django',
+    'asgi-threads': 'ASGI with a thread per request, like core.asgi',
+}
+
+
+class QueryLatency:
+    """Execute wrapper delaying every query, like a database server
+    across the network would.
+    """
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __call__(self, execute, sql, params, many, context):
+        time.sleep(self.seconds)
+        return execute(sql, params, many, context)
+
+    def install(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+def wsgi_get(handler, path, cookie):
+    """GET a path from a WSGI handler and return the status code."""
+    url = urlsplit(path)
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'SERVER_NAME': HOST,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': HOST,
+        'HTTP_COOKIE': cookie,
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    statuses = []
+    response = handler(
+        environ,
+        lambda status, headers, exc_info=None: statuses.append(status),
+    )
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return int(statuses[0].split()[0])
+
+
+async def asgi_get(app, path, cookie):
+    """GET a path from an ASGI app and return the status code."""
+    url = urlsplit(path)
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': url.path,
+        'raw_path': url.path.encode(),
+        'query_string': url.query.encode(),
+        'root_path': '',
+        'headers': [
+            (b'host', HOST.encode()),
+            (b'cookie', cookie.encode()),
+        ],
+        'client': ('127.0.0.1', 50000),
+        'server': (HOST, 80),
+    }
+    statuses = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+
+    await app(scope, receive, send)
+    return statuses[0]
+
+
+def run_wsgi(paths, concurrency, cookie):
+    handler = WSGIHandler()
+
+    def timed(path):
+        start = time.perf_counter()
+        status = wsgi_get(handler, path, cookie)
+        return time.perf_counter() - start, status
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(timed, paths))
+
+
+async def run_asgi(app, paths, concurrency, cookie):
+    # Like a client keeping `concurrency` connections busy
+    slots = asyncio.Semaphore(concurrency)
+
+    async def timed(path):
+        async with slots:
+            start = time.perf_counter()
+            status = await asgi_get(app, path, cookie)
+            return time.perf_counter() - start, status
+
+    return await asyncio.gather(*map(timed, paths))
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark requests per second and latency of pages served over '
+        'WSGI and ASGI at high concurrency. Requests are sent straight '
+        'to the handlers, so the numbers leave the web server and the '
+        'network out.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mode',
+            action='append',
+            dest='modes',
+            choices=MODES,
+            help='Only benchmark this mode, repeatable.',
+        )
+        parser.add_argument(
+            '--path',
+            action='append',
+            dest='paths',
+            help='Request this path, repeatable. Defaults to the home '
+            'page, an activity page and the activity API.',
+        )
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=64)
+        parser.add_argument(
+            '--query-latency',
+            type=float,
+            default=0,
+            help='Delay every query by this many ms, e.g. to mimic a '
+            'database server across the network rather than SQLite.',
+        )
+        parser.add_argument(
+            '--email',
+            help='Email of the user to log in as, defaults to a user of '
+            'a school with activities.',
+        )
+
+    def handle(self, *args, **options):
+        activity = Activity.objects.order_by('id').first()
+        if activity is None:
+            raise CommandError('No activities, run generate_data first')
+        if options['email']:
+            user = User.objects.filter(email=options['email']).first()
+        else:
+            user = User.objects.filter(school_id=activity.school_id).first()
+        if user is None:
+            raise CommandError('User not found')
+        if user.school_id != activity.school_id:
+            activity = Activity.objects.filter(
+                school_id=user.school_id
+            ).order_by('id').first() or activity
+
+        client = Client()
+        client.force_login(user)
+        cookie = (
+            f'{settings.SESSION_COOKIE_NAME}='
+            f'{client.cookies[settings.SESSION_COOKIE_NAME].value}'
+        )
+        paths = options['paths'] or [
+            reverse('home'),
+            reverse('view-activity', kwargs={'id': activity.id}),
+            reverse('api-activities'),
+        ]
+        paths = list(islice(cycle(paths), options['requests']))
+        concurrency = options['concurrency']
+        if options['query_latency']:
+            latency = QueryLatency(options['query_latency'] / 1000)
+            connection_created.connect(latency.install, weak=False)
+
+        self.stdout.write(
+            f'{len(paths)} requests, {concurrency} at a time, as '
+            f'{user.email}'
+        )
+        for mode in options['modes'] or MODES:
+            start = time.perf_counter()
+            if mode == 'wsgi':
+                results = run_wsgi(paths, concurrency, cookie)
+            else:
+                app = ASGIHandler()
+                if mode == 'asgi-threads':
+                    app = PerRequestThreads(app)
+                results = asyncio.run(
+                    run_asgi(app, paths, concurrency, cookie)
+                )
+            elapsed = time.perf_counter() - start
+            self.report(mode, results, elapsed)
+
+    def report(self, mode, results, elapsed):
+        timings = [timing * 1000 for timing, _ in results]
+        errors = sum(status != 200 for _, status in results)
+        percentiles = statistics.quantiles(timings, n=100)
+        self.stdout.write(
+            f'{mode:<14} {len(results) / elapsed:>8.1f} req/s  '
+            f'p50 {percentiles[49]:>7.1f}ms  '
+            f'p95 {percentiles[94]:>7.1f}ms  '
+            f'p99 {percentiles[98]:>7.1f}ms  '
+            f'errors {errors}  ({MODES[mode]})'
+        )
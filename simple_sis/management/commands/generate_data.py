@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from simple_sis.synthetic import DataGenerator
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate synthetic schools, venues, users, activities and '
+        'attendees at scale, e.g. for load testing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schools', type=int, default=10)
+        parser.add_argument('--venues', type=int, default=100)
+        parser.add_argument('--users-per-school', type=int, default=500)
+        parser.add_argument('--activities-per-school', type=int, default=1000)
+        parser.add_argument('--attendees-per-activity', type=int, default=20)
+        parser.add_argument(
+            '--carnival-attendees',
+            type=int,
+            default=0,
+            help='Also generate a carnival with this many attendees.',
+        )
+        parser.add_argument(
+            '--password',
+            default='12345',
+            help='Password of all generated users.',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Seed of the random generator, for repeatable datasets.',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        generator = DataGenerator(
+            schools=options['schools'],
+            venues=options['venues'],
+            users_per_school=options['users_per_school'],
+            activities_per_school=options['activities_per_school'],
+            attendees_per_activity=options['attendees_per_activity'],
+            carnival_attendees=options['carnival_attendees'],
+            password=options['password'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            log=self.log if options['verbosity'] > 1 else None,
+        )
+
+        start = time.perf_counter()
+        written = generator.generate()
+        elapsed = time.perf_counter() - start
+
+        for table, count in written.items():
+            self.stdout.write(f'{table}: {count}')
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Generated {sum(written.values())} rows in {elapsed:.1f}s'
+            )
+        )
+
+    def log(self, message):
+        self.stdout.write(message)
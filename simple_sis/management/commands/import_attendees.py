@@ -0,0 +1,51 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from simple_sis.attendee_import import IMPORT_CHUNK_SIZE, AttendeeImport
+from simple_sis.models import Activity
+
+
+class Command(BaseCommand):
+    help = (
+        'Import attendees of an activity from a CSV file with email, '
+        'role and optionally organiser columns.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('activity', type=int, help='Id of the activity.')
+        parser.add_argument('file', help='Path of the CSV file, - for stdin.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=IMPORT_CHUNK_SIZE
+        )
+
+    def handle(self, *args, **options):
+        if not Activity.objects.filter(id=options['activity']).exists():
+            raise CommandError(f'Activity {options["activity"]} not found')
+
+        start = time.perf_counter()
+        importer = AttendeeImport(
+            options['activity'], chunk_size=options['chunk_size']
+        )
+        if options['file'] == '-':
+            importer.run(sys.stdin)
+        else:
+            with open(options['file'], encoding='utf-8-sig', newline='') as f:
+                importer.run(f)
+        elapsed = time.perf_counter() - start
+
+        for line, message in importer.errors:
+            self.stderr.write(f'Line {line}: {message}')
+        if importer.error_count > len(importer.errors):
+            self.stderr.write(
+                f'... and {importer.error_count - len(importer.errors)} '
+                'more errors'
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Imported {importer.imported} attendees, skipped '
+                f'{importer.skipped} already attending and '
+                f'{importer.error_count} invalid rows in {elapsed:.1f}s'
+            )
+        )
@@ -0,0 +1,114 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from simple_sis.models import School
+from simple_sis.provisioning import (
+    PROVISIONING_BATCH_SIZE,
+    RosterSync,
+    read_csv,
+    read_json,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Create, update and deactivate the users of a school to match a '
+        'CSV or JSON roster with email, first_name, last_name, '
+        'account_type and optionally password fields.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('school', type=int, help='Id of the school.')
+        parser.add_argument('file', help='Path of the roster, - for stdin.')
+        parser.add_argument(
+            '--format',
+            choices=('csv', 'json'),
+            help='Format of the roster, by default told by its extension.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would change.',
+        )
+        parser.add_argument(
+            '--deactivate-despite-errors',
+            action='store_true',
+            help=(
+                'Deactivate the users missing from the roster even if '
+                'some of its rows are invalid.'
+            ),
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Processes hashing passwords, by default one per core.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=PROVISIONING_BATCH_SIZE
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the report as JSON.',
+        )
+
+    def handle(self, *args, **options):
+        if not School.objects.filter(id=options['school']).exists():
+            raise CommandError(f'School {options["school"]} not found')
+        path = options['file']
+        format = options['format'] or (
+            'json' if path.lower().endswith('.json') else 'csv'
+        )
+        read = read_json if format == 'json' else read_csv
+
+        start = time.perf_counter()
+        sync = RosterSync(
+            options['school'],
+            dry_run=options['dry_run'],
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            deactivate_despite_errors=options['deactivate_despite_errors'],
+        )
+        try:
+            if path == '-':
+                sync.run(read(sys.stdin))
+            else:
+                with open(path, encoding='utf-8-sig', newline='') as f:
+                    sync.run(read(f))
+        except ValueError as e:
+            raise CommandError(f'Invalid roster: {e}') from e
+        elapsed = time.perf_counter() - start
+
+        if options['json']:
+            self.stdout.write(json.dumps(sync.as_dict(), indent=4))
+            return
+
+        for row, message in sync.errors:
+            self.stderr.write(f'Row {row}: {message}')
+        if sync.error_count > len(sync.errors):
+            self.stderr.write(
+                f'... and {sync.error_count - len(sync.errors)} more errors'
+            )
+        if sync.skipped_deactivations:
+            self.stderr.write(
+                f'Left {sync.skipped_deactivations} users missing from the '
+                'roster active, as some of its rows are invalid, see '
+                '--deactivate-despite-errors'
+            )
+        if sync.dry_run:
+            for change, emails in sync.emails.items():
+                for email in emails:
+                    self.stdout.write(f'{change}: {email}')
+        counts = sync.counts
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{"Would have c" if sync.dry_run else "C"}reated '
+                f'{counts["created"]}, updated {counts["updated"]} and '
+                f'deactivated {counts["deactivated"]} users, '
+                f'{counts["unchanged"]} unchanged and '
+                f'{sync.error_count} invalid rows in {elapsed:.1f}s'
+            )
+        )
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from simple_sis.counters import recompute_counters
+from simple_sis.models import Activity
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute attendance counters of activities from their '
+        'attendees, e.g. after loading fixtures or changing attendees '
+        'with plain UPDATEs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--school',
+            type=int,
+            action='append',
+            dest='schools',
+            help='Only recompute activities of this school, repeatable.',
+        )
+
+    def handle(self, *args, **options):
+        activities = Activity.objects.all()
+        if options['schools']:
+            activities = activities.filter(school_id__in=options['schools'])
+
+        start = time.perf_counter()
+        repaired = recompute_counters(activities)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Repaired counters of {repaired} activities in '
+                f'{elapsed:.1f}s'
+            )
+        )
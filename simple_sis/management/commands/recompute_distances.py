@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from simple_sis.geodistance import recompute_distances
+from simple_sis.models import Activity
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute distances of activities from their schools, e.g. '
+        'after importing location coordinates.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--school',
+            type=int,
+            action='append',
+            dest='schools',
+            help='Only recompute activities of this school, repeatable.',
+        )
+
+    def handle(self, *args, **options):
+        activities = Activity.objects.all()
+        if options['schools']:
+            activities = activities.filter(school_id__in=options['schools'])
+
+        start = time.perf_counter()
+        updated = recompute_distances(activities)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Updated distances of {updated} activities in '
+                f'{elapsed:.1f}s'
+            )
+        )
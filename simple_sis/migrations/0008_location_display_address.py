@@ -0,0 +1,51 @@
+# Generated by Django 3.2.7 on 2026-10-18 01:31
+
+from django.db import migrations, models
+from django.db.models.functions import Concat
+
+# Locations are backfilled in primary key ranges of this size, to keep
+# individual UPDATE statements short on large tables
+BATCH_SIZE = 10000
+
+
+def backfill_display_address(apps, schema_editor):
+    Location = apps.get_model('simple_sis', 'Location')
+    separator = models.Value(', ')
+    display_address = Concat(
+        'address_line_1',
+        models.Case(
+            models.When(address_line_2__isnull=True, then=models.Value('')),
+            default=Concat(separator, 'address_line_2'),
+        ),
+        separator,
+        'city',
+        separator,
+        'state',
+        separator,
+        'postcode',
+        output_field=models.CharField(),
+    )
+
+    last_id = Location.objects.aggregate(last_id=models.Max('id'))['last_id']
+    for start in range(0, (last_id or 0) + 1, BATCH_SIZE):
+        Location.objects.filter(
+            id__gte=start, id__lt=start + BATCH_SIZE
+        ).update(display_address=display_address)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simple_sis', '0007_alter_activityattendee_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='display_address',
+            field=models.CharField(blank=True, editable=False, max_length=500),
+        ),
+        migrations.RunPython(
+            backfill_display_address, migrations.RunPython.noop
+        ),
+    ]
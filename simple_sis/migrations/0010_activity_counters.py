@@ -0,0 +1,72 @@
+# Generated by Django 3.2.7 on 2026-10-18 09:12
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+# Activities are backfilled in primary key ranges of this size, to keep
+# individual UPDATE statements short on large tables
+BATCH_SIZE = 1000
+
+COUNTER_FILTERS = {
+    'attendee_count': models.Q(),
+    'organiser_count': models.Q(is_organiser=True),
+    'approved_count': models.Q(approved_at__isnull=False),
+    'attended_count': models.Q(attended_at__isnull=False),
+}
+
+
+def backfill_counters(apps, schema_editor):
+    Activity = apps.get_model('simple_sis', 'Activity')
+    ActivityAttendee = apps.get_model('simple_sis', 'ActivityAttendee')
+    attendees = ActivityAttendee.objects.filter(
+        activity_id=models.OuterRef('id')
+    ).order_by().values('activity_id')
+    counts = {
+        field: Coalesce(
+            models.Subquery(
+                attendees.filter(filter).annotate(
+                    count=models.Count('id')
+                ).values('count'),
+                output_field=models.IntegerField(),
+            ),
+            0,
+        )
+        for field, filter in COUNTER_FILTERS.items()
+    }
+
+    last_id = Activity.objects.aggregate(last_id=models.Max('id'))['last_id']
+    for start in range(0, (last_id or 0) + 1, BATCH_SIZE):
+        Activity.objects.filter(
+            id__gte=start, id__lt=start + BATCH_SIZE
+        ).update(**counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simple_sis', '0009_location_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='approved_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='attended_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='attendee_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='organiser_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
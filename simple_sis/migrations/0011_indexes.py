@@ -0,0 +1,104 @@
+# Generated by Django 3.2.7 on 2026-10-18 10:05
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+COUNTER_FILTERS = {
+    'attendee_count': models.Q(),
+    'organiser_count': models.Q(is_organiser=True),
+    'approved_count': models.Q(approved_at__isnull=False),
+    'attended_count': models.Q(attended_at__isnull=False),
+}
+
+
+def merge_duplicate_attendees(apps, schema_editor):
+    """Merge users enrolled more than once in an activity into their
+    first enrolment, keeping the earliest approval and attendance, so
+    that the unique constraint can be added.
+    """
+    Activity = apps.get_model('simple_sis', 'Activity')
+    ActivityAttendee = apps.get_model('simple_sis', 'ActivityAttendee')
+    duplicates = ActivityAttendee.objects.order_by().values(
+        'activity_id', 'user_id'
+    ).annotate(
+        count=models.Count('id'),
+        keep=models.Min('id'),
+        is_organiser=models.Max('is_organiser'),
+        approved_at=models.Min('approved_at'),
+        attended_at=models.Min('attended_at'),
+    ).filter(count__gt=1)
+
+    activity_ids = set()
+    for row in duplicates.iterator():
+        attendees = ActivityAttendee.objects.filter(
+            activity_id=row['activity_id'], user_id=row['user_id']
+        )
+        attendees.exclude(id=row['keep']).delete()
+        attendees.update(
+            is_organiser=row['is_organiser'],
+            approved_at=row['approved_at'],
+            attended_at=row['attended_at'],
+        )
+        activity_ids.add(row['activity_id'])
+    if not activity_ids:
+        return
+
+    # The merged attendees were counted more than once
+    attendees = ActivityAttendee.objects.filter(
+        activity_id=models.OuterRef('id')
+    ).order_by().values('activity_id')
+    Activity.objects.filter(id__in=activity_ids).update(
+        **{
+            field: Coalesce(
+                models.Subquery(
+                    attendees.filter(filter).annotate(
+                        count=models.Count('id')
+                    ).values('count'),
+                    output_field=models.IntegerField(),
+                ),
+                0,
+            )
+            for field, filter in COUNTER_FILTERS.items()
+        }
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simple_sis', '0010_activity_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['school', 'start_date', 'id'], name='activity_school_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['updated_date'], name='activity_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activityattendee',
+            index=models.Index(fields=['activity', 'is_organiser', 'id'], name='attendee_roster_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activityattendee',
+            index=models.Index(fields=['user', 'is_organiser'], name='attendee_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['updated_date'], name='location_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='venue',
+            index=models.Index(fields=['updated_date'], name='venue_updated_idx'),
+        ),
+        migrations.RunPython(
+            merge_duplicate_attendees, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='activityattendee',
+            constraint=models.UniqueConstraint(fields=('activity', 'user'), name='unique_activity_attendee'),
+        ),
+    ]
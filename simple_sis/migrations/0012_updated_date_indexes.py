@@ -0,0 +1,21 @@
+# Generated by Django 3.2.7 on 2026-10-18 02:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simple_sis', '0011_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['school', 'updated_date'], name='activity_school_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activityattendee',
+            index=models.Index(fields=['activity', 'updated_date'], name='attendee_updated_idx'),
+        ),
+    ]
@@ -1,7 +1,10 @@
+from collections import Counter
+
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, UserManager as DjangoUserManager
 from django.utils import timezone
-from django.db import models
-from . import validators
+from django.db import models, transaction
+from django.db.models.functions import Concat
+from . import counters, validators
 
 ####################
 #      MIXINS      #
@@ -42,6 +45,15 @@ class ActivityTrackingModel(models.Model):
         help_text='When was this object updated.',
     )
 
+    def save(self, *args, **kwargs):
+        # Caches of rendered objects are keyed by `updated_date`, so
+        # every save has to move it on
+        self.updated_date = timezone.now()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'updated_date' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'updated_date']
+        super().save(*args, **kwargs)
+
 
 ######################
 #      GENERICS      #
@@ -82,6 +94,10 @@ class LookupCodeType(ActivityTrackingModel):
     """Simplified lookup code types for categorising look up codes.
     Omits functionality to set active/inactive for simplicity.
     """
+    # Codes of the lookup code types the app relies on
+    ACTIVITY_TYPE = 'ACTIVITY_TYPE'
+    ACTIVITY_ATTENDEE_TYPE = 'ACTIVITY_ATTENDEE_TYPE'
+
     # PK `id` field is automatically added by Django, but
     # for the sake of verbosity for the challenge, declare
     # it explicitly
@@ -201,6 +217,13 @@ class User(ActivityTrackingModel, AbstractBaseUser, PermissionsMixin):
     #
     objects = UserManager()
 
+    class Meta:
+        indexes = [
+            # Searches of the admin, by prefix
+            models.Index(fields=['first_name'], name='user_first_name_idx'),
+            models.Index(fields=['last_name'], name='user_last_name_idx'),
+        ]
+
 
 class UserAccountType(ActivityTrackingModel):
     """A model representing user account types, e.g. staff, student,
@@ -261,6 +284,114 @@ class States(models.TextChoices):
     NT = 'NT'
 
 
+# Fields making up the address of a location, in display order
+ADDRESS_FIELDS = (
+    'address_line_1',
+    'address_line_2',
+    'city',
+    'state',
+    'postcode',
+)
+
+
+def format_address(*parts):
+    """Join address parts for display, skipping the missing ones."""
+    return ', '.join([x for x in parts if x is not None])
+
+
+def display_address_expression(**values):
+    """A database expression computing the display address of a
+    location, the SQL twin of `format_address()`.
+
+    Address fields can be overridden with literal `values`, e.g. with
+    the new values of an update.
+    """
+    def part(name):
+        return models.Value(values[name]) if name in values else \
+            models.F(name)
+
+    separator = models.Value(', ')
+
+    # Only the second address line is optional, so it either comes with
+    # a leading separator or is left out entirely
+    if 'address_line_2' in values:
+        line_2 = values['address_line_2']
+        line_2 = models.Value('' if line_2 is None else f', {line_2}')
+    else:
+        line_2 = models.Case(
+            models.When(address_line_2__isnull=True, then=models.Value('')),
+            default=Concat(separator, 'address_line_2'),
+        )
+
+    return Concat(
+        part('address_line_1'),
+        line_2,
+        separator,
+        part('city'),
+        separator,
+        part('state'),
+        separator,
+        part('postcode'),
+        output_field=models.CharField(),
+    )
+
+
+class LocationQuerySet(models.QuerySet):
+    """Keeps the denormalised display address of locations in sync, and
+    validates their postcodes, when saving them in bulk.
+    """
+    def update(self, **kwargs):
+        changed = [name for name in ADDRESS_FIELDS if name in kwargs]
+        if not changed:
+            return super().update(**kwargs)
+        # The display address changes, which invalidates cached listings
+        kwargs.setdefault('updated_date', timezone.now())
+
+        if any(
+            hasattr(kwargs[name], 'resolve_expression') for name in changed
+        ):
+            # Values computed by the database are only known once
+            # written, so format the address in a second pass
+            with transaction.atomic(using=self.db):
+                ids = list(self.values_list('id', flat=True))
+                rows = super().update(**kwargs)
+                for start in range(0, len(ids), 1000):
+                    self.model.objects.using(self.db).filter(
+                        id__in=ids[start:start + 1000]
+                    ).update(display_address=display_address_expression())
+                return rows
+
+        # Put the display address first, as MySQL evaluates assignments
+        # of an UPDATE from left to right and would otherwise see the
+        # new values of columns assigned before it. The new values are
+        # part of the expression anyway.
+        return super().update(
+            display_address=display_address_expression(
+                **{name: kwargs[name] for name in changed}
+            ),
+            **kwargs,
+        )
+
+    update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        validators.validate_location_postcodes(objs)
+        for obj in objs:
+            obj.display_address = obj.format_address()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if any(name in fields for name in ADDRESS_FIELDS):
+            objs = list(objs)
+            if 'postcode' in fields or 'state' in fields:
+                validators.validate_location_postcodes(objs)
+            for obj in objs:
+                obj.display_address = obj.format_address()
+            fields = [*fields, 'display_address']
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+
 class Location(ActivityTrackingModel):
     """A generic model to store physical addresses and contact
     details of organisations/places. Used by both the School and
@@ -288,26 +419,120 @@ class Location(ActivityTrackingModel):
     postcode = models.CharField(
         max_length=4, validators=[validators.validate_postcode]
     )
+    # Coordinates of the location in decimal degrees (WGS 84), used to
+    # compute distances between schools and venues
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    # The address formatted for display, denormalised so that listings
+    # can print it straight from a join instead of loading the whole
+    # location. Kept in sync on save and by the bulk methods of the
+    # queryset.
+    display_address = models.CharField(
+        max_length=500,
+        blank=True,
+        editable=False,
+    )
 
-    def __str__(self) -> str:
-        return ', '.join(
-            [
-                x for x in [
-                    self.address_line_1,
-                    self.address_line_2,
-                    self.city,
-                    self.state,
-                    self.postcode,
-                ] if x is not None
-            ]
+    objects = LocationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Finding the latest change, e.g. to version caches
+            models.Index(fields=['updated_date'], name='location_updated_idx'),
+            # Searches of the admin, by prefix
+            models.Index(
+                fields=['display_address'], name='location_address_idx'
+            ),
+            models.Index(fields=['postcode'], name='location_postcode_idx'),
+        ]
+
+    def format_address(self):
+        return format_address(
+            *[getattr(self, name) for name in ADDRESS_FIELDS]
         )
 
+    def clean(self):
+        super().clean()
+        validators.validate_postcode_state(self.postcode, self.state)
+
+    def save(self, *args, **kwargs):
+        self.display_address = self.format_address()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and any(
+            name in update_fields for name in ADDRESS_FIELDS
+        ):
+            kwargs['update_fields'] = [*update_fields, 'display_address']
+        super().save(*args, **kwargs)
+
+    @property
+    def coordinates(self):
+        """A `(latitude, longitude)` tuple, or None when unknown."""
+        if self.latitude is None or self.longitude is None:
+            return None
+        return self.latitude, self.longitude
+
+    def __str__(self) -> str:
+        return self.display_address or self.format_address()
+
 
 ########################
 #      ACTIVITIES      #
 ########################
 
 
+class ActivityQuerySet(models.QuerySet):
+    """Reusable query building blocks for activities, e.g.
+
+    Activity.objects.filter(school=school).upcoming().for_listing()
+    """
+    def for_listing(self):
+        """Join in everything an activity listing row prints, so that
+        rendering a page doesn't fire extra queries per row.
+
+        The venue address is read off the joined location row as
+        `venue_address`, without loading the location itself, along with
+        the `updated_date` of the location as `venue_location_updated`,
+        which keys cached fragments, see `fragments`.
+        """
+        return self.select_related('venue').defer(
+            'venue__description'
+        ).annotate(
+            venue_address=models.F('venue__location__display_address'),
+            venue_location_updated=models.F('venue__location__updated_date'),
+        )
+
+    def upcoming(self):
+        return self.filter(start_date__gte=timezone.now())
+
+    def past(self):
+        return self.filter(start_date__lt=timezone.now())
+
+    def managed_by(self, user):
+        """Activities `user` may manage, e.g. add attendees to: all
+        activities of their school for staff, otherwise the activities
+        they organise.
+        """
+        activities = self.filter(school_id=user.school_id)
+        if not user.is_staff:
+            activities = activities.filter(
+                models.Exists(
+                    ActivityAttendee.objects.filter(
+                        activity_id=models.OuterRef('id'),
+                        user_id=user.id,
+                        is_organiser=True,
+                    )
+                )
+            )
+        return activities
+
+    def delete(self):
+        with counters.deleting_activities():
+            return super().delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class Activity(ActivityTrackingModel):
     """A model representing an event/activity as per the challenge
     requirements.
@@ -336,10 +561,197 @@ class Activity(ActivityTrackingModel):
         on_delete=models.PROTECT,  # Protect if activities exist
         related_name='activities',
     )
-    distance_from_school = models.IntegerField(default=0)  # In metres
+    # In metres, computed from the coordinates of the school and venue
+    # locations by `geodistance`
+    distance_from_school = models.IntegerField(default=0)
+    # Attendance counters, maintained along with the attendees so that
+    # listings don't have to count them, see `counters`
+    attendee_count = models.PositiveIntegerField(default=0, editable=False)
+    organiser_count = models.PositiveIntegerField(default=0, editable=False)
+    approved_count = models.PositiveIntegerField(default=0, editable=False)
+    attended_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = ActivityQuerySet.as_manager()
 
     class Meta:
         verbose_name_plural = 'Activities'
+        indexes = [
+            # Listings of a school's activities, paginated by date
+            models.Index(
+                fields=['school', 'start_date', 'id'],
+                name='activity_school_date_idx',
+            ),
+            models.Index(fields=['updated_date'], name='activity_updated_idx'),
+            # Latest change to a school's activities, see `conditional`
+            models.Index(
+                fields=['school', 'updated_date'],
+                name='activity_school_updated_idx',
+            ),
+            # Searches of the admin, by prefix
+            models.Index(fields=['name'], name='activity_name_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # The counters are only ever changed by increments, see
+        # `counters`, so an activity loaded before its attendees changed
+        # mustn't write its stale counts back
+        if not self._state.adding and not kwargs.get('force_insert') and \
+                kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and
+                field.name not in counters.COUNTER_FIELDS and
+                field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with counters.deleting_activities():
+            return super().delete(*args, **kwargs)
+
+    @property
+    def participant_count(self):
+        return self.attendee_count - self.organiser_count
+
+
+class ActivityAttendeeQuerySet(models.QuerySet):
+    """Bulk changes of attendees, which keep the attendance counters of
+    their activities up to date, see `counters`.
+
+    Status changes are a single UPDATE however many attendees are
+    selected. Attendees who already have the status are left alone, so
+    that the original timestamps are kept and repeating a change is
+    harmless. They return the number of attendees changed.
+    """
+    def _set_status(self, counter, pending, **values):
+        """Update attendees matching `pending` with `values`, counting
+        them towards the `counter` of their activities.
+        """
+        pending = self.filter(pending)
+        with transaction.atomic(using=self.db):
+            if counters.is_paused():
+                return pending.update(**values)
+            # Lock the attendees, so that the counts match the rows the
+            # UPDATE changes
+            changed = Counter(
+                pending.select_for_update().values_list(
+                    'activity_id', flat=True
+                )
+            )
+            if not changed:
+                return 0
+            updated = pending.update(**values)
+            deltas = counters.CounterDeltas()
+            counts = tuple(
+                int(field == counter) for field in counters.COUNTER_FIELDS
+            )
+            for activity_id, count in changed.items():
+                deltas.add(activity_id, counts, count)
+            deltas.apply()
+            return updated
+
+    def approve(self, user, now=None):
+        now = now or timezone.now()
+        return self._set_status(
+            'approved_count',
+            models.Q(approved_at__isnull=True),
+            approved_at=now,
+            approved_by=user,
+            updated_by=user,
+            updated_date=now,
+        )
+
+    approve.alters_data = True
+
+    def mark_attended(self, user, now=None):
+        now = now or timezone.now()
+        return self._set_status(
+            'attended_count',
+            models.Q(attended_at__isnull=True),
+            attended_at=now,
+            updated_by=user,
+            updated_date=now,
+        )
+
+    mark_attended.alters_data = True
+
+    def mark_attended_at(self, times, user, now=None):
+        """Record attendance times of many attendees at once, given as a
+        dict of attendee ids mapped to when they arrived, e.g. synced
+        from a device which was offline.
+
+        When an attendee was already recorded, the earlier time wins,
+        as the first scan at the gate is the actual arrival. Returns
+        the number of attendees changed.
+        """
+        if not times:
+            return 0
+        now = now or timezone.now()
+        with transaction.atomic(using=self.db):
+            # Lock the attendees, so that a concurrent check-in can't
+            # sneak in between comparing and writing the times
+            current = self.select_for_update().filter(
+                id__in=times
+            ).values_list('id', 'activity_id', 'attended_at')
+            changed = {}
+            deltas = counters.CounterDeltas()
+            for id, activity_id, attended_at in current:
+                if attended_at is None:
+                    deltas.add(activity_id, (0, 0, 0, 1))
+                elif attended_at <= times[id]:
+                    continue
+                changed[id] = times[id]
+            if not changed:
+                return 0
+            updated = self.filter(id__in=changed).update(
+                attended_at=models.Case(
+                    *[
+                        models.When(id=id, then=models.Value(time))
+                        for id, time in changed.items()
+                    ],
+                    output_field=models.DateTimeField(),
+                ),
+                updated_by=user,
+                updated_date=now,
+            )
+            deltas.apply()
+            return updated
+
+    mark_attended_at.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        deltas = counters.CounterDeltas()
+        for obj in objs:
+            deltas.add(obj.activity_id, obj.counts())
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            deltas.apply()
+        return objs
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            deltas = counters.CounterDeltas()
+            for row in self.order_by().values('activity_id').annotate(
+                **{
+                    field: models.Count('id', filter=filter)
+                    for field, filter in counters.COUNTER_FILTERS.items()
+                }
+            ):
+                deltas.add(
+                    row['activity_id'],
+                    [row[field] for field in counters.COUNTER_FIELDS],
+                    -1,
+                )
+            # Keep the signal handlers from counting every attendee
+            with counters.paused():
+                deleted = super().delete()
+            deltas.apply()
+            return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
 
 
 class ActivityAttendee(ActivityTrackingModel):
@@ -385,6 +797,57 @@ class ActivityAttendee(ActivityTrackingModel):
     # a digital tablet/mobile device
     attended_at = models.DateTimeField(null=True)
 
+    objects = ActivityAttendeeQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['activity', 'user'], name='unique_activity_attendee'
+            ),
+        ]
+        indexes = [
+            # Roster sections, paginated by id
+            models.Index(
+                fields=['activity', 'is_organiser', 'id'],
+                name='attendee_roster_idx',
+            ),
+            # Activities a user attends or organises
+            models.Index(
+                fields=['user', 'is_organiser'], name='attendee_user_idx'
+            ),
+            # Latest change to a roster, see `conditional`
+            models.Index(
+                fields=['activity', 'updated_date'],
+                name='attendee_updated_idx',
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the attendee counted towards when loaded, so
+        # that saving it can adjust the counters by the difference
+        instance._counted = instance.counted()
+        return instance
+
+    def counts(self):
+        """What the attendee counts towards, as a tuple in the order of
+        `counters.COUNTER_FIELDS`.
+        """
+        return counters.attendee_counts(
+            self.is_organiser, self.approved_at, self.attended_at
+        )
+
+    def counted(self):
+        """A tuple of the activity id and counts of the attendee, or
+        None if some of the fields they depend on weren't loaded.
+        """
+        if self.get_deferred_fields() & {
+            'activity_id', 'is_organiser', 'approved_at', 'attended_at'
+        }:
+            return None
+        return self.activity_id, self.counts()
+
 
 ####################
 #      VENUES      #
@@ -406,5 +869,10 @@ class Venue(ActivityTrackingModel):
         related_name='+',
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_date'], name='venue_updated_idx'),
+        ]
+
     def __str__(self) -> str:
         return f'{self.name}'
\ No newline at end of file
@@ -0,0 +1,169 @@
+"""Keyset (a.k.a. cursor or seek) pagination.
+
+Unlike OFFSET pagination, which makes the database walk through and
+throw away every row before the requested page, keyset pagination
+remembers the sort key of the last row shown and asks for the rows
+that come "after" it. As long as the sort key is backed by an index,
+every page costs the same no matter how deep into a listing the user
+has scrolled.
+"""
+import base64
+import json
+
+from django.core.exceptions import BadRequest, ValidationError
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 25
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+class KeysetPage:
+    """A single page of results along with the cursors required to
+    fetch its neighbours.
+    """
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _split_key(key):
+    """Split an `order_by()` style key into a field name and a flag
+    telling whether the key is sorted in descending order.
+    """
+    if key.startswith('-'):
+        return key[1:], True
+    return key, False
+
+
+def _encode_cursor(obj, keys):
+    values = []
+    for key in keys:
+        name, _ = _split_key(key)
+        value = getattr(obj, obj._meta.get_field(name).attname)
+        values.append(
+            value.isoformat() if hasattr(value, 'isoformat') else value
+        )
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_cursor(cursor, model, keys):
+    """Turn a cursor back into a list of Python values, raising
+    `BadRequest` (i.e. HTTP 400) if it was tampered with.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError
+        return [
+            model._meta.get_field(_split_key(key)[0]).to_python(value)
+            for key, value in zip(keys, values)
+        ]
+    except (ValueError, TypeError, ValidationError):
+        raise BadRequest('Invalid page cursor')
+
+
+def _seek_filter(keys, values, backwards):
+    """Build the WHERE clause selecting rows that sort after (or before,
+    when `backwards` is set) the given key values, i.e. for keys
+    `(a, b)` this is `a > x OR (a = x AND b > y)`.
+    """
+    condition = Q()
+    for i, key in enumerate(keys):
+        name, descending = _split_key(key)
+        lookup = 'lt' if descending != backwards else 'gt'
+        clause = Q(**{f'{name}__{lookup}': values[i]})
+        for prior_key, prior_value in zip(keys[:i], values[:i]):
+            clause &= Q(**{_split_key(prior_key)[0]: prior_value})
+        condition |= clause
+    return condition
+
+
+def _reverse_key(key):
+    name, descending = _split_key(key)
+    return name if descending else f'-{name}'
+
+
+def paginate(
+    queryset, keys, after=None, before=None, page_size=DEFAULT_PAGE_SIZE
+):
+    """Return a `KeysetPage` of `queryset` ordered by `keys`.
+
+    `keys` must uniquely identify a row (so always end with the primary
+    key) and follow the `order_by()` syntax, e.g. `('-start_date', '-id')`.
+    `after` and `before` are cursors taken from a previously returned
+    page; only one of them is expected to be set.
+    """
+    keys = tuple(keys)
+    model = queryset.model
+    backwards = bool(before) and not after
+    cursor = before if backwards else after
+
+    if cursor:
+        values = _decode_cursor(cursor, model, keys)
+        queryset = queryset.filter(_seek_filter(keys, values, backwards))
+
+    ordering = [_reverse_key(key) for key in keys] if backwards else keys
+    # Fetch a single extra row to find out whether there's more to come
+    # without having to run a separate COUNT query
+    items = list(queryset.order_by(*ordering)[:page_size + 1])
+    has_more = len(items) > page_size
+    items = items[:page_size]
+
+    if backwards:
+        items.reverse()
+        has_next, has_previous = True, has_more
+    else:
+        has_next, has_previous = has_more, bool(cursor)
+
+    if not items:
+        return KeysetPage(items)
+
+    return KeysetPage(
+        items,
+        next_cursor=_encode_cursor(items[-1], keys) if has_next else None,
+        previous_cursor=_encode_cursor(items[0], keys)
+        if has_previous else None,
+    )
+
+
+def iter_chunks(queryset, keys, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the rows of a `values()` queryset ordered by `keys` in
+    lists of up to `chunk_size` rows, e.g. for exports.
+
+    Every chunk is fetched by seeking past the last row of the previous
+    one, so that neither the app nor the database driver ever holds
+    more than a chunk, unlike `iterator()`, which some drivers (e.g.
+    MySQL's) fetch in full. The values have to include the keys.
+    """
+    keys = tuple(keys)
+    names = [_split_key(key)[0] for key in keys]
+    queryset = queryset.order_by(*keys)
+    chunk = list(queryset[:chunk_size])
+    while chunk:
+        yield chunk
+        if len(chunk) < chunk_size:
+            break
+        last = chunk[-1]
+        chunk = list(
+            queryset.filter(
+                _seek_filter(keys, [last[name] for name in names], False)
+            )[:chunk_size]
+        )
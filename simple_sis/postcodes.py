@@ -0,0 +1,113 @@
+"""Reference table of Australian postcodes.
+
+Postcodes are allocated to states in ranges, so the table is a short
+list of ranges, each with the state it belongs to and the approximate
+centroid of the area it covers. On import, the ranges are expanded
+into a lookup table of every existing postcode, which makes checking
+a postcode a single dict lookup, and validating a whole column of
+postcodes, e.g. 100k rows of an import, a matter of milliseconds.
+
+The centroids are deliberately coarse, they're only meant as a
+fallback for distances of locations without coordinates. Finer
+ranges can be added to the table without any code changes.
+"""
+from itertools import compress, count, repeat
+from operator import ne, not_
+
+# (first postcode, last postcode, state, (latitude, longitude))
+POSTCODE_RANGES = (
+    (800, 899, 'NT', (-12.46, 130.84)),
+    (2000, 2599, 'NSW', (-33.87, 151.21)),
+    (2600, 2618, 'ACT', (-35.28, 149.13)),
+    (2619, 2899, 'NSW', (-33.28, 148.20)),
+    (2900, 2920, 'ACT', (-35.28, 149.13)),
+    (2921, 2999, 'NSW', (-35.12, 147.37)),
+    (3000, 3999, 'VIC', (-37.81, 144.96)),
+    (4000, 4999, 'QLD', (-27.47, 153.03)),
+    (5000, 5799, 'SA', (-34.93, 138.60)),
+    (6000, 6797, 'WA', (-31.95, 115.86)),
+    (7000, 7799, 'TAS', (-42.88, 147.33)),
+)
+
+# Every existing postcode, zero padded to four digits, mapped to its
+# state and approximate centroid
+_STATE_OF = {}
+_CENTROID_OF = {}
+for _first, _last, _state, _centroid in POSTCODE_RANGES:
+    for _postcode in range(_first, _last + 1):
+        _STATE_OF[f'{_postcode:04}'] = _state
+        _CENTROID_OF[f'{_postcode:04}'] = _centroid
+del _first, _last, _state, _centroid, _postcode
+
+# State of postcodes which don't exist, never equal to any state
+_INVALID = object()
+
+
+def normalize_postcode(value):
+    """Return a postcode zero padded to four digits, or None if it's
+    not a number.
+    """
+    value = str(value).strip()
+    if not value.isdigit():
+        return None
+    return value.zfill(4)
+
+
+def postcode_state(value):
+    """Return the state a postcode belongs to, or None if the postcode
+    doesn't exist.
+    """
+    return _STATE_OF.get(normalize_postcode(value))
+
+
+def postcode_centroid(value):
+    """Return the approximate `(latitude, longitude)` of a postcode,
+    or None if the postcode doesn't exist.
+    """
+    return _CENTROID_OF.get(normalize_postcode(value))
+
+
+def check_postcode(value, state=None):
+    """Return why a postcode is invalid, optionally also for the given
+    state, or None if it's valid.
+    """
+    postcode = normalize_postcode(value)
+    if postcode is None:
+        return 'Postcode must be a number'
+    if postcode not in _STATE_OF:
+        return 'Invalid postcode'
+    if state and _STATE_OF[postcode] != state:
+        return f'Postcode {value} is not in {state}'
+    return None
+
+
+def check_postcodes(postcodes, states=None):
+    """Validate a whole column of postcodes, optionally against a
+    matching column of states, e.g. of rows being imported.
+
+    Returns a dict of the positions of invalid postcodes mapped to
+    the reasons, empty if all of them are valid.
+    """
+    postcodes = list(postcodes)
+    # Spot the rows which may be invalid with C level iteration only,
+    # so that the well formed rows, i.e. nearly all of them, cost a
+    # single dict lookup each
+    if states is None:
+        suspects = compress(
+            count(), map(not_, map(_STATE_OF.__contains__, postcodes))
+        )
+    else:
+        states = list(states)
+        suspects = compress(
+            count(),
+            map(ne, map(_STATE_OF.get, postcodes, repeat(_INVALID)), states),
+        )
+
+    errors = {}
+    for position in suspects:
+        error = check_postcode(
+            postcodes[position], states and states[position]
+        )
+        if error:
+            errors[position] = error
+    return errors
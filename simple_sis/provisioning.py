@@ -0,0 +1,332 @@
+"""Bulk provisioning of the users of a school from a roster, e.g. at the
+start of a school year or by a nightly sync with another system.
+
+A roster lists the users of a school, one per row of a CSV file or per
+object of a JSON array, by their email, names, account type (by name,
+e.g. `Student`) and optionally an initial password, e.g.
+
+    email,first_name,last_name,account_type,password
+    jane@example.com,Jane,Doe,Student,s3cret
+
+It's diffed against the existing users by email, regardless of case:
+
+- users who don't exist yet are created. Hashing passwords is
+  deliberately slow, so their passwords are hashed by a pool of
+  processes, one per core by default. Users listed without a password
+  get an unusable one, e.g. to be reset by email.
+- existing users of the school are updated where their names or
+  account type differ, and reactivated if they were deactivated. Their
+  passwords are left alone. Users of other schools, and staff and
+  superusers, are reported as errors and left alone, so that a roster
+  can't take their accounts over.
+- active users of the school missing from the roster are deactivated,
+  but only those of the account types listed by the roster, so that
+  e.g. a roster of students leaves the staff alone. Users listed by
+  invalid rows are left alone too, and a roster with any invalid rows
+  deactivates no one unless told to, so that e.g. a misspelt account
+  type can't lock users out.
+
+The changes are written by batched bulk inserts and updates in a single
+transaction, once the passwords are hashed. Bulk writes don't send
+signals, so the cached snapshots of the changed users are dropped
+explicitly, see `authentication`. A dry run only reports what would
+change, without hashing or writing anything.
+"""
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from .authentication import forget_users
+from .models import User, UserAccountType
+
+PROVISIONING_BATCH_SIZE = 2000
+
+# Only the first errors are kept, the rest are just counted
+MAX_REPORTED_ERRORS = 1000
+
+# Only the first emails of every kind of change are reported
+MAX_REPORTED_EMAILS = 100
+
+REQUIRED_FIELDS = ('email', 'account_type')
+
+# Fields of existing users updated from the roster
+SYNCED_FIELDS = (
+    'first_name',
+    'last_name',
+    'account_type_id',
+    'is_active',
+)
+
+CHANGES = ('created', 'updated', 'deactivated')
+
+
+def batches(items, size):
+    """Yield lists of up to `size` of `items`."""
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def hash_passwords(passwords, workers=None):
+    """Hashes of `passwords`, in the same order, spread across a pool
+    of `workers` processes, by default one per core.
+    """
+    workers = min(workers or os.cpu_count() or 1, len(passwords))
+    if workers <= 1:
+        return [make_password(password) for password in passwords]
+    with ProcessPoolExecutor(workers) as executor:
+        # A few tasks per process keep them busy until the end, without
+        # a round trip per password
+        chunk_size = -(-len(passwords) // (workers * 4))
+        return list(
+            executor.map(make_password, passwords, chunksize=chunk_size)
+        )
+
+
+def read_csv(lines):
+    """Yield `(line number, row)` of every row of a CSV roster."""
+    reader = csv.DictReader(lines)
+    reader.fieldnames = [
+        name.strip().lower() for name in reader.fieldnames or []
+    ]
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_json(file):
+    """Yield `(position, row)` of every object of a JSON roster."""
+    rows = json.load(file)
+    if not isinstance(rows, list):
+        raise ValueError('A JSON roster has to be an array of objects')
+    for position, row in enumerate(rows, 1):
+        yield position, row if isinstance(row, dict) else {}
+
+
+class RosterSync:
+    """Provisions the users of a school from a roster, see module docs.
+    """
+    def __init__(
+        self,
+        school_id,
+        provisioned_by=None,
+        dry_run=False,
+        workers=None,
+        batch_size=PROVISIONING_BATCH_SIZE,
+        deactivate_despite_errors=False,
+    ):
+        self.school_id = school_id
+        self.provisioned_by_id = provisioned_by and provisioned_by.id
+        self.dry_run = dry_run
+        self.workers = workers
+        self.batch_size = batch_size
+        self.deactivate_despite_errors = deactivate_despite_errors
+        self.now = timezone.now()
+        self.counts = dict.fromkeys((*CHANGES, 'unchanged'), 0)
+        self.emails = {change: [] for change in CHANGES}
+        self.error_count = 0
+        self.errors = []  # (row, message) tuples
+        self.rows = {}  # Row numbers by lowercase email
+        self.rejected = set()  # Lowercase emails of invalid rows
+        # Users who'd have been deactivated but for invalid rows
+        self.skipped_deactivations = 0
+        self.account_types = {
+            name.lower(): id
+            for id, name in UserAccountType.objects.values_list('id', 'name')
+        }
+
+    def error(self, row, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((row, message))
+
+    def record(self, change, emails):
+        self.counts[change] += len(emails)
+        reported = self.emails[change]
+        reported.extend(emails[:MAX_REPORTED_EMAILS - len(reported)])
+
+    def run(self, rows):
+        """Sync the users of the school with a roster, given as
+        `(row number, row)` pairs, e.g. by `read_csv()`. Returns self,
+        holding the counts and errors.
+        """
+        roster = self.read(rows)
+        new, changed = self.diff(roster)
+        deactivated = self.missing(roster)
+        if self.error_count and not self.deactivate_despite_errors:
+            self.skipped_deactivations = len(deactivated)
+            deactivated = []
+
+        self.record('created', [user.email for user in new])
+        self.record('updated', [user.email for user in changed])
+        self.record('deactivated', [email for _, email in deactivated])
+        if self.dry_run:
+            return self
+
+        hashes = iter(
+            hash_passwords(
+                [user.password for user in new if user.password],
+                self.workers,
+            )
+        )
+        for user in new:
+            # Users listed without a password get an unusable one, which
+            # takes no hashing
+            user.password = (
+                next(hashes) if user.password else make_password(None)
+            )
+
+        forgotten = [user.id for user in changed]
+        forgotten += [id for id, _ in deactivated]
+        with transaction.atomic():
+            User.objects.bulk_create(new, batch_size=self.batch_size)
+            User.objects.bulk_update(
+                changed,
+                [*SYNCED_FIELDS, 'updated_by', 'updated_date'],
+                batch_size=self.batch_size,
+            )
+            for batch in batches(deactivated, self.batch_size):
+                User.objects.filter(id__in=[id for id, _ in batch]).update(
+                    is_active=False,
+                    updated_by_id=self.provisioned_by_id,
+                    updated_date=self.now,
+                )
+            transaction.on_commit(lambda: forget_users(forgotten))
+        return self
+
+    def read(self, rows):
+        """The valid rows of a roster, as users to be, by lowercase
+        email.
+        """
+        roster = {}
+        for row, values in rows:
+            values = {
+                str(key).strip().lower(): str(value or '').strip()
+                for key, value in values.items()
+            }
+            if values.get('email'):
+                # Until the row proves valid, see `missing()`
+                self.rejected.add(
+                    User.objects.normalize_email(values['email']).lower()
+                )
+            missing = [key for key in REQUIRED_FIELDS if not values.get(key)]
+            if missing:
+                self.error(row, f'Missing {", ".join(missing)}')
+                continue
+            account_type = values['account_type']
+            account_type_id = self.account_types.get(account_type.lower())
+            if account_type_id is None:
+                self.error(row, f'Unknown account type "{account_type}"')
+                continue
+            email = User.objects.normalize_email(values['email'])
+            if email.lower() in roster:
+                self.error(row, f'Duplicate email "{email}"')
+                continue
+            self.rejected.discard(email.lower())
+            self.rows[email.lower()] = row
+            roster[email.lower()] = User(
+                email=email,
+                first_name=values.get('first_name') or None,
+                last_name=values.get('last_name') or None,
+                account_type_id=account_type_id,
+                school_id=self.school_id,
+                # Hashed once the users to be created are known
+                password=values.get('password', ''),
+                created_by_id=self.provisioned_by_id,
+                created_date=self.now,
+                updated_by_id=self.provisioned_by_id,
+                updated_date=self.now,
+            )
+        return roster
+
+    def diff(self, roster):
+        """The users of a roster to be created, and the existing users
+        of the school to be updated, changed accordingly. Users listed
+        who may not be provisioned, see module docs, are reported.
+        """
+        new = []
+        changed = []
+        for emails in batches(roster, self.batch_size):
+            # Emails match regardless of case, like MySQL compares them.
+            # They're queried as listed too, for databases comparing
+            # them as is, e.g. SQLite.
+            listed_emails = [roster[email].email for email in emails]
+            existing = User.objects.filter(
+                email__in={*emails, *listed_emails}
+            ).only(
+                'id',
+                'email',
+                'school_id',
+                'is_staff',
+                'is_superuser',
+                *SYNCED_FIELDS,
+            )
+            found = {user.email.lower(): user for user in existing}
+            for email in emails:
+                user = found.get(email)
+                if user is None:
+                    new.append(roster[email])
+                    continue
+                if user.school_id != self.school_id:
+                    self.error(
+                        self.rows[email],
+                        f'User "{user.email}" belongs to another school',
+                    )
+                    continue
+                if user.is_staff or user.is_superuser:
+                    self.error(
+                        self.rows[email], f'User "{user.email}" is an admin'
+                    )
+                    continue
+                listed = roster[email]
+                listed.is_active = True
+                if all(
+                    getattr(user, field) == getattr(listed, field)
+                    for field in SYNCED_FIELDS
+                ):
+                    self.counts['unchanged'] += 1
+                    continue
+                for field in SYNCED_FIELDS:
+                    setattr(user, field, getattr(listed, field))
+                user.updated_by_id = self.provisioned_by_id
+                user.updated_date = self.now
+                changed.append(user)
+        return new, changed
+
+    def missing(self, roster):
+        """`(id, email)` of the active users of the school, of the
+        account types listed by the roster, missing from it, other than
+        those of rows rejected as invalid.
+        """
+        account_type_ids = {user.account_type_id for user in roster.values()}
+        active = User.objects.filter(
+            school_id=self.school_id,
+            account_type_id__in=account_type_ids,
+            is_active=True,
+        ).values_list('id', 'email')
+        return [
+            (id, email) for id, email in active.iterator()
+            if email.lower() not in roster and
+            email.lower() not in self.rejected
+        ]
+
+    def as_dict(self):
+        return {
+            'dry_run': self.dry_run,
+            **self.counts,
+            'emails': self.emails,
+            'skipped_deactivations': self.skipped_deactivations,
+            'error_count': self.error_count,
+            'errors': [
+                {'row': row, 'error': message}
+                for row, message in self.errors
+            ],
+        }
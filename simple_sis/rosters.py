@@ -0,0 +1,122 @@
+"""Loading of activity rosters, i.e. the lists of organisers and
+participants of an activity.
+
+Rosters of whole-of-school events can run into thousands of attendees,
+so they are never loaded in full. Instead, each section of a roster is
+served in keyset-paginated pages, while the counts shown alongside are
+read off the attendance counters of the activity.
+"""
+from django.db.models import Q
+
+from .models import ActivityAttendee
+from .pagination import paginate
+
+ROSTER_PAGE_SIZE = 50
+
+# Roster sections mapped to the `is_organiser` flag of their attendees
+ROSTER_SECTIONS = {
+    'organisers': True,
+    'participants': False,
+}
+
+# Server-side filters by approval/attendance status
+ROSTER_STATUSES = {
+    'approved': Q(approved_at__isnull=False),
+    'pending': Q(approved_at__isnull=True),
+    'attended': Q(attended_at__isnull=False),
+    'absent': Q(attended_at__isnull=True),
+}
+
+
+class RosterSection:
+    """A group of attendees of an activity, e.g. organisers, along with
+    their total count.
+
+    Only the first page of attendees is loaded, further pages are
+    fetched on demand by the browser.
+    """
+    def __init__(self, name, page, total_count):
+        self.name = name
+        self.page = page
+        self.total_count = total_count
+
+    def __iter__(self):
+        return iter(self.page)
+
+    def __len__(self):
+        return self.total_count
+
+
+class Roster:
+    """The roster of an activity split into organisers and
+    participants.
+    """
+    def __init__(self, organisers, participants):
+        self.organisers = organisers
+        self.participants = participants
+
+    @property
+    def total_count(self):
+        return self.organisers.total_count + self.participants.total_count
+
+
+def roster_queryset(activity_id, section, status=None, search=None):
+    """Attendees of one roster section of an activity, optionally
+    narrowed down by status and a free text name/email search.
+
+    Users are joined in, so that rendering the roster doesn't fire
+    extra queries per attendee. Attendee types are resolved through
+    the lookup code cache instead.
+    """
+    queryset = ActivityAttendee.objects.filter(
+        activity_id=activity_id,
+        is_organiser=ROSTER_SECTIONS[section],
+    ).select_related('user')
+
+    if status in ROSTER_STATUSES:
+        queryset = queryset.filter(ROSTER_STATUSES[status])
+
+    # Every word of the search has to match a part of the name or email
+    for term in (search or '').split():
+        queryset = queryset.filter(
+            Q(user__first_name__icontains=term) |
+            Q(user__last_name__icontains=term) |
+            Q(user__email__icontains=term)
+        )
+
+    return queryset
+
+
+def roster_page(
+    activity_id,
+    section,
+    status=None,
+    search=None,
+    after=None,
+    page_size=ROSTER_PAGE_SIZE,
+):
+    """A single page of a roster section, in enrolment order."""
+    return paginate(
+        roster_queryset(activity_id, section, status, search),
+        ('id', ),
+        after=after,
+        page_size=page_size,
+    )
+
+
+def load_roster(activity, page_size=ROSTER_PAGE_SIZE):
+    """Load the first page of every roster section of `activity`. Costs
+    the same fixed number of queries whatever the size of the roster.
+    """
+    return Roster(
+        organisers=RosterSection(
+            'organisers',
+            roster_page(activity.id, 'organisers', page_size=page_size),
+            activity.organiser_count,
+        ),
+        participants=RosterSection(
+            'participants',
+            roster_page(activity.id, 'participants', page_size=page_size),
+            activity.participant_count,
+        ),
+    )
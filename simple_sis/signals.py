@@ -0,0 +1,183 @@
+"""Signal handlers keeping caches and derived data in sync with
+changes made through the ORM, including the admin.
+"""
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from . import counters, databases, geodistance, live
+from .authentication import forget_users
+from .lookups import lookup_codes
+from .models import (
+    Activity,
+    ActivityAttendee,
+    Location,
+    LookupCode,
+    LookupCodeType,
+    School,
+    User,
+    Venue,
+)
+from .spatial import venue_index
+
+
+@receiver(post_save, sender=LookupCode)
+@receiver(post_delete, sender=LookupCode)
+@receiver(post_save, sender=LookupCodeType)
+@receiver(post_delete, sender=LookupCodeType)
+def invalidate_lookup_codes(sender, **kwargs):
+    lookup_codes.invalidate()
+
+
+@receiver(pre_save, sender=Activity)
+def set_distance_from_school(sender, instance, raw, **kwargs):
+    # Leave fixtures alone
+    if raw:
+        return
+    distance = geodistance.activity_distance(
+        instance.school_id, instance.venue_id
+    )
+    if distance is not None:
+        instance.distance_from_school = distance
+
+
+@receiver(post_save, sender=Location)
+def recompute_location_distances(sender, instance, raw, **kwargs):
+    if raw or geodistance.approximate_coordinates(
+        instance.latitude, instance.longitude, instance.postcode
+    ) is None:
+        return
+    transaction.on_commit(
+        lambda: geodistance.recompute_location_distances(instance.id)
+    )
+
+
+@receiver(post_save, sender=School)
+def recompute_school_distances(sender, instance, raw, created, **kwargs):
+    # A new school has no activities yet
+    if raw or created:
+        return
+    transaction.on_commit(
+        lambda: geodistance.recompute_school_distances([instance.id])
+    )
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user(sender, instance, **kwargs):
+    # Again once committed, as other requests may cache the user as it
+    # was before the transaction committed in the meantime
+    forget_users([instance.id])
+    transaction.on_commit(lambda: forget_users([instance.id]))
+
+
+@receiver(post_save, sender=School)
+def forget_school_users(sender, instance, raw, created, **kwargs):
+    # A new school has no users yet
+    if raw or created:
+        return
+    user_ids = list(
+        User.objects.filter(school_id=instance.id).values_list(
+            'id', flat=True
+        )
+    )
+    if user_ids:
+        transaction.on_commit(lambda: forget_users(user_ids))
+
+
+@receiver(post_save, sender=Venue)
+def recompute_venue_distances(sender, instance, raw, created, **kwargs):
+    if raw or created:
+        return
+    activities = Activity.objects.filter(venue_id=instance.id)
+    transaction.on_commit(
+        lambda: geodistance.recompute_distances(activities)
+    )
+
+
+@receiver(post_save, sender=Venue)
+def reindex_venue(sender, instance, raw, **kwargs):
+    transaction.on_commit(lambda: venue_index.refresh_venues([instance.id]))
+
+
+@receiver(post_delete, sender=Venue)
+def unindex_venue(sender, instance, **kwargs):
+    transaction.on_commit(lambda: venue_index.remove_venue(instance.id))
+
+
+@receiver(post_save, sender=Location)
+def reindex_location_venues(sender, instance, raw, created, **kwargs):
+    # A new location has no venues yet
+    if raw or created:
+        return
+    venue_ids = list(
+        Venue.objects.filter(location_id=instance.id).values_list(
+            'id', flat=True
+        )
+    )
+    if venue_ids:
+        transaction.on_commit(lambda: venue_index.refresh_venues(venue_ids))
+
+
+@receiver(post_save, sender=ActivityAttendee)
+def count_attendee(sender, instance, raw, created, **kwargs):
+    # Fixtures are counted by the `recompute_counters` command
+    if raw or counters.is_paused():
+        return
+    previous = None if created else getattr(instance, '_counted', None)
+    if previous is None and not created:
+        # Unknown what the attendee counted towards before, e.g. when
+        # saved with deferred fields
+        counters.recompute_counters(
+            Activity.objects.filter(id=instance.activity_id)
+        )
+    else:
+        deltas = counters.CounterDeltas()
+        if previous is not None:
+            deltas.add(*previous, sign=-1)
+        deltas.add(instance.activity_id, instance.counts())
+        deltas.apply()
+    instance._counted = instance.counted()
+
+
+@receiver(post_delete, sender=ActivityAttendee)
+def uncount_attendee(sender, instance, **kwargs):
+    if counters.is_paused():
+        return
+    deltas = counters.CounterDeltas()
+    deltas.add(
+        *(
+            getattr(instance, '_counted', None) or
+            (instance.activity_id, instance.counts())
+        ),
+        sign=-1,
+    )
+    deltas.apply()
+
+
+@receiver(pre_delete, sender=Activity)
+def start_deleting_activity(sender, instance, **kwargs):
+    # Deleting an activity deletes its attendees first, there's no
+    # point in updating its counters for each of them
+    counters.deleting([instance.id])
+
+
+@receiver(post_delete, sender=Activity)
+def finish_deleting_activity(sender, instance, **kwargs):
+    counters.done_deleting([instance.id])
+
+
+@receiver(counters.attendance_changed)
+def push_attendance(sender, activity_ids, **kwargs):
+    live.broker.changed(activity_ids)
+
+
+@receiver(request_started)
+def check_connections(sender, **kwargs):
+    databases.check_connections()
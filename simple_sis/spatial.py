@@ -0,0 +1,257 @@
+"""In-memory spatial index of venues, answering "k nearest venues
+within R km of a point" without scanning every location.
+
+Venues are bucketed into a grid of `CELL_SIZE` degree cells. A search
+walks rings of cells outwards from the cell of the point and stops as
+soon as no unvisited cell can hold anything closer than the k nearest
+venues found so far, or anything within the radius.
+
+The index is built on first use and kept up to date incrementally when
+venues or their locations are saved in this process. Other processes
+rebuild their index once they notice the change, see
+`caching.VersionStamp`.
+"""
+import math
+import threading
+
+from django.db import DatabaseError
+
+from .caching import VersionStamp
+
+# Size of grid cells in degrees, about 11km in latitude
+CELL_SIZE = 0.1
+
+# Length of a degree of latitude in km
+DEGREE_KM = 111.195
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance in km between two points given in decimal
+    degrees.
+    """
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2)**2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2)**2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def cell_of(latitude, longitude):
+    return (
+        math.floor(latitude / CELL_SIZE),
+        math.floor(longitude / CELL_SIZE),
+    )
+
+
+class IndexedVenue:
+    """A venue entry of the index, holding everything needed to list
+    the venue without touching the database.
+    """
+    __slots__ = ('id', 'name', 'address', 'latitude', 'longitude')
+
+    def __init__(self, id, name, address, latitude, longitude):
+        self.id = id
+        self.name = name
+        self.address = address
+        self.latitude = latitude
+        self.longitude = longitude
+
+
+class VenueIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._venues = None  # Venue ids mapped to `IndexedVenue`s
+        self._cells = None  # Grid cells mapped to sets of venue ids
+        self._bounds = None  # Min/max rows and columns of the grid
+        self._version = VersionStamp('simple_sis:venue_index:version')
+
+    def _build(self):
+        from .models import Venue
+
+        self._version.fetch()
+        self._venues = {}
+        self._cells = {}
+        self._bounds = None
+        rows = Venue.objects.filter(
+            location__latitude__isnull=False,
+            location__longitude__isnull=False,
+        ).values_list(
+            'id',
+            'name',
+            'location__display_address',
+            'location__latitude',
+            'location__longitude',
+        )
+        for row in rows.iterator():
+            self._add(IndexedVenue(*row))
+
+    def _fresh(self):
+        if self._venues is None or self._version.is_stale():
+            with self._lock:
+                self._build()
+
+    def warm(self):
+        """Build the index up front, e.g. when a worker process starts.
+
+        Failures are ignored, as the database may not be migrated yet,
+        the index is then built on first use instead.
+        """
+        try:
+            with self._lock:
+                self._build()
+        except DatabaseError:
+            pass
+
+    def clear(self):
+        """Drop the index of this process, it's rebuilt on next use."""
+        with self._lock:
+            self._venues = None
+
+    def _add(self, venue):
+        row, col = cell_of(venue.latitude, venue.longitude)
+        self._venues[venue.id] = venue
+        self._cells.setdefault((row, col), set()).add(venue.id)
+        # Bounds only ever grow, which is fine as they merely limit how
+        # far searches go
+        if self._bounds is None:
+            self._bounds = [row, row, col, col]
+        else:
+            bounds = self._bounds
+            bounds[0], bounds[1] = min(bounds[0], row), max(bounds[1], row)
+            bounds[2], bounds[3] = min(bounds[2], col), max(bounds[3], col)
+
+    def _remove(self, venue_id):
+        venue = self._venues.pop(venue_id, None)
+        if venue is not None:
+            cell = cell_of(venue.latitude, venue.longitude)
+            self._cells[cell].discard(venue_id)
+            if not self._cells[cell]:
+                del self._cells[cell]
+
+    def refresh_venues(self, venue_ids):
+        """Re-index the given venues, e.g. after they or their location
+        were saved, and let other processes know about the change.
+        """
+        from .models import Venue
+
+        self._version.bump(adopt=True)
+        if self._venues is None:
+            return  # Nothing to update, the index is built on first use
+
+        rows = Venue.objects.filter(id__in=venue_ids).values_list(
+            'id',
+            'name',
+            'location__display_address',
+            'location__latitude',
+            'location__longitude',
+        )
+        rows = {row[0]: row for row in rows}
+        with self._lock:
+            for venue_id in venue_ids:
+                self._remove(venue_id)
+                row = rows.get(venue_id)
+                if row is not None and None not in row[3:]:
+                    self._add(IndexedVenue(*row))
+
+    def remove_venue(self, venue_id):
+        self._version.bump(adopt=True)
+        if self._venues is not None:
+            with self._lock:
+                self._remove(venue_id)
+
+    def nearest(self, latitude, longitude, k=10, radius=None):
+        """Return up to `k` `(distance in km, IndexedVenue)` tuples of
+        the venues closest to the given point, optionally only those
+        within `radius` km, nearest first.
+        """
+        if k <= 0:
+            return []
+        self._fresh()
+        with self._lock:
+            venues = self._venues
+            cells = self._cells
+            if not venues:
+                return []
+
+            center_row, center_col = cell_of(latitude, longitude)
+            # Rings needed to cover the whole grid, in case there's no
+            # radius and fewer than k venues around
+            min_row, max_row, min_col, max_col = self._bounds
+            max_ring = max(
+                abs(min_row - center_row),
+                abs(max_row - center_row),
+                abs(min_col - center_col),
+                abs(max_col - center_col),
+            )
+
+            found = []
+            ring = 0
+            while ring <= max_ring:
+                # Once rings hold more cells than there are occupied
+                # ones, e.g. when venues are sparse, scanning every
+                # venue is cheaper than walking mostly empty cells
+                if 8 * ring > len(cells):
+                    found = self._measure(
+                        latitude, longitude, venues.values(), radius
+                    )
+                    break
+
+                ring_venues = (
+                    venues[venue_id]
+                    for cell in self._ring(center_row, center_col, ring)
+                    for venue_id in cells.get(cell, ())
+                )
+                found.extend(
+                    self._measure(latitude, longitude, ring_venues, radius)
+                )
+
+                # Anything in the rings further out is at least this far,
+                # bearing in mind cells get narrower in longitude further
+                # away from the equator
+                reach = ring * CELL_SIZE * DEGREE_KM * math.cos(
+                    math.radians(
+                        min(abs(latitude) + (ring + 1) * CELL_SIZE, 89.9)
+                    )
+                )
+                if radius is not None and reach > radius:
+                    break
+                if len(found) >= k:
+                    found.sort(key=lambda item: item[0])
+                    del found[k:]
+                    if found[-1][0] <= reach:
+                        break
+                ring += 1
+
+        found.sort(key=lambda item: item[0])
+        return found[:k]
+
+    @staticmethod
+    def _measure(latitude, longitude, venues, radius):
+        """`(distance, venue)` tuples of the given venues within the
+        radius of the point.
+        """
+        found = []
+        for venue in venues:
+            distance = haversine_km(
+                latitude, longitude, venue.latitude, venue.longitude
+            )
+            if radius is None or distance <= radius:
+                found.append((distance, venue))
+        return found
+
+    @staticmethod
+    def _ring(center_row, center_col, ring):
+        """Cells at the given Chebyshev distance from the center."""
+        if ring == 0:
+            yield center_row, center_col
+            return
+        for col in range(center_col - ring, center_col + ring + 1):
+            yield center_row - ring, col
+            yield center_row + ring, col
+        for row in range(center_row - ring + 1, center_row + ring):
+            yield row, center_col - ring
+            yield row, center_col + ring
+
+
+venue_index = VenueIndex()
@@ -0,0 +1,329 @@
+"""Generation of synthetic data at scale, e.g. for load testing.
+
+Rows are produced by generators and written through batched bulk
+inserts, so that memory use stays flat however many rows are
+generated. Primary keys are assigned up front, continuing from the
+highest existing key of every table, as `bulk_create()` doesn't return
+them on MySQL or SQLite. That in turn lets attendees reference
+activities and users without reading them back.
+"""
+import datetime
+import random
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.db.models import Max
+from django.utils import timezone
+
+from . import counters
+from .geodistance import recompute_distances
+from .models import (
+    Activity,
+    ActivityAttendee,
+    Location,
+    LookupCode,
+    LookupCodeType,
+    School,
+    States,
+    User,
+    UserAccountType,
+    Venue,
+)
+
+# Lookup codes required by the generated data, by lookup code type
+LOOKUP_CODES = {
+    LookupCodeType.ACTIVITY_TYPE: [
+        ('ACTIVITY_EXCURSION', 'Excursion'),
+        ('ACTIVITY_PICNIC', 'Picnic'),
+        ('ACTIVITY_CARNIVAL', 'Carnival'),
+        ('ACTIVITY_SPORT', 'Sport'),
+    ],
+    LookupCodeType.ACTIVITY_ATTENDEE_TYPE: [
+        ('ATTENDEE_STUDENT', 'Student'),
+        ('ATTENDEE_VOLUNTEER', 'Volunteer'),
+        ('ATTENDEE_STAFF', 'Staff'),
+    ],
+}
+
+# Sample postcodes and the coordinates of the capital city of every
+# state to generate valid addresses
+STATES = {
+    States.NSW: (range(2000, 2100), -33.87, 151.21),
+    States.QLD: (range(4000, 4100), -27.47, 153.03),
+    States.SA: (range(5000, 5100), -34.93, 138.60),
+    States.TAS: (range(7000, 7100), -42.88, 147.33),
+    States.VIC: (range(3000, 3100), -37.81, 144.96),
+    States.WA: (range(6000, 6100), -31.95, 115.86),
+    States.ACT: (range(2600, 2619), -35.28, 149.13),
+    States.NT: (range(800, 900), -12.46, 130.84),
+}
+
+FIRST_NAMES = [
+    'Oliver', 'Charlotte', 'Noah', 'Amelia', 'Jack', 'Isla', 'William',
+    'Mia', 'Leo', 'Olivia', 'Lucas', 'Ava', 'Thomas', 'Grace', 'Henry',
+    'Chloe', 'Ethan', 'Zoe', 'James', 'Ruby'
+]
+LAST_NAMES = [
+    'Smith', 'Jones', 'Williams', 'Brown', 'Wilson', 'Taylor', 'Johnson',
+    'White', 'Martin', 'Anderson', 'Thompson', 'Nguyen', 'Thomas', 'Walker',
+    'Harris', 'Lee', 'Ryan', 'Robinson', 'Kelly', 'King'
+]
+
+
+def next_id(model):
+    """The first free primary key of `model`'s table."""
+    return (model.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+
+
+class DataGenerator:
+    """Generates schools, locations, venues, lookup codes, users,
+    activities and attendees in the given volumes.
+
+    The same `seed` and `now` always produce the same data.
+    """
+    def __init__(
+        self,
+        schools=10,
+        venues=100,
+        users_per_school=500,
+        activities_per_school=1000,
+        attendees_per_activity=20,
+        carnival_attendees=0,
+        password='12345',
+        seed=0,
+        batch_size=5000,
+        now=None,
+        log=None,
+    ):
+        self.schools = schools
+        self.venues = venues
+        self.users_per_school = users_per_school
+        self.activities_per_school = activities_per_school
+        self.attendees_per_activity = min(
+            attendees_per_activity, users_per_school
+        )
+        self.carnival_attendees = min(
+            carnival_attendees, schools * users_per_school
+        )
+        self.password = password
+        self.batch_size = batch_size
+        self.now = now or timezone.now()
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.log = log or (lambda message: None)
+
+    def insert(self, model, rows):
+        """Write `rows` in batches, never holding more than a single
+        batch in memory. Returns the number of rows written.
+        """
+        rows = iter(rows)
+        count = 0
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            model.objects.bulk_create(batch)
+            count += len(batch)
+            self.log(f'{model._meta.verbose_name_plural}: {count}')
+        return count
+
+    def generate(self):
+        """Generate all the data and return the number of rows written
+        into every table.
+        """
+        self.create_lookups()
+
+        # Assign primary key ranges of every table up front
+        self.first_location = next_id(Location)
+        self.first_school = next_id(School)
+        self.first_venue = next_id(Venue)
+        self.first_user = next_id(User)
+        self.first_activity = next_id(Activity)
+        self.first_attendee = next_id(ActivityAttendee)
+
+        written = {
+            'locations': self.insert(Location, self.iter_locations()),
+            'schools': self.insert(School, self.iter_schools()),
+            'venues': self.insert(Venue, self.iter_venues()),
+            'users': self.insert(User, self.iter_users()),
+            'activities': self.insert(Activity, self.iter_activities()),
+        }
+        # Counting attendees batch by batch would cost an UPDATE per
+        # activity and batch, counting them all at the end is cheaper
+        with counters.paused():
+            written['attendees'] = self.insert(
+                ActivityAttendee, self.iter_attendees()
+            )
+
+        # Bulk inserts bypass signals, so fill in activity distances
+        # from the generated coordinates in one go afterwards
+        activities = Activity.objects.filter(id__gte=self.first_activity)
+        recompute_distances(activities)
+        counters.recompute_counters(activities)
+        return written
+
+    def create_lookups(self):
+        """Get or create the few lookup codes and account types used by
+        the generated data.
+        """
+        self.lookups = {}
+        for type_code, codes in LOOKUP_CODES.items():
+            code_type, _ = LookupCodeType.objects.get_or_create(
+                code=type_code
+            )
+            self.lookups[type_code] = [
+                LookupCode.objects.get_or_create(
+                    type=code_type, code=code, defaults={'name': name}
+                )[0].id for code, name in codes
+            ]
+        self.account_type_id = UserAccountType.objects.get_or_create(
+            name='Student'
+        )[0].id
+
+    def iter_locations(self):
+        states = list(STATES)
+        for i in range(self.schools + self.venues):
+            state = self.rng.choice(states)
+            postcodes, latitude, longitude = STATES[state]
+            postcode = self.rng.choice(postcodes)
+            yield Location(
+                id=self.first_location + i,
+                address_line_1=f'{self.rng.randint(1, 999)} '
+                f'{self.rng.choice(LAST_NAMES)} Street',
+                city=f'{self.rng.choice(LAST_NAMES)}ville',
+                state=state,
+                postcode=f'{postcode:04}',
+                # Scatter locations within ~50km of the capital
+                latitude=latitude + self.rng.uniform(-0.45, 0.45),
+                longitude=longitude + self.rng.uniform(-0.45, 0.45),
+                created_date=self.now,
+                updated_date=self.now,
+            )
+
+    def iter_schools(self):
+        for i in range(self.schools):
+            yield School(
+                id=self.first_school + i,
+                name=f'{self.rng.choice(LAST_NAMES)} School '
+                f'{self.first_school + i}',
+                location_id=self.first_location + i,
+                created_date=self.now,
+                updated_date=self.now,
+            )
+
+    def iter_venues(self):
+        for i in range(self.venues):
+            yield Venue(
+                id=self.first_venue + i,
+                name=f'{self.rng.choice(LAST_NAMES)} Park '
+                f'{self.first_venue + i}',
+                location_id=self.first_location + self.schools + i,
+                created_date=self.now,
+                updated_date=self.now,
+            )
+
+    def iter_users(self):
+        # Hashing passwords is deliberately slow, so hash it once and
+        # share the hash between all generated users
+        password = make_password(self.password)
+        for i in range(self.schools * self.users_per_school):
+            user_id = self.first_user + i
+            yield User(
+                id=user_id,
+                email=f'user{user_id}@simplesis.test',
+                first_name=self.rng.choice(FIRST_NAMES),
+                last_name=self.rng.choice(LAST_NAMES),
+                password=password,
+                school_id=self.first_school + i // self.users_per_school,
+                account_type_id=self.account_type_id,
+                created_date=self.now,
+                updated_date=self.now,
+            )
+
+    def plan_activities(self):
+        """Yield `(activity, user_ids, rng)` for every activity to be
+        generated, where `user_ids` are the users enrolled into the
+        activity.
+
+        Every activity gets a random generator seeded by its id, so
+        that activities and their attendees can be streamed into the
+        database separately and still agree with each other, without
+        having to keep anything in memory in between.
+        """
+        categories = self.lookups[LookupCodeType.ACTIVITY_TYPE]
+        activity_id = self.first_activity
+        for school in range(self.schools):
+            school_users = self.first_user + school * self.users_per_school
+            for _ in range(self.activities_per_school):
+                rng = random.Random(f'{self.seed}:{activity_id}')
+                activity = Activity(
+                    id=activity_id,
+                    school_id=self.first_school + school,
+                    name=f'Activity {activity_id}',
+                    description='Generated activity',
+                    category_id=rng.choice(categories),
+                    # Spread activities two years into the past and
+                    # the future
+                    start_date=self.now +
+                    datetime.timedelta(hours=rng.randint(-17520, 17520)),
+                    venue_id=self.first_venue + rng.randrange(self.venues),
+                    created_date=self.now,
+                    updated_date=self.now,
+                )
+                user_ids = [
+                    school_users + offset for offset in rng.sample(
+                        range(self.users_per_school),
+                        self.attendees_per_activity,
+                    )
+                ]
+                yield activity, user_ids, rng
+                activity_id += 1
+
+        # A whole-of-school carnival with a very large roster, open to
+        # students of all schools
+        if self.carnival_attendees:
+            activity = Activity(
+                id=activity_id,
+                school_id=self.first_school,
+                name='Athletics Carnival',
+                description='Whole of school carnival',
+                category_id=categories[2],
+                start_date=self.now + datetime.timedelta(days=30),
+                venue_id=self.first_venue,
+                created_date=self.now,
+                updated_date=self.now,
+            )
+            user_ids = range(
+                self.first_user, self.first_user + self.carnival_attendees
+            )
+            yield activity, user_ids, random.Random(
+                f'{self.seed}:{activity_id}'
+            )
+
+    def iter_activities(self):
+        for activity, _, _ in self.plan_activities():
+            yield activity
+
+    def iter_attendees(self):
+        student, volunteer, staff = self.lookups[
+            LookupCodeType.ACTIVITY_ATTENDEE_TYPE]
+        attendee_id = self.first_attendee
+        for activity, user_ids, rng in self.plan_activities():
+            is_past = activity.start_date < self.now
+            for user_id in user_ids:
+                is_organiser = rng.random() < 0.1
+                approved = rng.random() < 0.7
+                attended = approved and (is_past or rng.random() < 0.3)
+                yield ActivityAttendee(
+                    id=attendee_id,
+                    activity_id=activity.id,
+                    user_id=user_id,
+                    is_organiser=is_organiser,
+                    attendee_type_id=staff if is_organiser else
+                    rng.choice((student, student, student, volunteer)),
+                    approved_at=self.now if approved else None,
+                    attended_at=self.now if attended else None,
+                    created_date=self.now,
+                    updated_date=self.now,
+                )
+                attendee_id += 1
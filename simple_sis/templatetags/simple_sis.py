@@ -0,0 +1,31 @@
+from django import template
+
+from simple_sis.fragments import activity_version
+from simple_sis.lookups import lookup_codes
+
+register = template.Library()
+
+
+@register.filter
+def lookup_name(id):
+    """Resolve a lookup code id to the code's name through the lookup
+    code cache, e.g. `{{ activity.category_id|lookup_name }}`.
+    """
+    code = lookup_codes.get(id)
+    return code.name if code is not None else ''
+
+
+@register.filter
+def km(metres):
+    """Format a distance in metres as kilometres, e.g. `12.3 km`."""
+    if metres is None:
+        return ''
+    return f'{metres / 1000:.1f} km'
+
+
+@register.filter
+def fragment_version(activity):
+    """The version keying cached fragments of an activity, e.g.
+    `{% cache None 'activity-row' activity|fragment_version %}`.
+    """
+    return activity_version(activity)
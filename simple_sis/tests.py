@@ -1,3 +1,2089 @@
-from django.test import TestCase
+"""Performance regression tests.
 
-# Create your tests here.
+The tests seed a realistic volume of data (many schools, tens of
+thousands of activities and hundreds of thousands of attendees) and
+then, for every URL in `simple_sis.urls`:
+
+- assert the number of queries stays within the URL's budget, which
+  catches N+1 regressions,
+- assert none of the queries scans a whole table or sorts its rows
+  instead of using an index, as told by SQLite's query plans, and
+- record p50/p95 response times and, where enabled by PERF_ENFORCE,
+  fail if p95 exceeds the stored baseline by more than the allowed
+  tolerance.
+
+The suite runs against SQLite, so it doesn't need a MySQL server:
+
+    DATABASE_ENGINE=sqlite pipenv run test
+
+The following environment variables tune the run:
+
+- PERF_SCALE: multiplier for the seeded volumes, e.g. 0.05 for a
+  quick smoke run (default 1)
+- PERF_ENFORCE: set to 1 to fail on timings regressing past the
+  baseline. By default they're only reported, as they vary with the
+  machine and its load, which would make the run nondeterministic
+- PERF_TOLERANCE: how much slower than the baseline p95 a URL may get
+  before the test fails (default 1.5, i.e. 50% slower)
+- PERF_SLACK_MS: absolute slack added on top of the tolerance to keep
+  very fast URLs from failing on timer noise (default 10)
+- PERF_UPDATE_BASELINE: set to 1 to store the measured timings as the
+  new baseline instead of comparing against it
+
+Baselines are only meaningful for the machine and the volumes they were
+recorded with, so timings are compared against them at scale 1 only,
+best on the machine that recorded them.
+"""
+import asyncio
+import csv
+import gc
+import json
+import os
+import re
+import sqlite3
+import statistics
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from io import BytesIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from xml.sax.saxutils import escape
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.signals import request_started
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import F
+from django.db.models.signals import pre_delete
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import admin, live, throttling, urls
+from .asynchronous import PerRequestThreads, StreamingASGIHandler
+from .attendee_import import AttendeeImport
+from .authentication import get_user, user_key
+from .check_in import check_in
+from .counters import COUNTER_FIELDS, recompute_counters
+from .databases import replica_reads
+from .geodistance import (
+    activity_distance,
+    distance_matrix,
+    recompute_distances,
+)
+from .lookups import lookup_codes
+from .models import (
+    Activity,
+    ActivityAttendee,
+    ActivityAttendeeQuerySet,
+    Location,
+    LookupCode,
+    LookupCodeType,
+    School,
+    User,
+    UserAccountType,
+    Venue,
+)
+from .pagination import _encode_cursor, iter_chunks
+from .postcodes import check_postcodes, postcode_centroid, postcode_state
+from .provisioning import RosterSync, hash_passwords, read_csv, read_json
+from .spatial import venue_index
+from .synthetic import DataGenerator
+
+PERF_SCALE = float(os.environ.get('PERF_SCALE', 1))
+PERF_ENFORCE = os.environ.get('PERF_ENFORCE') in ('1', 'True')
+PERF_TOLERANCE = float(os.environ.get('PERF_TOLERANCE', 1.5))
+PERF_SLACK_MS = float(os.environ.get('PERF_SLACK_MS', 10))
+PERF_UPDATE_BASELINE = os.environ.get('PERF_UPDATE_BASELINE') in ('1', 'True')
+PERF_BASELINE_PATH = Path(__file__).resolve().parent / 'perf_baseline.json'
+
+# How many times each URL is requested to compute its timings
+PERF_SAMPLES = 20
+
+# Seeded volumes at scale 1
+SCHOOLS = 20
+VENUES = 200
+USERS_PER_SCHOOL = 500
+ACTIVITIES_PER_SCHOOL = 1500
+ATTENDEES_PER_ACTIVITY = 10
+# A whole-of-school carnival seeded in addition to the regular activities
+CARNIVAL_ATTENDEES = 5000
+
+# Every URL in `simple_sis.urls` mapped to a list of cases to request it
+# with. A case is a tuple of:
+#
+# (label, URL kwargs, query string, whether to log in, query budget)
+#
+# optionally followed by a `(content type, body)` tuple to POST rather
+# than GET. URL kwargs, query strings and bodies are formatted with the
+# `targets` dict of the test case, giving access to ids of the seeded
+# objects. Budgets are of requests whose session and user are cached,
+# see `PerformanceTests.log_in()`.
+URL_CASES = {
+    'login': [
+        ('login', {}, '', False, 0),
+    ],
+    'logout': [
+        ('logout', {}, '', True, 2),
+    ],
+    'login-metrics': [
+        ('login-metrics', {}, '', True, 0),
+    ],
+    'home': [
+        ('home', {}, '', True, 2),
+        ('home-past', {}, 'when=past', True, 2),
+        ('home-category', {}, 'when=all&category={category}', True, 2),
+        ('home-deep-page', {}, 'when=all&after={deep_cursor}', True, 2),
+    ],
+    'view-activity': [
+        ('view-activity', {'id': '{activity}'}, '', True, 4),
+        ('view-activity-carnival', {'id': '{carnival}'}, '', True, 4),
+    ],
+    'activity-roster': [
+        (
+            'activity-roster', {
+                'id': '{carnival}',
+                'section': 'participants'
+            }, '', True, 2
+        ),
+        (
+            'activity-roster-filtered', {
+                'id': '{carnival}',
+                'section': 'participants'
+            }, 'status=approved&q=son', True, 2
+        ),
+        (
+            'activity-roster-deep-page', {
+                'id': '{carnival}',
+                'section': 'participants'
+            }, 'after={roster_cursor}', True, 2
+        ),
+    ],
+    'import-attendees': [
+        (
+            'import-attendees', {'id': '{activity}'}, '', True, 11,
+            ('text/csv', '{import_csv}')
+        ),
+    ],
+    'check-in': [
+        (
+            'check-in', {'id': '{carnival}'}, '', True, 7, (
+                'application/json',
+                '{{"email": "{carnival_attendee_email}"}}'
+            )
+        ),
+    ],
+    'sync-check-ins': [
+        (
+            'sync-check-ins', {'id': '{carnival}'}, '', True, 9, (
+                'application/json',
+                '{{"check_ins": {check_ins}}}'
+            )
+        ),
+    ],
+    'update-attendees': [
+        (
+            'approve-attendees', {
+                'id': '{carnival}',
+                'action': 'approve'
+            }, '', True, 7, (
+                'application/x-www-form-urlencoded',
+                'section=participants&status=pending'
+            )
+        ),
+        (
+            'attend-attendees', {
+                'id': '{carnival}',
+                'action': 'attend'
+            }, '', True, 7, (
+                'application/x-www-form-urlencoded',
+                'id={carnival_attendee}&id={carnival_attendee_2}'
+            )
+        ),
+    ],
+    'export-activities': [
+        ('export-activities', {'format': 'csv'}, 'when=all', True, 3),
+        ('export-activities-xlsx', {'format': 'xlsx'}, '', True, 2),
+    ],
+    'export-roster': [
+        ('export-roster', {'id': '{carnival}', 'format': 'csv'}, '', True, 4),
+        (
+            'export-roster-xlsx', {'id': '{carnival}', 'format': 'xlsx'},
+            '', True, 4
+        ),
+    ],
+    'live-activity': [
+        ('live-activity', {'id': '{carnival}'}, '', True, 1),
+    ],
+    'activity-events': [
+        ('activity-events', {'id': '{carnival}'}, '', True, 2),
+    ],
+    'nearby-venues': [
+        ('nearby-venues', {}, '', True, 1),
+        ('nearby-venues-radius', {}, 'k=50&radius=25', True, 1),
+    ],
+    'api-activities': [
+        ('api-activities', {}, '', True, 1),
+        (
+            'api-activities-deep-page', {}, 'when=all&after={deep_cursor}',
+            True, 1
+        ),
+    ],
+    'api-activity': [
+        ('api-activity', {'id': '{carnival}'}, '', True, 1),
+    ],
+    'api-attendees': [
+        ('api-attendees', {'id': '{carnival}'}, '', True, 2),
+        (
+            'api-attendees-filtered', {'id': '{carnival}'},
+            'section=organisers&status=pending&q=son', True, 2
+        ),
+    ],
+}
+
+
+def scaled(value):
+    return max(1, int(value * PERF_SCALE))
+
+
+# SQLite query plan steps reading a whole table rather than an index,
+# or sorting rows, which keyset pagination relies on indexes to avoid
+SLOW_PLAN_STEP = re.compile(
+    r'^SCAN (?:TABLE )?(?!CONSTANT ROW)(?P<table>\w+)(?: AS \w+)?$'
+    r'|^USE TEMP B-TREE FOR ORDER BY$'
+)
+
+# Tables read in full on purpose, e.g. to fill process-wide caches
+FULL_SCAN_ALLOWED = {'simple_sis_lookupcode', 'simple_sis_lookupcodetype'}
+
+
+def slow_plan_steps(sql):
+    """The steps of the plan of a SELECT query which scan a whole table
+    or sort the rows, as told by SQLite.
+    """
+    if not sql.startswith('SELECT'):
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        steps = [row[3] for row in cursor.fetchall()]
+    return [
+        step for step, match in zip(steps, map(SLOW_PLAN_STEP.match, steps))
+        if match and match['table'] not in FULL_SCAN_ALLOWED
+    ]
+
+
+def seed():
+    """Seed the test database with a scaled volume of data and return
+    the user to log in as along with a carnival of the user's school.
+    """
+    DataGenerator(
+        schools=scaled(SCHOOLS),
+        venues=scaled(VENUES),
+        users_per_school=scaled(USERS_PER_SCHOOL),
+        activities_per_school=scaled(ACTIVITIES_PER_SCHOOL),
+        attendees_per_activity=scaled(ATTENDEES_PER_ACTIVITY),
+        carnival_attendees=scaled(CARNIVAL_ATTENDEES),
+        seed=1,
+    ).generate()
+    carnival = Activity.objects.get(name='Athletics Carnival')
+    user = User.objects.filter(school_id=carnival.school_id).first()
+    return user, carnival
+
+
+class PerformanceTests(TestCase):
+    """Query budget and latency checks for every URL of the app."""
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, carnival = seed()
+        # Staff may manage every activity of their school
+        cls.user.is_staff = True
+        cls.user.save(update_fields=['is_staff'])
+        # Caches are warmed when a worker process starts
+        lookup_codes.warm()
+        venue_index.warm()
+        activities = Activity.objects.filter(school_id=cls.user.school_id)
+        ordered = activities.order_by('start_date', 'id')
+        deep = ordered[ordered.count() // 2]
+        roster = carnival.attendees.filter(is_organiser=False).order_by('id')
+        queued = list(roster.values_list('user_id', flat=True)[3:203])
+        arrival = timezone.now() - timedelta(hours=1)
+        cls.targets = {
+            'activity': activities.exclude(id=carnival.id).first().id,
+            'carnival': carnival.id,
+            'category': carnival.category_id,
+            'deep_cursor': _encode_cursor(deep, ('start_date', 'id')),
+            'roster_cursor': _encode_cursor(
+                roster[roster.count() // 2], ('id', )
+            ),
+            'carnival_attendee': roster[0].id,
+            'carnival_attendee_email': roster[2].user.email,
+            # A tablet's queue of scans, a few attendees scanned twice
+            'check_ins': json.dumps(
+                [
+                    {
+                        'user': user_id,
+                        'at': (arrival + timedelta(seconds=i)).isoformat(),
+                    } for i, user_id in enumerate(queued + queued[:10])
+                ]
+            ),
+            'carnival_attendee_2': roster[1].id,
+            # Users of the school, most of whom don't attend yet. Kept
+            # to a single insert on SQLite, which limits the number of
+            # parameters per query.
+            'import_csv': 'email,role\n' + ''.join(
+                f'{email},Student\n' for email in User.objects.filter(
+                    school_id=cls.user.school_id
+                ).values_list('email', flat=True)[:80]
+            ),
+        }
+
+    def get_cases(self):
+        """Yield (label, path, login, budget, post) of every case."""
+        for name, cases in URL_CASES.items():
+            for label, kwargs, query, login, budget, *post in cases:
+                path = reverse(
+                    name,
+                    kwargs={
+                        key: value.format(**self.targets)
+                        for key, value in kwargs.items()
+                    },
+                )
+                if query:
+                    path = f'{path}?{query.format(**self.targets)}'
+                if post:
+                    content_type, body = post[0]
+                    post = (content_type, body.format(**self.targets))
+                yield label, path, login, budget, post
+
+    def request(self, path, post):
+        if post:
+            content_type, body = post
+            response = self.client.post(
+                path, body, content_type=content_type
+            )
+        else:
+            response = self.client.get(path)
+        if response.streaming:
+            # Streamed responses only do their work as they're sent
+            response.getvalue()
+        return response
+
+    def log_in(self, login):
+        """Log the test client in or out, as required by a case.
+
+        The user is loaded once after logging in, so that cases measure
+        requests whose session and user are cached, as most are.
+        """
+        if login:
+            self.client.force_login(self.user)
+            get_user(SimpleNamespace(session=self.client.session))
+        else:
+            self.client.logout()
+
+    def test_every_url_has_cases(self):
+        names = {pattern.name for pattern in urls.urlpatterns}
+        self.assertEqual(
+            names - set(URL_CASES),
+            set(),
+            'Add query budgets for the new URLs to URL_CASES',
+        )
+
+    def test_query_budgets(self):
+        for label, path, login, budget, post in self.get_cases():
+            with self.subTest(label):
+                self.log_in(login)
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.request(path, post)
+                self.assertLess(response.status_code, 400, path)
+                self.assertLessEqual(
+                    len(queries),
+                    budget,
+                    '\n'.join(query['sql'] for query in queries),
+                )
+
+    @skipUnless(connection.vendor == 'sqlite', 'Reads SQLite query plans')
+    def test_slow_plans_are_spotted(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(
+                Activity.objects.filter(attendee_count=1).order_by(
+                    'description'
+                )
+            )
+        self.assertEqual(
+            slow_plan_steps(queries[0]['sql']),
+            ['SCAN simple_sis_activity', 'USE TEMP B-TREE FOR ORDER BY'],
+        )
+
+    @skipUnless(connection.vendor == 'sqlite', 'Reads SQLite query plans')
+    def test_query_plans(self):
+        for label, path, login, _, post in self.get_cases():
+            with self.subTest(label):
+                self.log_in(login)
+                with CaptureQueriesContext(connection) as queries:
+                    self.request(path, post)
+                slow = [
+                    f'{step}: {query["sql"]}'
+                    for query in queries
+                    for step in slow_plan_steps(query['sql'])
+                ]
+                self.assertEqual(slow, [], '\n'.join(slow))
+
+    def test_latency_baseline(self):
+        results = {}
+        for label, path, login, _, post in self.get_cases():
+            # Warm up caches, e.g. compiled templates, and get garbage
+            # collection out of the way of the measurements
+            self.log_in(login)
+            self.request(path, post)
+            gc.collect()
+            timings = []
+            for _ in range(PERF_SAMPLES):
+                self.log_in(login)
+                start = time.perf_counter()
+                response = self.request(path, post)
+                timings.append((time.perf_counter() - start) * 1000)
+                self.assertLess(response.status_code, 400, path)
+            percentiles = statistics.quantiles(timings, n=20)
+            results[label] = {
+                'p50': round(statistics.median(timings), 2),
+                'p95': round(percentiles[18], 2),
+            }
+
+        print('\nURL latency in ms (p50 / p95):')
+        for label, result in results.items():
+            print(f'  {label:<30} {result["p50"]:>8} / {result["p95"]:>8}')
+
+        if PERF_UPDATE_BASELINE:
+            PERF_BASELINE_PATH.write_text(
+                json.dumps(results, indent=4, sort_keys=True) + '\n'
+            )
+            return
+        if not PERF_ENFORCE or PERF_SCALE != 1:
+            return
+
+        baseline = json.loads(PERF_BASELINE_PATH.read_text())
+        for label, result in results.items():
+            with self.subTest(label):
+                self.assertIn(
+                    label,
+                    baseline,
+                    'No baseline stored, run with PERF_UPDATE_BASELINE=1',
+                )
+                self.assertLessEqual(
+                    result['p95'],
+                    baseline[label]['p95'] * PERF_TOLERANCE + PERF_SLACK_MS,
+                    f'p95 of {label} regressed past the baseline',
+                )
+
+
+class LookupCodeCacheTests(TestCase):
+    def setUp(self):
+        self.type = LookupCodeType.objects.create(
+            code=LookupCodeType.ACTIVITY_TYPE
+        )
+        self.code = LookupCode.objects.create(
+            type=self.type, code='ACTIVITY_PICNIC', name='Picnic'
+        )
+
+    def test_lookups_are_served_from_memory(self):
+        lookup_codes.warm()
+        with self.assertNumQueries(0):
+            self.assertEqual(lookup_codes.get(self.code.id), self.code)
+            self.assertEqual(
+                lookup_codes.get_by_code(
+                    LookupCodeType.ACTIVITY_TYPE, 'ACTIVITY_PICNIC'
+                ),
+                self.code,
+            )
+            self.assertEqual(
+                lookup_codes.of_type(LookupCodeType.ACTIVITY_TYPE),
+                [self.code],
+            )
+
+    def test_saving_a_code_invalidates_the_cache(self):
+        lookup_codes.warm()
+        self.code.name = 'Outdoor picnic'
+        self.code.save()
+        self.assertEqual(
+            lookup_codes.get(self.code.id).name, 'Outdoor picnic'
+        )
+
+
+class LocationDisplayAddressTests(TestCase):
+    def setUp(self):
+        self.location = Location.objects.create(
+            address_line_1='1 Some Street',
+            city='Some City',
+            state='NSW',
+            postcode='2000',
+        )
+
+    def assertInSync(self):
+        location = Location.objects.get(id=self.location.id)
+        self.assertEqual(location.display_address, location.format_address())
+
+    def test_save(self):
+        self.assertEqual(
+            self.location.display_address,
+            '1 Some Street, Some City, NSW, 2000',
+        )
+        self.location.address_line_2 = 'Unit 2'
+        self.location.save(update_fields=['address_line_2'])
+        self.assertInSync()
+
+    def test_bulk_update(self):
+        Location.objects.filter(id=self.location.id).update(
+            address_line_2='Unit 2', city='Other City'
+        )
+        self.assertInSync()
+        Location.objects.filter(id=self.location.id).update(
+            address_line_2=F('city')
+        )
+        self.assertInSync()
+        Location.objects.filter(id=self.location.id).update(
+            address_line_2=None
+        )
+        self.assertInSync()
+
+
+class GeodistanceTests(TestCase):
+    def setUp(self):
+        distance_matrix.clear()
+        category = LookupCode.objects.create(
+            type=LookupCodeType.objects.create(
+                code=LookupCodeType.ACTIVITY_TYPE
+            ),
+            code='ACTIVITY_EXCURSION',
+            name='Excursion',
+        )
+        # Sydney and Melbourne CBDs, roughly 714km apart
+        self.school = School.objects.create(
+            name='School',
+            location=Location.objects.create(
+                address_line_1='1 George Street',
+                city='Sydney',
+                state='NSW',
+                postcode='2000',
+                latitude=-33.8688,
+                longitude=151.2093,
+            ),
+        )
+        self.venue_location = Location.objects.create(
+            address_line_1='1 Swanston Street',
+            city='Melbourne',
+            state='VIC',
+            postcode='3000',
+            latitude=-37.8136,
+            longitude=144.9631,
+        )
+        self.activity = Activity.objects.create(
+            school=self.school,
+            name='Excursion',
+            description='Excursion',
+            category=category,
+            start_date=self.venue_location.created_date,
+            venue=Venue.objects.create(
+                name='Venue', location=self.venue_location
+            ),
+        )
+
+    def test_distance_is_set_on_save(self):
+        self.assertAlmostEqual(
+            self.activity.distance_from_school, 713_500, delta=1000
+        )
+
+    def test_distances_follow_location_moves(self):
+        # Move the venue to the school
+        with self.captureOnCommitCallbacks(execute=True):
+            self.venue_location.latitude = -33.8688
+            self.venue_location.longitude = 151.2093
+            self.venue_location.save()
+        self.activity.refresh_from_db()
+        self.assertEqual(self.activity.distance_from_school, 0)
+        # Nothing changed since, so there's nothing to update
+        self.assertEqual(recompute_distances(), 0)
+
+
+class SpatialIndexTests(TestCase):
+    def setUp(self):
+        venue_index.clear()
+        self.venues = {}
+        # Sydney CBD, Parramatta (~19km west) and Newcastle (~117km north)
+        for name, latitude, longitude in [
+            ('Sydney', -33.8688, 151.2093),
+            ('Parramatta', -33.8150, 151.0011),
+            ('Newcastle', -32.9283, 151.7817),
+        ]:
+            self.venues[name] = Venue.objects.create(
+                name=name,
+                location=Location.objects.create(
+                    address_line_1='1 Main Street',
+                    city=name,
+                    state='NSW',
+                    postcode='2000',
+                    latitude=latitude,
+                    longitude=longitude,
+                ),
+            )
+
+    def nearest(self, **kwargs):
+        return [
+            venue.name
+            for _, venue in venue_index.nearest(-33.8688, 151.2093, **kwargs)
+        ]
+
+    def test_nearest(self):
+        self.assertEqual(
+            self.nearest(), ['Sydney', 'Parramatta', 'Newcastle']
+        )
+        self.assertEqual(self.nearest(k=2), ['Sydney', 'Parramatta'])
+        self.assertEqual(self.nearest(radius=50), ['Sydney', 'Parramatta'])
+        self.assertEqual(self.nearest(k=0), [])
+
+    def test_nearby_venues(self):
+        school = School.objects.create(
+            name='School', location=self.venues['Sydney'].location
+        )
+        self.client.force_login(
+            User.objects.create_user('user@simplesis.test', school=school)
+        )
+        path = reverse('nearby-venues')
+        venues = self.client.get(path, {'k': 1}).json()['venues']
+        self.assertEqual([venue['name'] for venue in venues], ['Sydney'])
+        for k in ('0', '-1', 'x'):
+            with self.subTest(k=k):
+                response = self.client.get(path, {'k': k})
+                self.assertEqual(response.status_code, 400)
+
+    def test_index_follows_location_moves(self):
+        self.nearest()
+        # Move Newcastle next door
+        location = self.venues['Newcastle'].location
+        with self.captureOnCommitCallbacks(execute=True):
+            location.latitude = -33.8700
+            location.longitude = 151.2100
+            location.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.nearest(k=2), ['Sydney', 'Newcastle'])
+
+
+class PostcodeTests(TestCase):
+    def test_lookups(self):
+        self.assertEqual(postcode_state('2000'), 'NSW')
+        self.assertEqual(postcode_state('2600'), 'ACT')
+        self.assertEqual(postcode_state('800'), 'NT')
+        self.assertEqual(postcode_state('0800'), 'NT')
+        self.assertIsNone(postcode_state('1000'))
+        self.assertIsNone(postcode_state('abc'))
+        self.assertEqual(postcode_centroid('3000'), (-37.81, 144.96))
+
+    def test_bulk_validation(self):
+        self.assertEqual(
+            check_postcodes(
+                ['2000', '3000', 'abc', '1000', '20000', '2600'],
+                ['NSW', 'NSW', 'NSW', 'NSW', 'NSW', ''],
+            ),
+            {
+                1: 'Postcode 3000 is not in NSW',
+                2: 'Postcode must be a number',
+                3: 'Invalid postcode',
+                4: 'Invalid postcode',
+            },
+        )
+        self.assertEqual(check_postcodes(['2000', '800']), {})
+
+    def test_location_state_must_match(self):
+        location = Location(
+            address_line_1='1 George Street',
+            city='Sydney',
+            state='VIC',
+            postcode='2000',
+        )
+        with self.assertRaisesMessage(
+            ValidationError, 'Postcode 2000 is not in VIC'
+        ):
+            location.full_clean(exclude=['created_by', 'updated_by'])
+        location.state = 'NSW'
+        location.full_clean(exclude=['created_by', 'updated_by'])
+
+    def test_bulk_locations_are_validated(self):
+        locations = [
+            Location(
+                address_line_1=f'{number} George Street',
+                city='Sydney',
+                state='NSW',
+                postcode=postcode,
+            ) for number, postcode in enumerate(['2000', '3000', '1000'], 1)
+        ]
+        with self.assertRaises(ValidationError) as raised:
+            Location.objects.bulk_create(locations)
+        self.assertEqual(
+            raised.exception.messages,
+            [
+                'Location 1: Postcode 3000 is not in NSW',
+                'Location 2: Invalid postcode',
+            ],
+        )
+        self.assertFalse(Location.objects.exists())
+
+        Location.objects.bulk_create(locations[:1])
+        location = Location.objects.get()
+        location.state = 'VIC'
+        with self.assertRaisesMessage(
+            ValidationError, 'Postcode 2000 is not in VIC'
+        ):
+            Location.objects.bulk_update([location], ['state'])
+
+    def test_distances_fall_back_to_postcodes(self):
+        school = School.objects.create(
+            name='School',
+            location=Location.objects.create(
+                address_line_1='1 George Street',
+                city='Sydney',
+                state='NSW',
+                postcode='2000',
+            ),
+        )
+        venue = Venue.objects.create(
+            name='Venue',
+            location=Location.objects.create(
+                address_line_1='1 Swanston Street',
+                city='Melbourne',
+                state='VIC',
+                postcode='3000',
+            ),
+        )
+        self.assertAlmostEqual(
+            activity_distance(school.id, venue.id), 713_500, delta=1000
+        )
+
+
+class AttendeeImportTests(TestCase):
+    def setUp(self):
+        DataGenerator(
+            schools=1,
+            venues=1,
+            users_per_school=5,
+            activities_per_school=1,
+            attendees_per_activity=0,
+            carnival_attendees=0,
+        ).generate()
+        self.activity = Activity.objects.get()
+        self.emails = list(User.objects.values_list('email', flat=True))
+
+    def import_csv(self, text, **kwargs):
+        return AttendeeImport(self.activity.id, **kwargs).run(
+            text.splitlines(keepends=True)
+        )
+
+    def test_import(self):
+        result = self.import_csv(
+            'Email,Role,Organiser\n'
+            f'{self.emails[0]},Student,\n'
+            f'{self.emails[1]},ATTENDEE_STAFF,yes\n'
+            f'{self.emails[0]},Student,\n'
+            'nobody@simplesis.test,Student,\n'
+            f'{self.emails[2]},Juggler,\n'
+            ',Student,\n',
+            chunk_size=2,
+        )
+        self.assertEqual((result.imported, result.skipped), (2, 1))
+        self.assertEqual(
+            result.errors,
+            [
+                (5, 'Unknown user "nobody@simplesis.test"'),
+                (6, 'Unknown role "Juggler"'),
+                (7, 'Missing email'),
+            ],
+        )
+        self.assertEqual(
+            set(
+                self.activity.attendees.values_list(
+                    'user__email', 'attendee_type__code', 'is_organiser'
+                )
+            ),
+            {
+                (self.emails[0], 'ATTENDEE_STUDENT', False),
+                (self.emails[1], 'ATTENDEE_STAFF', True),
+            },
+        )
+
+        # Importing the same file again only skips the attendees, and
+        # emails match regardless of case
+        result = self.import_csv(
+            f'email,role\n{self.emails[0].upper()},Student\n'
+            f'{self.emails[3].upper()},Student\n'
+        )
+        self.assertEqual((result.imported, result.skipped), (1, 1))
+
+    def test_concurrent_import(self):
+        # Another import adds the first user after the attendees of the
+        # activity were looked up
+        ActivityAttendee.objects.create(
+            activity=self.activity,
+            user=User.objects.get(email=self.emails[0]),
+            attendee_type=LookupCode.objects.get(code='ATTENDEE_STUDENT'),
+        )
+        with mock.patch.object(
+            ActivityAttendeeQuerySet, 'values_list', return_value=[]
+        ):
+            result = self.import_csv(
+                'email,role\n'
+                f'{self.emails[0]},Student\n'
+                f'{self.emails[1]},Student\n'
+                f'{self.emails[2]},Student\n'
+            )
+        self.assertEqual((result.imported, result.skipped), (2, 1))
+        self.assertEqual(result.errors, [])
+        self.assertEqual(self.activity.attendees.count(), 3)
+        self.assertEqual(recompute_counters(), 0)
+
+    def test_upload(self):
+        user = User.objects.get(email=self.emails[0])
+        self.client.force_login(user)
+        path = reverse('import-attendees', kwargs={'id': self.activity.id})
+        upload = SimpleUploadedFile(
+            'attendees.csv',
+            f'email,role\n{self.emails[1]},Student\n'.encode(),
+        )
+        # Only staff and organisers may import
+        response = self.client.post(path, {'file': upload})
+        self.assertEqual(response.status_code, 404)
+
+        user.is_staff = True
+        user.save()
+        upload.seek(0)
+        response = self.client.post(path, {'file': upload})
+        self.assertEqual(response.json()['imported'], 1)
+
+        # Invalid files, e.g. not UTF-8 encoded or with a field past the
+        # size limit, import nothing
+        rows = f'email,role\n{self.emails[2]},Student\n'
+        too_long = 'x' * (csv.field_size_limit() + 1)
+        for content in (
+            f'{rows}\xe9\n'.encode('latin-1'),
+            f'{rows}{too_long}\n'.encode(),
+        ):
+            upload = SimpleUploadedFile('attendees.csv', content)
+            response = self.client.post(path, {'file': upload})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+        self.assertEqual(self.activity.attendees.count(), 1)
+
+    def test_missing_columns(self):
+        result = self.import_csv(f'email\n{self.emails[0]}\n')
+        self.assertEqual(result.errors, [(1, 'Missing columns: role')])
+        self.assertEqual(self.activity.attendees.count(), 0)
+
+
+class ProvisioningTests(TestCase):
+    def setUp(self):
+        DataGenerator(
+            schools=1,
+            venues=1,
+            users_per_school=4,
+            activities_per_school=1,
+            attendees_per_activity=0,
+            carnival_attendees=0,
+        ).generate()
+        self.users = list(User.objects.order_by('id'))
+        self.school_id = self.users[0].school_id
+        self.users[3].is_active = False
+        self.users[3].save()
+        self.teacher = User.objects.create_user(
+            'teacher@simplesis.test',
+            school_id=self.school_id,
+            account_type=UserAccountType.objects.create(name='Staff'),
+        )
+        self.roster = (
+            'Email,First_Name,Last_Name,Account_Type,Password\n'
+            f'{self.users[0].email.upper()},{self.users[0].first_name},'
+            f'{self.users[0].last_name},Student,\n'
+            f'{self.users[1].email},Renamed,{self.users[1].last_name},'
+            'student,\n'
+            f'{self.users[3].email},{self.users[3].first_name},'
+            f'{self.users[3].last_name},Student,\n'
+            'new@simplesis.test,New,Student,Student,s3cret\n'
+            'nopassword@simplesis.test,No,Password,Student,\n'
+            'NEW@simplesis.test,New,Again,Student,\n'
+            'juggler@simplesis.test,Juggler,,Juggler,\n'
+            ',Missing,Email,Student,\n'
+        )
+
+    def sync(self, **kwargs):
+        return RosterSync(self.school_id, workers=1, **kwargs).run(
+            read_csv(self.roster.splitlines(keepends=True))
+        )
+
+    def test_sync(self):
+        # Cached before the update, which bypasses the signals
+        self.client.force_login(self.users[1])
+        get_user(SimpleNamespace(session=self.client.session))
+        self.assertIsNotNone(cache.get(user_key(self.users[1].id)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            sync = self.sync(deactivate_despite_errors=True)
+        self.assertEqual(
+            sync.counts,
+            {'created': 2, 'updated': 2, 'deactivated': 1, 'unchanged': 1},
+        )
+        self.assertEqual(
+            sync.errors,
+            [
+                (7, 'Duplicate email "NEW@simplesis.test"'),
+                (8, 'Unknown account type "Juggler"'),
+                (9, 'Missing email'),
+            ],
+        )
+        self.assertIsNone(cache.get(user_key(self.users[1].id)))
+
+        users = {user.email: user for user in User.objects.all()}
+        self.assertEqual(users[self.users[1].email].first_name, 'Renamed')
+        self.assertFalse(users[self.users[2].email].is_active)
+        self.assertTrue(users[self.users[3].email].is_active)
+        self.assertTrue(users['new@simplesis.test'].check_password('s3cret'))
+        self.assertFalse(
+            users['nopassword@simplesis.test'].has_usable_password()
+        )
+        # Only students are listed, so the staff are left alone
+        self.assertTrue(users[self.teacher.email].is_active)
+
+        # Syncing the same roster again changes nothing
+        sync = self.sync()
+        self.assertEqual(sync.counts['unchanged'], 5)
+        self.assertEqual(sync.counts['created'], 0)
+
+    def test_dry_run(self):
+        # Account types, existing users and users missing from the roster
+        with self.assertNumQueries(3):
+            sync = self.sync(dry_run=True, deactivate_despite_errors=True)
+        self.assertEqual(
+            sync.as_dict()['emails'],
+            {
+                'created': ['new@simplesis.test', 'nopassword@simplesis.test'],
+                'updated': [self.users[1].email, self.users[3].email],
+                'deactivated': [self.users[2].email],
+            },
+        )
+        self.assertFalse(User.objects.filter(email='new@simplesis.test'))
+        self.assertTrue(User.objects.get(id=self.users[2].id).is_active)
+
+    def test_invalid_rows_deactivate_no_one(self):
+        self.roster = (
+            'email,account_type\n'
+            f'{self.users[0].email},Student\n'
+            f'{self.users[1].email},Studentx\n'
+        )
+        sync = self.sync()
+        self.assertEqual(sync.errors, [(3, 'Unknown account type "Studentx"')])
+        self.assertEqual(
+            (sync.counts['deactivated'], sync.skipped_deactivations), (0, 1)
+        )
+        self.assertTrue(User.objects.get(id=self.users[2].id).is_active)
+
+        # Even then, the user of the invalid row is left alone
+        sync = self.sync(deactivate_despite_errors=True)
+        self.assertEqual(sync.emails['deactivated'], [self.users[2].email])
+        self.assertTrue(User.objects.get(id=self.users[1].id).is_active)
+
+    def test_users_of_other_schools_and_admins_are_left_alone(self):
+        school = School.objects.create(
+            name='Other', location=self.users[0].school.location
+        )
+        outsider = User.objects.create_user(
+            'outsider@simplesis.test', school=school
+        )
+        superuser = User.objects.create_superuser(
+            'admin@simplesis.test', school_id=self.school_id
+        )
+        self.roster = (
+            'email,first_name,account_type\n'
+            f'{outsider.email},Taken,Student\n'
+            f'{superuser.email},Taken,Student\n'
+        )
+        sync = self.sync()
+        self.assertEqual(
+            sync.errors,
+            [
+                (2, f'User "{outsider.email}" belongs to another school'),
+                (3, f'User "{superuser.email}" is an admin'),
+            ],
+        )
+        self.assertEqual(sync.counts['updated'], 0)
+        for user in (outsider, superuser):
+            self.assertEqual(
+                User.objects.get(id=user.id).school_id, user.school_id
+            )
+
+    def test_json(self):
+        roster = json.dumps(
+            [
+                {
+                    'email': 'new@simplesis.test',
+                    'first_name': 'New',
+                    'account_type': 'Student',
+                },
+                'not an object',
+            ]
+        )
+        sync = RosterSync(self.school_id, dry_run=True).run(
+            read_json(BytesIO(roster.encode()))
+        )
+        self.assertEqual(sync.counts['created'], 1)
+        self.assertEqual(sync.errors, [(2, 'Missing email, account_type')])
+
+    def test_hashing_in_parallel(self):
+        hashes = hash_passwords(['a', 'b', 'c'], workers=2)
+        self.assertEqual(
+            [check_password(password, hash) for password, hash in zip(
+                'abc', hashes
+            )],
+            [True] * 3,
+        )
+
+
+class BulkAttendeeUpdateTests(TestCase):
+    def setUp(self):
+        DataGenerator(
+            schools=1,
+            venues=1,
+            users_per_school=10,
+            activities_per_school=1,
+            attendees_per_activity=10,
+            carnival_attendees=0,
+        ).generate()
+        self.activity = Activity.objects.get()
+        self.user = User.objects.first()
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+
+    def post(self, action, data):
+        return self.client.post(
+            reverse(
+                'update-attendees',
+                kwargs={'id': self.activity.id, 'action': action},
+            ),
+            data,
+        )
+
+    def test_approve_section(self):
+        participants = self.activity.attendees.filter(is_organiser=False)
+        pending = list(participants.filter(approved_at__isnull=True))
+        approved = participants.count() - len(pending)
+
+        with self.assertNumQueries(9):
+            response = self.post('approve', {'section': 'participants'})
+        self.assertEqual(response.json()['updated'], len(pending))
+        self.assertEqual(
+            response.json()['counts']['approved_count'],
+            self.activity.attendees.filter(approved_at__isnull=False).count(),
+        )
+        # Earlier approvals are kept, the new ones are tracked
+        self.assertEqual(
+            participants.filter(
+                approved_by=self.user, updated_by=self.user
+            ).count(),
+            len(pending),
+        )
+        self.assertEqual(
+            participants.exclude(approved_by=self.user).count(), approved
+        )
+
+    def test_mark_attended_by_id(self):
+        absent = self.activity.attendees.filter(attended_at__isnull=True)
+        ids = list(absent.values_list('id', flat=True)[:3])
+        self.assertEqual(self.post('attend', {'id': ids}).json()['updated'], 3)
+        self.assertEqual(self.post('attend', {'id': ids}).json()['updated'], 0)
+        self.assertFalse(absent.filter(id__in=ids).exists())
+
+    def test_invalid_selection(self):
+        self.assertEqual(self.post('approve', {}).status_code, 400)
+        self.assertEqual(self.post('approve', {'id': 'x'}).status_code, 400)
+        self.assertEqual(
+            self.post('delete', {'section': 'participants'}).status_code, 404
+        )
+
+
+class CheckInTests(TestCase):
+    def setUp(self):
+        DataGenerator(
+            schools=1,
+            venues=1,
+            users_per_school=10,
+            activities_per_school=1,
+            attendees_per_activity=10,
+            carnival_attendees=0,
+        ).generate()
+        self.activity = Activity.objects.get()
+        self.activity.attendees.update(attended_at=None)
+        self.attendees = list(
+            self.activity.attendees.select_related('user').order_by('id')
+        )
+        self.user = self.attendees[0].user
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+
+    def post(self, name, body):
+        return self.client.post(
+            reverse(name, kwargs={'id': self.activity.id}),
+            json.dumps(body),
+            content_type='application/json',
+        )
+
+    def test_check_in(self):
+        attendee = self.attendees[1]
+        first = self.post('check-in', {'email': attendee.user.email}).json()
+        self.assertFalse(first['attendee']['already_checked_in'])
+        # Scanning again keeps the time of the first scan
+        again = self.post('check-in', {'user': attendee.user_id}).json()
+        self.assertTrue(again['attendee']['already_checked_in'])
+        self.assertEqual(
+            again['attendee']['attended_at'],
+            first['attendee']['attended_at'],
+        )
+
+        response = self.post('check-in', {'email': 'nobody@simplesis.test'})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.post('check-in', {}).status_code, 400)
+
+    def test_sync(self):
+        now = timezone.now()
+        early = now - timedelta(hours=2)
+        late = now - timedelta(hours=1)
+        first, second, third = self.attendees[1:4]
+        # Checked in live, after the offline scan
+        ActivityAttendee.objects.filter(id=first.id).mark_attended(None, late)
+        # Checked in live, before the offline scan
+        ActivityAttendee.objects.filter(id=third.id).mark_attended(None, early)
+
+        result = self.post(
+            'sync-check-ins', {
+                'check_ins': [
+                    {'user': first.user_id, 'at': early.isoformat()},
+                    {'email': second.user.email.upper(),
+                     'at': late.isoformat()},
+                    {'user': second.user_id, 'at': early.isoformat()},
+                    {'user': third.user_id, 'at': late.isoformat()},
+                    {'user': first.user_id, 'at': 'yesterday'},
+                    {'user': first.user_id, 'at': '2021-02-30T09:00:00'},
+                    {'user': first.user_id,
+                     'at': (now + timedelta(hours=1)).isoformat()},
+                    {'email': 'nobody@simplesis.test',
+                     'at': early.isoformat()},
+                ]
+            }
+        ).json()
+
+        self.assertEqual((result['received'], result['applied']), (8, 2))
+        self.assertEqual(
+            result['errors'],
+            [
+                {'index': 4, 'error': 'Invalid check-in time'},
+                {'index': 5, 'error': 'Invalid check-in time'},
+                {'index': 6, 'error': 'Check-in time is in the future'},
+                {'index': 7, 'error': 'Not attending this activity'},
+            ],
+        )
+        # The earliest time wins
+        times = dict(
+            self.activity.attendees.values_list('id', 'attended_at')
+        )
+        self.assertEqual(times[first.id], early)
+        self.assertEqual(times[second.id], early)
+        self.assertEqual(times[third.id], early)
+
+
+class CounterTests(TestCase):
+    def setUp(self):
+        DataGenerator(
+            schools=1,
+            venues=1,
+            users_per_school=10,
+            activities_per_school=2,
+            attendees_per_activity=5,
+            carnival_attendees=0,
+        ).generate()
+        self.activity, self.other = Activity.objects.order_by('id')
+        self.users = list(User.objects.order_by('id'))
+
+    def assertCounts(self, activity, counts):
+        activity.refresh_from_db()
+        self.assertEqual(
+            tuple(getattr(activity, field) for field in COUNTER_FIELDS),
+            counts,
+        )
+
+    def test_generated(self):
+        self.assertEqual(recompute_counters(), 0)
+        self.assertEqual(self.activity.attendee_count, 5)
+
+    def test_changes(self):
+        self.activity.attendees.all().delete()
+        self.assertCounts(self.activity, (0, 0, 0, 0))
+
+        attendee = ActivityAttendee.objects.create(
+            activity=self.activity,
+            user=self.users[0],
+            attendee_type=LookupCode.objects.get(code='ATTENDEE_STUDENT'),
+            is_organiser=True,
+        )
+        self.assertCounts(self.activity, (1, 1, 0, 0))
+        ActivityAttendee.objects.filter(id=attendee.id).approve(None)
+        self.assertCounts(self.activity, (1, 1, 1, 0))
+
+        # Moving an attendee over counts them towards the other activity
+        attendee = ActivityAttendee.objects.get(id=attendee.id)
+        attendee.activity = self.other
+        attendee.is_organiser = False
+        attendee.save()
+        self.assertCounts(self.activity, (0, 0, 0, 0))
+        attendee.delete()
+        self.assertEqual(recompute_counters(), 0)
+
+        AttendeeImport(self.activity.id).run(
+            ['email,role\n']
+            + [f'{user.email},Student\n' for user in self.users]
+        )
+        check_in(self.activity.id, {'user': self.users[1].id}, None)
+        self.assertCounts(self.activity, (10, 0, 0, 1))
+        self.assertEqual(recompute_counters(), 0)
+
+        # Deleting activities doesn't bother with their counters
+        Activity.objects.all().delete()
+
+    def test_failed_activity_delete(self):
+        def fail(sender, instance, **kwargs):
+            raise DatabaseError('Delete failed')
+
+        pre_delete.connect(fail, sender=Activity)
+        try:
+            with self.assertRaises(DatabaseError), transaction.atomic():
+                self.activity.delete()
+        finally:
+            pre_delete.disconnect(fail, sender=Activity)
+
+        # The activity's counters are still maintained
+        self.activity.attendees.all().delete()
+        self.assertCounts(self.activity, (0, 0, 0, 0))
+
+    def test_saving_a_stale_activity(self):
+        stale = Activity.objects.get(id=self.activity.id)
+        self.activity.attendees.all().delete()
+        stale.name = 'Renamed'
+        stale.save()
+        self.assertCounts(self.activity, (0, 0, 0, 0))
+
+    def test_repair(self):
+        # Plain updates aren't tracked
+        self.activity.attendees.update(approved_at=None, attended_at=None)
+        self.assertEqual(recompute_counters(), 1)
+        self.assertEqual(recompute_counters(), 0)
+        self.activity.refresh_from_db()
+        self.assertEqual(
+            (self.activity.approved_count, self.activity.attended_count),
+            (0, 0),
+        )
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        DataGenerator(
+            schools=1,
+            venues=2,
+            users_per_school=5,
+            activities_per_school=3,
+            attendees_per_activity=2,
+            carnival_attendees=0,
+        ).generate()
+        self.activity = Activity.objects.order_by('id').first()
+        self.activity.start_date = timezone.now() + timedelta(days=1)
+        self.activity.save()
+        self.user = User.objects.first()
+        self.client.force_login(self.user)
+        self.home = reverse('home') + '?when=all'
+        self.view = reverse('view-activity', kwargs={'id': self.activity.id})
+
+    def assertShown(self, text):
+        self.assertContains(self.client.get(self.home), text)
+        self.assertContains(self.client.get(self.view), text)
+
+    def test_saving_bumps_updated_date(self):
+        updated_date = self.activity.updated_date
+        self.activity.name = 'Renamed'
+        self.activity.save(update_fields=['name'])
+        self.activity.refresh_from_db()
+        self.assertGreater(self.activity.updated_date, updated_date)
+
+    def test_fragments_are_served_from_cache(self):
+        self.client.get(self.home)
+        # Changing the data behind the cache's back isn't noticed
+        Activity.objects.filter(id=self.activity.id).update(name='Hidden')
+        self.assertNotContains(self.client.get(self.home), 'Hidden')
+
+    def test_changes_show_up(self):
+        self.activity.attendees.update(approved_at=None)
+        recompute_counters()
+        self.assertShown(self.activity.name)
+        self.assertShown('0 approved')
+
+        self.activity.name = 'Renamed activity'
+        self.activity.save()
+        self.assertShown('Renamed activity')
+
+        venue = self.activity.venue
+        venue.name = 'Renamed venue'
+        venue.save()
+        self.assertShown('Renamed venue')
+
+        location = venue.location
+        location.address_line_1 = '1 Renamed Street'
+        location.save()
+        self.assertShown('1 Renamed Street')
+
+        category = LookupCode.objects.get(id=self.activity.category_id)
+        category.name = 'Renamed category'
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+        self.assertShown('Renamed category')
+
+        self.activity.attendees.approve(self.user)
+        self.assertShown('2 approved')
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        DataGenerator(
+            schools=1,
+            venues=1,
+            users_per_school=5,
+            activities_per_school=3,
+            attendees_per_activity=3,
+            carnival_attendees=0,
+        ).generate()
+        self.activity = Activity.objects.order_by('id').first()
+        self.client.force_login(User.objects.first())
+        self.home = reverse('home') + '?when=all'
+        self.view = reverse('view-activity', kwargs={'id': self.activity.id})
+
+    def assertNotModified(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            # The version of the page, the session and the user are cached
+            response = self.client.get(
+                path, HTTP_IF_NONE_MATCH=response['ETag']
+            )
+        self.assertEqual(response.status_code, 304)
+        return response
+
+    def test_home(self):
+        etag = self.assertNotModified(self.home)['ETag']
+
+        self.activity.name = 'Renamed'
+        self.activity.save()
+        response = self.client.get(self.home, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Renamed')
+
+        etag = response['ETag']
+        Activity.objects.exclude(id=self.activity.id).first().delete()
+        response = self.client.get(self.home, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_activity(self):
+        response = self.assertNotModified(self.view)
+        response = self.client.get(
+            self.view, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # Changes to the roster which don't affect the counters
+        attendee = self.activity.attendees.first()
+        attendee.attendee_type = LookupCode.objects.get(
+            code='ATTENDEE_VOLUNTEER'
+        )
+        attendee.save()
+        response = self.client.get(
+            self.view, HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(
+            reverse('view-activity', kwargs={'id': 0}),
+            HTTP_IF_NONE_MATCH='*',
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        DataGenerator(
+            schools=1,
+            venues=2,
+            users_per_school=10,
+            activities_per_school=5,
+            attendees_per_activity=7,
+            carnival_attendees=0,
+        ).generate()
+        self.activity = Activity.objects.order_by('id').first()
+        self.user = User.objects.first()
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+
+    def export(self, name, **kwargs):
+        response = self.client.get(reverse(name, kwargs=kwargs))
+        self.assertTrue(response.streaming)
+        return response, response.getvalue()
+
+    def test_chunks(self):
+        activities = Activity.objects.values('id', 'start_date')
+        keys = ('-start_date', 'id')
+        chunks = list(iter_chunks(activities, keys, chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual(
+            [row for chunk in chunks for row in chunk],
+            list(activities.order_by(*keys)),
+        )
+
+    def test_roster_csv(self):
+        response, content = self.export(
+            'export-roster', id=self.activity.id, format='csv'
+        )
+        self.assertIn('attachment;', response['Content-Disposition'])
+        rows = list(csv.reader(content.decode('utf-8-sig').splitlines()))
+        self.assertEqual(rows[0][:3], ['First name', 'Last name', 'Email'])
+        self.assertEqual(
+            sorted(row[2] for row in rows[1:]),
+            sorted(
+                self.activity.attendees.values_list('user__email', flat=True)
+            ),
+        )
+
+    def test_activities_xlsx(self):
+        _, content = self.export('export-activities', format='xlsx')
+        with zipfile.ZipFile(BytesIO(content)) as archive:
+            self.assertIsNone(archive.testzip())
+            sheet = archive.read('xl/worksheets/sheet1.xml').decode()
+        activities = Activity.objects.upcoming()
+        self.assertEqual(sheet.count('<row>'), 1 + activities.count())
+        self.assertIn(escape(activities.first().name), sheet)
+
+    def test_roster_only_for_managers(self):
+        self.user.is_staff = False
+        self.user.save()
+        path = reverse(
+            'export-roster', kwargs={'id': self.activity.id, 'format': 'csv'}
+        )
+        self.assertEqual(self.client.get(path).status_code, 404)
+
+        ActivityAttendee.objects.update_or_create(
+            activity=self.activity,
+            user=self.user,
+            defaults={
+                'is_organiser': True,
+                'attendee_type':
+                    LookupCode.objects.get(code='ATTENDEE_STAFF'),
+            },
+        )
+        self.assertEqual(self.client.get(path).status_code, 200)
+
+    def test_formulas_are_exported_as_text(self):
+        attendee = self.activity.attendees.order_by('id').first()
+        User.objects.filter(id=attendee.user_id).update(
+            first_name='=HYPERLINK("http://example.com")', last_name='-1'
+        )
+        _, content = self.export(
+            'export-roster', id=self.activity.id, format='csv'
+        )
+        rows = list(csv.reader(content.decode('utf-8-sig').splitlines()))
+        self.assertIn(
+            ["'=HYPERLINK(\"http://example.com\")", "'-1"],
+            [row[:2] for row in rows],
+        )
+
+        _, content = self.export(
+            'export-roster', id=self.activity.id, format='xlsx'
+        )
+        with zipfile.ZipFile(BytesIO(content)) as archive:
+            sheet = archive.read('xl/worksheets/sheet1.xml').decode()
+        self.assertIn('<t>=HYPERLINK("http://example.com")</t>', sheet)
+        self.assertNotIn('<f>', sheet)
+
+    def test_unknown_format(self):
+        response = self.client.get(
+            reverse('export-activities', kwargs={'format': 'pdf'})
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class AsgiExportTests(TransactionTestCase):
+    def setUp(self):
+        DataGenerator(
+            schools=1,
+            venues=1,
+            users_per_school=5,
+            activities_per_school=1,
+            attendees_per_activity=4,
+            carnival_attendees=0,
+        ).generate()
+        self.activity = Activity.objects.get()
+        user = User.objects.first()
+        user.is_staff = True
+        user.save()
+        self.client.force_login(user)
+
+    def test_export_streams_under_asgi(self):
+        name = settings.SESSION_COOKIE_NAME
+        session = f'{name}={self.client.cookies[name].value}'
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': reverse(
+                'export-roster',
+                kwargs={'id': self.activity.id, 'format': 'csv'},
+            ),
+            'query_string': b'',
+            'headers': [
+                (b'host', b'testserver'),
+                (b'cookie', session.encode()),
+            ],
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        # Run like a server would, so that the rows are fetched outside
+        # of the event loop or not at all
+        app = PerRequestThreads(StreamingASGIHandler())
+        asyncio.run(app(scope, receive, send))
+
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertFalse(messages[-1].get('more_body', False))
+        content = b''.join(message.get('body', b'') for message in messages)
+        rows = list(csv.reader(content.decode('utf-8-sig').splitlines()))
+        self.assertEqual(
+            sorted(row[2] for row in rows[1:]),
+            sorted(
+                self.activity.attendees.values_list('user__email', flat=True)
+            ),
+        )
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        DataGenerator(
+            schools=2,
+            venues=2,
+            users_per_school=10,
+            activities_per_school=30,
+            attendees_per_activity=4,
+            carnival_attendees=0,
+        ).generate()
+        self.user = User.objects.order_by('id').first()
+        activities = Activity.objects.order_by('id')
+        self.activity = activities.filter(school_id=self.user.school_id)[0]
+        self.other_activity = activities.exclude(
+            school_id=self.user.school_id
+        )[0]
+        self.client.force_login(self.user)
+
+    def test_activities(self):
+        path = reverse('api-activities') + '?when=all'
+        first = self.client.get(path).json()
+        second = self.client.get(f'{path}&after={first["next"]}').json()
+        self.assertIsNone(second['next'])
+        self.assertEqual(
+            [
+                activity['id']
+                for activity in first['activities'] + second['activities']
+            ],
+            list(
+                Activity.objects.filter(
+                    school_id=self.user.school_id
+                ).order_by('start_date', 'id').values_list('id', flat=True)
+            ),
+        )
+
+    async def test_activity(self):
+        self.async_client.cookies = self.client.cookies
+        response = await self.async_client.get(
+            reverse('api-activity', kwargs={'id': self.activity.id})
+        )
+        activity = response.json()
+        self.assertEqual(activity['name'], self.activity.name)
+        self.assertEqual(
+            activity['counts']['attendee_count'], self.activity.attendee_count
+        )
+
+        response = await self.async_client.get(
+            reverse('api-activity', kwargs={'id': self.other_activity.id})
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_attendees(self):
+        path = reverse('api-attendees', kwargs={'id': self.activity.id})
+        attendees = self.client.get(path).json()['attendees']
+        self.assertEqual(
+            sorted(attendee['user'] for attendee in attendees),
+            sorted(
+                self.activity.attendees.filter(
+                    is_organiser=False
+                ).values_list('user_id', flat=True)
+            ),
+        )
+        # Emails are only listed to those managing the activity
+        self.assertNotIn('email', attendees[0])
+        self.user.is_staff = True
+        self.user.save()
+        attendees = self.client.get(path).json()['attendees']
+        self.assertEqual(
+            sorted(attendee['email'] for attendee in attendees),
+            sorted(
+                self.activity.attendees.filter(
+                    is_organiser=False
+                ).values_list('user__email', flat=True)
+            ),
+        )
+        response = self.client.get(path + '?section=everyone')
+        self.assertEqual(response.status_code, 400)
+
+        self.client.logout()
+        response = self.client.get(path)
+        self.assertRedirects(
+            response, f'{reverse("login")}?next={path}', 302,
+            fetch_redirect_response=False
+        )
+
+
+class PerRequestThreadsTests(TestCase):
+    def test_requests_get_threads_of_their_own(self):
+        # Both requests have to be on their threads at the same time to
+        # get past the barrier, they'd time out sharing a thread
+        barrier = threading.Barrier(2, timeout=5)
+
+        async def app(scope, receive, send):
+            await sync_to_async(barrier.wait)()
+
+        async def serve():
+            app_ = PerRequestThreads(app)
+            await asyncio.gather(app_({}, None, None), app_({}, None, None))
+
+        # Run like a server would, rather than as an async test, whose
+        # synchronous work is all sent back to the thread running it
+        asyncio.run(serve())
+
+
+class LiveEventsTests(TransactionTestCase):
+    def setUp(self):
+        DataGenerator(
+            schools=1,
+            venues=1,
+            users_per_school=5,
+            activities_per_school=1,
+            attendees_per_activity=4,
+            carnival_attendees=0,
+        ).generate()
+        ActivityAttendee.objects.update(attended_at=None)
+        recompute_counters()
+        self.activity = Activity.objects.get()
+        self.user = User.objects.first()
+        self.client.force_login(self.user)
+        self.path = reverse('activity-events', kwargs={'id': self.activity.id})
+
+    def listen(self, messages, disconnect, cookie=True):
+        """Connect a stream, like a server would, collecting the ASGI
+        messages sent.
+        """
+        name = settings.SESSION_COOKIE_NAME
+        session = f'{name}={self.client.cookies[name].value}'
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': self.path,
+            'headers': [(b'cookie', session.encode())] if cookie else [],
+        }
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        return live.LiveEvents(None)(scope, receive, messages.put)
+
+    async def next_event(self, messages):
+        message = await asyncio.wait_for(messages.get(), 5)
+        data = message['body'].decode().split('data: ', 1)[1]
+        return json.loads(data)
+
+    def test_changes_are_pushed_to_every_stream(self):
+        attendee = self.activity.attendees.first()
+
+        async def scenario():
+            disconnect = asyncio.Event()
+            streams = []
+            for _ in range(2):
+                messages = asyncio.Queue()
+                streams.append(
+                    (
+                        messages,
+                        asyncio.ensure_future(
+                            self.listen(messages, disconnect)
+                        ),
+                    )
+                )
+            for messages, _ in streams:
+                start = await asyncio.wait_for(messages.get(), 5)
+                self.assertEqual(start['status'], 200)
+                event = await self.next_event(messages)
+                self.assertEqual(event['counts']['attended_count'], 0)
+
+            await sync_to_async(check_in, thread_sensitive=False)(
+                self.activity.id, {'user': attendee.user_id}, self.user
+            )
+            for messages, _ in streams:
+                event = await self.next_event(messages)
+                self.assertEqual(event['counts']['attended_count'], 1)
+                self.assertEqual(event['recent'][0]['id'], attendee.id)
+
+            disconnect.set()
+            await asyncio.gather(*(stream for _, stream in streams))
+
+        with mock.patch.object(live.broker, 'interval', 0), \
+                mock.patch.object(
+                    live, 'attendance_event', wraps=live.attendance_event
+                ) as loads:
+            asyncio.run(scenario())
+        # Once for each stream connecting, then once for both streams
+        self.assertEqual(loads.call_count, 3)
+        self.assertEqual(live.broker.subscriptions, {})
+
+    def test_logged_out(self):
+        async def scenario():
+            messages = asyncio.Queue()
+            await self.listen(messages, asyncio.Event(), cookie=False)
+            return await messages.get()
+
+        self.assertEqual(asyncio.run(scenario())['status'], 403)
+
+
+class AuthenticationCacheTests(TestCase):
+    def setUp(self):
+        DataGenerator(
+            schools=1,
+            venues=1,
+            users_per_school=3,
+            activities_per_school=1,
+            attendees_per_activity=0,
+            carnival_attendees=0,
+        ).generate()
+        self.user = User.objects.order_by('id').first()
+        self.client.force_login(self.user)
+        self.path = reverse('api-activities')
+
+    def current_user(self):
+        return get_user(SimpleNamespace(session=self.client.session))
+
+    def test_no_queries_for_the_user(self):
+        self.client.get(self.path)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        tables = ('django_session', User._meta.db_table)
+        self.assertEqual(
+            [
+                query['sql'] for query in queries
+                if any(table in query['sql'] for table in tables)
+            ],
+            [],
+        )
+
+    def test_changes_are_seen(self):
+        self.current_user()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Renamed'
+            self.user.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.school.name = 'Renamed School'
+            self.user.school.save()
+        user = self.current_user()
+        self.assertEqual(user.first_name, 'Renamed')
+        self.assertEqual(user.school.name, 'Renamed School')
+
+    def test_password_change_logs_out(self):
+        self.client.get(self.path)
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertEqual(self.client.get(self.path).status_code, 302)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Copies SQLite databases')
+@override_settings(REPLICA_DATABASES=['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    """Routing between the test database and a copy of it in a second
+    SQLite database, standing in for a replica lagging behind.
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Set up once the test runner is done with the databases, which
+        # only knows about the configured ones
+        cls.directory = TemporaryDirectory()
+        connections.databases['replica'] = {
+            **connections.databases['default'],
+            'NAME': os.path.join(cls.directory.name, 'replica.sqlite3'),
+            'CONN_MAX_AGE': 60,
+            'CONN_HEALTH_CHECKS': True,
+            'TEST': {'MIRROR': 'default'},
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        DataGenerator(
+            schools=1,
+            venues=1,
+            users_per_school=3,
+            activities_per_school=1,
+            attendees_per_activity=0,
+            carnival_attendees=0,
+        ).generate()
+        self.activity = Activity.objects.get()
+        self.client.force_login(User.objects.first())
+        # Replicate what there is so far, then fall behind
+        replica = connections['replica']
+        replica.close()
+        connection.ensure_connection()
+        copy = sqlite3.connect(replica.settings_dict['NAME'])
+        connection.connection.backup(copy)
+        copy.close()
+        Activity.objects.filter(id=self.activity.id).update(name='Renamed')
+
+    def name(self):
+        return Activity.objects.get(id=self.activity.id).name
+
+    def test_requests_read_from_the_replica(self):
+        response = self.client.get(
+            reverse('api-activity', kwargs={'id': self.activity.id})
+        )
+        self.assertEqual(response.json()['name'], self.activity.name)
+
+    def test_reads_after_writes_go_to_the_primary(self):
+        with replica_reads():
+            self.assertEqual(self.name(), self.activity.name)
+            with transaction.atomic():
+                self.assertEqual(self.name(), 'Renamed')
+            self.assertEqual(self.name(), self.activity.name)
+            Activity.objects.filter(id=self.activity.id).update(
+                description='Changed'
+            )
+            self.assertEqual(self.name(), 'Renamed')
+        self.assertEqual(self.name(), 'Renamed')
+
+    def test_broken_connections_are_closed(self):
+        replica = connections['replica']
+        replica.ensure_connection()
+        request_started.send(sender=None)
+        self.assertIsNotNone(replica.connection)
+        with mock.patch.object(replica, 'is_usable', return_value=False):
+            request_started.send(sender=None)
+        self.assertIsNone(replica.connection)
+
+
+class LoginThrottlingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        DataGenerator(
+            schools=1,
+            venues=1,
+            users_per_school=3,
+            activities_per_school=1,
+            attendees_per_activity=0,
+            carnival_attendees=0,
+        ).generate()
+        self.emails = list(
+            User.objects.order_by('id').values_list('email', flat=True)
+        )
+
+    def log_in(self, email, password='wrong'):
+        return self.client.post(
+            reverse('login'), {'username': email, 'password': password}
+        )
+
+    def test_account_is_throttled(self):
+        for _ in range(throttling.ACCOUNT_FAILURE_LIMIT):
+            self.assertEqual(self.log_in(self.emails[0]).status_code, 200)
+        with mock.patch('simple_sis.views.authenticate') as authenticate:
+            response = self.log_in(self.emails[0], '12345')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(
+            response['Retry-After'], str(throttling.ACCOUNT_WINDOW)
+        )
+        authenticate.assert_not_called()
+
+        # Other accounts may still log in from the same IP
+        self.assertEqual(self.log_in(self.emails[1], '12345').status_code, 302)
+        self.assertEqual(
+            throttling.login_metrics(),
+            {
+                'hashed': throttling.ACCOUNT_FAILURE_LIMIT + 1,
+                'succeeded': 1,
+                'rejected': 1,
+            },
+        )
+
+    def test_ip_is_throttled(self):
+        with mock.patch.object(throttling.ip_failures, 'limit', 2):
+            self.log_in(self.emails[0])
+            self.log_in(self.emails[1])
+            response = self.log_in(self.emails[2], '12345')
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(
+                response['Retry-After'], str(throttling.IP_WINDOW)
+            )
+            response = self.client.post(
+                reverse('login'),
+                {'username': self.emails[2], 'password': '12345'},
+                REMOTE_ADDR='10.0.0.2',
+            )
+            self.assertEqual(response.status_code, 302)
+
+    def test_success_clears_failures(self):
+        for _ in range(throttling.ACCOUNT_FAILURE_LIMIT - 1):
+            self.log_in(self.emails[0])
+        self.log_in(self.emails[0], '12345')
+        self.client.logout()
+        self.log_in(self.emails[0])
+        self.assertEqual(self.log_in(self.emails[0], '12345').status_code, 302)
+
+    def test_client_ip(self):
+        request = SimpleNamespace(
+            META={
+                'REMOTE_ADDR': '10.0.0.1',
+                'HTTP_X_FORWARDED_FOR': '1.2.3.4, 203.0.113.7, 10.0.0.9',
+            }
+        )
+        self.assertEqual(throttling.client_ip(request), '10.0.0.1')
+        # IPs ahead of those appended by our proxies may be forged
+        with override_settings(CLIENT_IP_HEADER='HTTP_X_FORWARDED_FOR'):
+            self.assertEqual(throttling.client_ip(request), '10.0.0.9')
+            with override_settings(CLIENT_IP_PROXY_COUNT=2):
+                self.assertEqual(
+                    throttling.client_ip(request), '203.0.113.7'
+                )
+            with override_settings(CLIENT_IP_PROXY_COUNT=5):
+                self.assertEqual(throttling.client_ip(request), '1.2.3.4')
+
+    def test_sliding_window(self):
+        window = throttling.SlidingWindow('test', 10, 100)
+        window.add('name', 50)
+        window.add('name', 99)
+        window.add('name', 120)
+        counts = cache.get_many(window.keys('name', 175))
+        # A quarter of the previous window still overlaps
+        self.assertEqual(window.count(counts, 'name', 175), 1 + 2 * 0.25)
+
+
+class AdminTests(TestCase):
+    def setUp(self):
+        DataGenerator(
+            schools=2,
+            venues=3,
+            users_per_school=5,
+            activities_per_school=3,
+            attendees_per_activity=3,
+            carnival_attendees=0,
+        ).generate()
+        self.user = User.objects.order_by('id').first()
+        self.user.is_staff = True
+        self.user.is_superuser = True
+        self.user.save()
+        self.client.force_login(self.user)
+
+    def test_changelists_join_related_objects(self):
+        for model in (User, School, Venue, LookupCode, ActivityAttendee):
+            path = reverse(
+                f'admin:simple_sis_{model._meta.model_name}_changelist'
+            )
+            with self.subTest(model.__name__):
+                self.client.get(path)
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(path)
+                self.assertEqual(response.status_code, 200)
+                # Session and user, the count and the page of rows
+                self.assertLessEqual(len(queries), 4)
+
+    def test_change_forms_search_related_objects(self):
+        attendee = ActivityAttendee.objects.first()
+        response = self.client.get(
+            reverse(
+                'admin:simple_sis_activityattendee_change',
+                args=[attendee.id],
+            )
+        )
+        # Only the selected users are rendered, not every user
+        self.assertEqual(
+            response.content.decode().count('data-theme="admin-autocomplete"'),
+            6,
+        )
+        self.assertNotContains(response, User.objects.last().email)
+
+        response = self.client.get(
+            reverse('admin:autocomplete'),
+            {
+                'app_label': 'simple_sis',
+                'model_name': 'activityattendee',
+                'field_name': 'user',
+                'term': self.user.email[:5],
+            },
+        )
+        self.assertIn(
+            str(self.user.id),
+            [result['id'] for result in response.json()['results']],
+        )
+
+    def test_searches_of_large_tables_are_indexed(self):
+        for model, model_admin in (
+            (User, admin.UserAdmin),
+            (Activity, admin.ActivityAdmin),
+            (Location, admin.LocationAdmin),
+        ):
+            indexed = {index.fields[0] for index in model._meta.indexes}
+            indexed |= {
+                field.name for field in model._meta.fields if field.unique
+            }
+            for field in model_admin.search_fields:
+                with self.subTest(model=model.__name__, field=field):
+                    # By prefix, as only those can use the index
+                    self.assertTrue(field.startswith('^'))
+                    self.assertIn(field[1:], indexed)
+
+    def test_estimated_counts(self):
+        users = User.objects.order_by('id')
+        paginate = admin.EstimatedCountPaginator
+        with mock.patch.object(admin, 'estimated_count', return_value=50000):
+            self.assertEqual(paginate(users, 10).count, 50000)
+            staff = users.filter(is_staff=True)
+            self.assertEqual(paginate(staff, 10).count, 1)
+        # Small tables are counted exactly
+        with mock.patch.object(admin, 'estimated_count', return_value=100):
+            self.assertEqual(paginate(users, 10).count, users.count())
@@ -0,0 +1,156 @@
+"""Throttling of failed logins.
+
+Checking a password costs a deliberately slow hash, so a burst of bad
+logins, e.g. a bot trying leaked passwords, would take the CPU away
+from everyone else. Failed logins are therefore counted per account and
+per client IP over sliding windows, and logins past either limit are
+rejected before any password is hashed, which bounds the hashing an
+attacker can cause. The limit per IP is generous, as a whole school may
+log in from behind a single IP.
+
+The counts are kept in the (default) cache, which has to be shared by
+all processes once there are several of them, and so are the metrics
+of hashed and rejected logins, see `login_metrics()`.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Failed logins allowed per account, and per client IP, within their
+# window of seconds
+ACCOUNT_FAILURE_LIMIT = 5
+ACCOUNT_WINDOW = 15 * 60
+IP_FAILURE_LIMIT = 100
+IP_WINDOW = 5 * 60
+
+# Logins let through to hash their password, logins which succeeded
+# of those, and logins rejected without hashing
+LOGIN_METRICS = ('hashed', 'succeeded', 'rejected')
+METRIC_KEY = 'simple_sis:login_metrics:{}'
+
+
+def increment(key, timeout):
+    """Increment the count under `key`, atomically where the cache
+    supports it.
+    """
+    if cache.add(key, 1, timeout):
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout)  # It expired in the meantime
+
+
+class SlidingWindow:
+    """Counts of events over the last `window` seconds, by name.
+
+    Counts are approximated from counters of the current and the
+    previous fixed window, weighing the previous one by how much of it
+    still overlaps with the sliding window, so that the cache can count
+    atomically without keeping every event.
+    """
+    def __init__(self, prefix, limit, window):
+        self.prefix = prefix
+        self.limit = limit
+        self.window = window
+
+    def keys(self, name, now):
+        # Names, e.g. emails, may not be valid cache keys
+        name = hashlib.sha256(name.encode()).hexdigest()
+        slot = int(now // self.window)
+        return (
+            f'simple_sis:{self.prefix}:{name}:{slot}',
+            f'simple_sis:{self.prefix}:{name}:{slot - 1}',
+        )
+
+    def count(self, counts, name, now):
+        """The count of `name` from cached `counts` of its keys."""
+        current, previous = self.keys(name, now)
+        overlap = 1 - (now % self.window) / self.window
+        return counts.get(current, 0) + counts.get(previous, 0) * overlap
+
+    def add(self, name, now):
+        increment(self.keys(name, now)[0], self.window * 2)
+
+    def clear(self, name, now):
+        cache.delete_many(self.keys(name, now))
+
+
+account_failures = SlidingWindow(
+    'login_failures:account', ACCOUNT_FAILURE_LIMIT, ACCOUNT_WINDOW
+)
+ip_failures = SlidingWindow('login_failures:ip', IP_FAILURE_LIMIT, IP_WINDOW)
+
+
+def client_ip(request):
+    """IP of the client of a request, see `CLIENT_IP_HEADER` and
+    `CLIENT_IP_PROXY_COUNT`.
+    """
+    ips = (request.META.get(settings.CLIENT_IP_HEADER) or '').split(',')
+    # Every proxy appends the IP it got the request from to
+    # X-Forwarded-For, so the client is the IP appended by the first of
+    # ours. Any IPs ahead of it are sent by the client, and can't be
+    # trusted.
+    proxies = max(settings.CLIENT_IP_PROXY_COUNT, 1)
+    return ips[-min(proxies, len(ips))].strip()
+
+
+class LoginThrottle:
+    """Failed logins of an account from the client of a request."""
+    def __init__(self, request, username):
+        self.account = (username or '').strip().lower()
+        self.ip = client_ip(request)
+        self.now = time.time()
+        self.retry_after = None  # Seconds to wait, once throttled
+        self.windows = (
+            (account_failures, self.account),
+            (ip_failures, self.ip),
+        )
+
+    def is_throttled(self):
+        """Whether the account or the IP failed too many times to try
+        again yet, setting `retry_after` if so. Counts the login as
+        rejected if so, or as hashed, as its password is checked next.
+        """
+        counts = cache.get_many(
+            [
+                key for window, name in self.windows
+                for key in window.keys(name, self.now)
+            ]
+        )
+        tripped = [
+            window.window for window, name in self.windows
+            if window.count(counts, name, self.now) >= window.limit
+        ]
+        if tripped:
+            # The window of the limit tripped, the longer one if both
+            self.retry_after = max(tripped)
+        count_login('rejected' if tripped else 'hashed')
+        return bool(tripped)
+
+    def failed(self):
+        for window, name in self.windows:
+            window.add(name, self.now)
+
+    def succeeded(self):
+        count_login('succeeded')
+        account_failures.clear(self.account, self.now)
+
+
+def count_login(metric):
+    increment(METRIC_KEY.format(metric), None)
+
+
+def login_metrics():
+    """Numbers of logins by `LOGIN_METRICS`, since the cache was last
+    cleared.
+    """
+    counts = cache.get_many(
+        [METRIC_KEY.format(metric) for metric in LOGIN_METRICS]
+    )
+    return {
+        metric: counts.get(METRIC_KEY.format(metric), 0)
+        for metric in LOGIN_METRICS
+    }
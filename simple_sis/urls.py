@@ -1,9 +1,76 @@
 from django.urls import path
-from .views import home, login, logout, view_activity
+from . import api
+from .views import (
+    activity_events,
+    activity_roster,
+    check_in_attendee,
+    export_activities,
+    export_roster,
+    home,
+    import_attendees,
+    live_activity,
+    login,
+    login_metrics,
+    logout,
+    nearby_venues,
+    sync_attendee_check_ins,
+    update_attendees,
+    view_activity,
+)
 
 urlpatterns = [
     path('login', login, name='login'),
     path('logout', logout, name='logout'),
+    path('metrics/logins', login_metrics, name='login-metrics'),
     path('', home, name='home'),
     path('activities/<int:id>', view_activity, name='view-activity'),
+    path('activities/<int:id>/live', live_activity, name='live-activity'),
+    path(
+        'activities/<int:id>/events',
+        activity_events,
+        name='activity-events',
+    ),
+    path(
+        'activities/export/<str:format>',
+        export_activities,
+        name='export-activities',
+    ),
+    path(
+        'activities/<int:id>/roster/export/<str:format>',
+        export_roster,
+        name='export-roster',
+    ),
+    path(
+        'activities/<int:id>/roster/<str:section>',
+        activity_roster,
+        name='activity-roster',
+    ),
+    path(
+        'activities/<int:id>/attendees/import',
+        import_attendees,
+        name='import-attendees',
+    ),
+    path(
+        'activities/<int:id>/check-in',
+        check_in_attendee,
+        name='check-in',
+    ),
+    path(
+        'activities/<int:id>/check-in/sync',
+        sync_attendee_check_ins,
+        name='sync-check-ins',
+    ),
+    path(
+        'activities/<int:id>/attendees/<str:action>',
+        update_attendees,
+        name='update-attendees',
+    ),
+    path('venues/nearby', nearby_venues, name='nearby-venues'),
+    path('api/activities', api.activities, name='api-activities'),
+    path('api/activities/<int:id>', api.activity, name='api-activity'),
+    path(
+        'api/activities/<int:id>/attendees',
+        api.attendees,
+        name='api-attendees',
+    ),
 ]
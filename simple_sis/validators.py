@@ -1,25 +1,40 @@
 from django.core.exceptions import ValidationError
 
+from .postcodes import check_postcode, check_postcodes, postcode_state
+
 
 def validate_postcode(value):
-    # Try to parse string into integer
-    try:
-        int_value = int(value)
-    except ValueError:
-        raise ValidationError('Postcode must be a number')
+    # Check against the postcode ranges of all Australian states, see
+    # `postcodes.POSTCODE_RANGES`
+    error = check_postcode(value)
+    if error:
+        raise ValidationError(error)
+
+
+def validate_postcode_state(postcode, state):
+    """Check that a postcode belongs to the given state, the error is
+    reported for the postcode field. Postcodes which don't exist are
+    left to `validate_postcode`.
+    """
+    if state and postcode_state(postcode):
+        error = check_postcode(postcode, state)
+        if error:
+            raise ValidationError({'postcode': error})
 
-    # Check against post code ranges for all Australian states
-    if int_value >= 2000 and int_value <= 2599 or \
-            int_value >= 2619 and int_value <= 2899 or \
-            int_value >= 2921 and int_value <= 2999 or \
-            int_value >= 2600 and int_value <= 2618 or \
-            int_value >= 2900 and int_value <= 2920 or \
-            int_value >= 3000 and int_value <= 3999 or \
-            int_value >= 4000 and int_value <= 4999 or \
-            int_value >= 5000 and int_value <= 5799 or \
-            int_value >= 6000 and int_value <= 6797 or \
-            int_value >= 7000 and int_value <= 7799 or \
-            int_value >= 800 and int_value <= 899:
-        return
 
-    raise ValidationError('Invalid postcode')
\ No newline at end of file
+def validate_location_postcodes(locations):
+    """Check the postcodes of many locations against their states at
+    once, e.g. of locations saved in bulk, which skips validation. The
+    errors are reported by the position of the location.
+    """
+    errors = check_postcodes(
+        [location.postcode for location in locations],
+        [location.state for location in locations],
+    )
+    if errors:
+        raise ValidationError(
+            [
+                f'Location {position}: {error}'
+                for position, error in sorted(errors.items())
+            ]
+        )
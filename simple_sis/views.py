@@ -1,13 +1,58 @@
+import codecs
+import csv
+import json
+from urllib.parse import urlencode
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, resolve_url
-from django.http import Http404
+from django.http import Http404, HttpResponse, JsonResponse
 from django.contrib.auth import (
     authenticate,
     login as django_login,
     logout as django_logout,
 )
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import require_POST
 from django.conf import settings
-from .models import Activity, ActivityAttendee
+from .asynchronous import async_login_required
+from .attendee_import import AttendeeImport
+from .counters import COUNTER_FIELDS
+from .check_in import CheckInError, NotAttending, check_in, sync_check_ins
+from .conditional import activity_version, conditional_page, home_version
+from .exports import (
+    ACTIVITY_HEADER,
+    EXPORT_FORMATS,
+    ROSTER_HEADER,
+    activity_rows,
+    export_response,
+    roster_rows,
+)
+from .live import EVENT_STREAM, attendance_event, event_message
+from .lookups import lookup_codes
+from .models import Activity, ActivityAttendee, LookupCodeType, School
+from .pagination import paginate
+from .spatial import venue_index
+from .throttling import LoginThrottle, login_metrics as current_login_metrics
+from .rosters import (
+    ROSTER_SECTIONS,
+    ROSTER_STATUSES,
+    load_roster,
+    roster_page,
+    roster_queryset,
+)
+
+# Bulk actions on attendees mapped to the queryset methods doing them
+ATTENDEE_ACTIONS = {
+    'approve': 'approve',
+    'attend': 'mark_attended',
+}
+
+# Filters available on the home page activity listing, along with
+# the keyset ordering each of them is paginated by
+ACTIVITY_LISTINGS = {
+    'upcoming': ('start_date', 'id'),
+    'past': ('-start_date', '-id'),
+    'all': ('start_date', 'id'),
+}
 
 
 def login(request):
@@ -18,14 +63,27 @@ def login(request):
         username = request.POST.get('username')
         password = request.POST.get('password')
 
+        # Reject logins of accounts or IPs failing over and over again
+        # before they cost a password hash, see `throttling`
+        throttle = LoginThrottle(request, username)
+        if throttle.is_throttled():
+            context['error'] = (
+                'Too many failed attempts, please try again later.'
+            )
+            response = render(request, 'login.html', context, status=429)
+            response['Retry-After'] = throttle.retry_after
+            return response
+
         user = authenticate(username=username, password=password)
         if user is not None:
+            throttle.succeeded()
             django_login(request, user)
             return redirect(
                 request.GET.get(
                     'next', resolve_url(settings.LOGIN_REDIRECT_URL)
                 )
             )
+        throttle.failed()
 
     return render(request, 'login.html', context)
 
@@ -36,27 +94,81 @@ def logout(request):
     return redirect(resolve_url(settings.LOGOUT_REDIRECT_URL))
 
 
-@login_required
-def home(request):
+def listed_activities(request):
+    """Activities of the user's school, filtered by the `when` and
+    `category` query parameters of the home page listing. Returns the
+    activities along with the filters applied.
+    """
+    when = request.GET.get('when')
+    if when not in ACTIVITY_LISTINGS:
+        when = 'upcoming'
+    try:
+        category = int(request.GET.get('category', ''))
+    except ValueError:
+        category = None
+
+    # Filter by `school_id` rather than going through `user.school`
+    # to save a query fetching the school itself
+    activities = Activity.objects.filter(school_id=request.user.school_id)
+    if when == 'upcoming':
+        activities = activities.upcoming()
+    elif when == 'past':
+        activities = activities.past()
+    if category is not None:
+        activities = activities.filter(category_id=category)
+    return activities, when, category
+
+
+# The pages below are async views, which load and render everything in
+# a single `sync_to_async()` hop, see `asynchronous`
+@async_login_required
+@conditional_page(home_version)
+async def home(request):
     ''''''
+    return await sync_to_async(render_home)(request)
+
+
+def render_home(request):
     user = request.user
-    activities = user.school.activities.all()
+    activities, when, category = listed_activities(request)
+
+    page = paginate(
+        activities.for_listing(),
+        ACTIVITY_LISTINGS[when],
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+
+    filters = {'when': when}
+    if category is not None:
+        filters['category'] = category
 
     context = {
         'page_title': 'Home',
         'h1_title': 'School Activities',
         'user': user,
-        'activities': activities,
+        'activities': page,
+        'when': when,
+        'category': category,
+        'categories': lookup_codes.of_type(LookupCodeType.ACTIVITY_TYPE),
+        'filter_query': urlencode(filters),
     }
 
     return render(request, 'home.html', context)
 
 
-@login_required
-def view_activity(request, id):
+@async_login_required
+@conditional_page(activity_version)
+async def view_activity(request, id):
+    return await sync_to_async(render_activity)(request, id)
+
+
+def render_activity(request, id):
     user = request.user
     try:
-        activity = user.school.activities.get(id=id)
+        activity = Activity.objects.for_listing().get(
+            school_id=user.school_id, id=id
+        )
     except Activity.DoesNotExist:
         raise Http404("Activity does not exist")
 
@@ -65,11 +177,292 @@ def view_activity(request, id):
         'h1_title': f'{activity.name}',
         'user': user,
         'activity': activity,
-        # Normally this would be done with a reverse lookup
-        # but for the save of the challenge we can run a
-        # raw SQL query
-        'organisers': activity.attendees.filter(is_organiser=True),
-        'attendees': activity.attendees.filter(is_organiser=False),
+        'roster': load_roster(activity),
     }
 
-    return render(request, 'activity-view.html', context)
\ No newline at end of file
+    return render(request, 'activity-view.html', context)
+
+
+@async_login_required
+async def live_activity(request, id):
+    """A dashboard of the attendance of an activity, kept up to date by
+    the events of `activity_events`, e.g. for the office during events.
+    """
+    return await sync_to_async(render_live_activity)(request, id)
+
+
+def render_live_activity(request, id):
+    name = Activity.objects.filter(
+        school_id=request.user.school_id, id=id
+    ).values_list('name', flat=True).first()
+    if name is None:
+        raise Http404("Activity does not exist")
+
+    context = {
+        'page_title': f'Live - {name}',
+        'h1_title': name,
+        'user': request.user,
+        'activity_id': id,
+    }
+
+    return render(request, 'activity-live.html', context)
+
+
+@async_login_required
+async def activity_events(request, id):
+    """The attendance of an activity as a single server-sent event,
+    after which browsers reconnect in a few seconds.
+
+    Served over ASGI, `live.LiveEvents` answers these requests with a
+    stream of events instead, this is the fallback having dashboards
+    poll, e.g. under runserver.
+    """
+    event = await sync_to_async(attendance_event)(
+        id, request.user.school_id
+    )
+    if event is None:
+        raise Http404("Activity does not exist")
+    return HttpResponse(event_message(event), content_type=EVENT_STREAM)
+
+
+@async_login_required
+async def activity_roster(request, id, section):
+    """Render a single page of a roster section as a partial HTML
+    fragment, which the activity page appends to its tables.
+    """
+    if section not in ROSTER_SECTIONS:
+        raise Http404("Activity does not exist")
+    return await sync_to_async(render_roster_page)(request, id, section)
+
+
+def render_roster_page(request, id, section):
+    if not Activity.objects.filter(
+        school_id=request.user.school_id, id=id
+    ).exists():
+        raise Http404("Activity does not exist")
+
+    status = request.GET.get('status')
+    if status not in ROSTER_STATUSES:
+        status = None
+    search = request.GET.get('q', '').strip()
+
+    filters = {}
+    if status:
+        filters['status'] = status
+    if search:
+        filters['q'] = search
+
+    context = {
+        'activity_id': id,
+        'section': section,
+        'page': roster_page(
+            id,
+            section,
+            status=status,
+            search=search,
+            after=request.GET.get('after'),
+        ),
+        'filter_query': urlencode(filters),
+    }
+
+    return render(request, 'roster-rows.html', context)
+
+
+@login_required
+def export_roster(request, id, format):
+    """Download the roster of an activity as a CSV or XLSX file,
+    optionally only the attendees with the given `status`. It lists the
+    emails of the attendees, so only those managing the activity may.
+    """
+    name = Activity.objects.managed_by(request.user).filter(
+        id=id
+    ).values_list('name', flat=True).first()
+    if format not in EXPORT_FORMATS or name is None:
+        raise Http404("Activity does not exist")
+
+    return export_response(
+        format,
+        f'{name} roster',
+        ROSTER_HEADER,
+        roster_rows(id, status=request.GET.get('status')),
+    )
+
+
+@login_required
+def export_activities(request, format):
+    """Download the activities of the user's school as a CSV or XLSX
+    file, filtered like the home page listing.
+    """
+    if format not in EXPORT_FORMATS:
+        raise Http404("Unknown export format")
+
+    activities, when, _ = listed_activities(request)
+    return export_response(
+        format,
+        f'{when} activities',
+        ACTIVITY_HEADER,
+        activity_rows(activities, ACTIVITY_LISTINGS[when]),
+    )
+
+
+@login_required
+def nearby_venues(request):
+    """List the venues nearest to the user's school as JSON, e.g. for
+    picking the venue of a new activity.
+
+    Accepts `k`, the number of venues to return (10 by default, from 1
+    to 50), and `radius`, the maximum distance from the school in km.
+    """
+    try:
+        k = int(request.GET.get('k', 10))
+        if k < 1:
+            raise ValueError(k)
+        k = min(k, 50)
+        radius = request.GET.get('radius')
+        radius = float(radius) if radius else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid k or radius'}, status=400)
+
+    coordinates = School.objects.filter(
+        id=request.user.school_id
+    ).values_list('location__latitude', 'location__longitude').first()
+    if coordinates is None or None in coordinates:
+        return JsonResponse({'venues': []})
+
+    return JsonResponse(
+        {
+            'venues': [
+                {
+                    'id': venue.id,
+                    'name': venue.name,
+                    'address': venue.address,
+                    'distance_km': round(distance, 2),
+                } for distance, venue in
+                venue_index.nearest(*coordinates, k=k, radius=radius)
+            ]
+        }
+    )
+
+
+@login_required
+@require_POST
+def import_attendees(request, id):
+    """Import attendees of an activity from a CSV file, uploaded either
+    as the `file` field of a form or as the request body, and report
+    the outcome as JSON. See `attendee_import` for the file format.
+    """
+    if not Activity.objects.managed_by(request.user).filter(id=id).exists():
+        raise Http404("Activity does not exist")
+
+    # Both are read line by line rather than loaded in full
+    upload = request.FILES.get('file', request)
+    try:
+        result = AttendeeImport(id, imported_by=request.user).run(
+            codecs.iterdecode(upload, 'utf-8-sig')
+        )
+    except UnicodeDecodeError:
+        return JsonResponse(
+            {'error': 'The file has to be UTF-8 encoded'}, status=400
+        )
+    except csv.Error:
+        return JsonResponse({'error': 'Invalid CSV file'}, status=400)
+    return JsonResponse(result.as_dict())
+
+
+@login_required
+@require_POST
+def update_attendees(request, id, action):
+    """Approve or mark as attended a selection of attendees of an
+    activity with a single UPDATE, and return the new attendance
+    counters of the activity as JSON.
+
+    Attendees are selected either by their ids, given as `id` fields,
+    or by the same roster `section`, `status` and `q` filters as the
+    activity page, e.g. all pending participants.
+    """
+    if action not in ATTENDEE_ACTIONS or not Activity.objects.managed_by(
+        request.user
+    ).filter(id=id).exists():
+        raise Http404("Activity does not exist")
+
+    ids = request.POST.getlist('id')
+    section = request.POST.get('section')
+    if ids:
+        try:
+            attendees = ActivityAttendee.objects.filter(
+                activity_id=id, id__in=[int(value) for value in ids]
+            )
+        except ValueError:
+            return JsonResponse({'error': 'Invalid attendee id'}, status=400)
+    elif section in ROSTER_SECTIONS:
+        attendees = roster_queryset(
+            id,
+            section,
+            status=request.POST.get('status'),
+            search=request.POST.get('q'),
+        )
+    else:
+        return JsonResponse({'error': 'No attendees selected'}, status=400)
+
+    updated = getattr(attendees, ATTENDEE_ACTIONS[action])(request.user)
+    counts = Activity.objects.filter(id=id).values(*COUNTER_FIELDS).get()
+    return JsonResponse({'updated': updated, 'counts': counts})
+
+
+def json_body(request):
+    """The decoded JSON body of a request, or None if it isn't valid
+    JSON.
+    """
+    try:
+        return json.loads(request.body)
+    except ValueError:
+        return None
+
+
+@login_required
+@require_POST
+def check_in_attendee(request, id):
+    """Check an attendee in to an activity, given the JSON of
+    `{"user": <user id>}` or `{"email": <email>}`. See `check_in`.
+    """
+    if not Activity.objects.managed_by(request.user).filter(id=id).exists():
+        raise Http404("Activity does not exist")
+    body = json_body(request)
+    if not isinstance(body, dict):
+        return JsonResponse({'error': 'Invalid check-in'}, status=400)
+
+    try:
+        attendee = check_in(id, body, request.user)
+    except NotAttending as error:
+        return JsonResponse({'error': str(error)}, status=404)
+    except CheckInError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse({'attendee': attendee})
+
+
+@login_required
+@require_POST
+def sync_attendee_check_ins(request, id):
+    """Apply check-ins recorded offline, given the JSON of
+    `{"check_ins": [{"user": <user id>, "at": <ISO 8601 time>}, ...]}`.
+    See `check_in.sync_check_ins`.
+    """
+    if not Activity.objects.managed_by(request.user).filter(id=id).exists():
+        raise Http404("Activity does not exist")
+    body = json_body(request)
+    if not isinstance(body, dict) or not isinstance(
+        body.get('check_ins'), list
+    ):
+        return JsonResponse({'error': 'Invalid check-ins'}, status=400)
+
+    return JsonResponse(sync_check_ins(id, body['check_ins'], request.user))
+
+
+@login_required
+def login_metrics(request):
+    """Numbers of hashed and rejected logins as JSON, for staff, e.g.
+    to be scraped by monitoring.
+    """
+    if not request.user.is_staff:
+        raise Http404("Page does not exist")
+    return JsonResponse(current_login_metrics())
@@ -0,0 +1,191 @@
+"""A minimal streaming writer of XLSX workbooks.
+
+An XLSX file is a zip archive of XML parts. The fixed parts are tiny,
+and the worksheet is written row by row into a zip entry opened for
+writing, so the workbook never exists in memory as a whole: every
+chunk of rows is compressed and handed out as soon as it's written.
+Zip archives can be written to streams which can't seek, the sizes of
+entries then follow their data instead of preceding it.
+
+Only what exports need is supported: a single worksheet of strings,
+numbers, booleans and dates.
+"""
+import datetime
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from django.utils import timezone
+
+CONTENT_TYPE = (
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+)
+
+CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+    'content-types">'
+    '<Default Extension="rels" ContentType="application/'
+    'vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/'
+    'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType='
+    '"application/'
+    'vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/'
+    'vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+
+RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+    '2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+    'officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+WORKBOOK_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/'
+    '2006/main" xmlns:r="http://schemas.openxmlformats.org/'
+    'officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+WORKBOOK_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+    '2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+    'officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/'
+    'officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+# Cell style 1 formats dates, with the built-in date and time format,
+# which spreadsheet apps show in the format of the user's locale
+STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/'
+    '2006/main">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font>'
+    '</fonts>'
+    '<fills count="2">'
+    '<fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill>'
+    '</fills>'
+    '<borders count="1">'
+    '<border><left/><right/><top/><bottom/><diagonal/></border>'
+    '</borders>'
+    '<cellStyleXfs count="1">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0"/>'
+    '</cellStyleXfs>'
+    '<cellXfs count="2">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" '
+    'applyNumberFormat="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1">'
+    '<cellStyle name="Normal" xfId="0" builtinId="0"/>'
+    '</cellStyles>'
+    '</styleSheet>'
+)
+
+SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/'
+    '2006/main"><sheetData>'
+)
+
+SHEET_END = '</sheetData></worksheet>'
+
+# Characters XML 1.0 doesn't allow, even escaped
+ILLEGAL_CHARACTERS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Characters Excel doesn't allow in sheet names
+INVALID_SHEET_NAME = re.compile(r'[\[\]:*?/\\]')
+
+# Day zero of Excel's date serial numbers
+EPOCH = datetime.datetime(1899, 12, 30)
+
+
+class _Chunks:
+    """A write-only file collecting what's written into it, for the
+    generator to hand out.
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        """Return and forget everything written so far, in a list of at
+        most one chunk of bytes.
+        """
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return [data] if data else []
+
+
+def cell(value):
+    if value is None or value == '':
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c><v>{value}</v></c>'
+    if isinstance(value, datetime.datetime):
+        if timezone.is_aware(value):
+            value = timezone.make_naive(value)
+        days = (value - EPOCH) / datetime.timedelta(days=1)
+        return f'<c s="1"><v>{days:.6f}</v></c>'
+    value = ILLEGAL_CHARACTERS.sub('', escape(str(value)))
+    return f'<c t="inlineStr"><is><t>{value}</t></is></c>'
+
+
+def row(values):
+    return f'<row>{"".join(map(cell, values))}</row>'
+
+
+def stream_xlsx(header, chunks, sheet_name='Sheet1'):
+    """Yield the bytes of a workbook with a single worksheet, holding
+    the `header` row followed by the rows of every chunk of `chunks`.
+    """
+    output = _Chunks()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES_XML)
+        archive.writestr('_rels/.rels', RELS_XML)
+        archive.writestr(
+            'xl/workbook.xml',
+            WORKBOOK_XML.format(
+                name=escape(
+                    INVALID_SHEET_NAME.sub(' ', sheet_name)[:31],
+                    {'"': '&quot;'},
+                )
+            ),
+        )
+        archive.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS_XML)
+        archive.writestr('xl/styles.xml', STYLES_XML)
+        yield from output.take()
+
+        with archive.open(
+            'xl/worksheets/sheet1.xml', 'w', force_zip64=True
+        ) as sheet:
+            sheet.write((SHEET_START + row(header)).encode())
+            for chunk in chunks:
+                sheet.write(''.join(map(row, chunk)).encode())
+                yield from output.take()
+            sheet.write(SHEET_END.encode())
+    yield from output.take()